@@ -11,7 +11,9 @@ __all__ = [
     "bettingmarketgroup",
     "block",
     "blockchain",
+    "blockstore",
     "committee",
+    "cursor",
     "event",
     "eventgroup",
     "exceptions",
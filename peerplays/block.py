@@ -8,6 +8,9 @@ class Block(dict):
 
         :param int block: block number
         :param peerplays.peerplays.PeerPlays peerplays_instance: PeerPlays instance
+        :param bool header_only: Only obtain the block header (timestamp,
+            witness, previous block id, Merkle root) without the
+            transactions and the witness signature
 
         Instances of this class are dictionaries that come with additional
         methods (see below) that allow dealing with a block and it's
@@ -28,9 +31,11 @@ class Block(dict):
         self,
         block,
         peerplays_instance=None,
+        header_only=False,
     ):
         self.peerplays = peerplays_instance or shared_peerplays_instance()
         self.block = block
+        self.header_only = header_only
 
         if isinstance(block, Block):
             super(Block, self).__init__(block)
@@ -41,7 +46,10 @@ class Block(dict):
         """ Even though blocks never change, you freshly obtain its contents
             from an API with this method
         """
-        block = self.peerplays.rpc.get_block(self.block)
+        if self.header_only:
+            block = self.peerplays.rpc.get_block_header(self.block)
+        else:
+            block = self.peerplays.rpc.get_block(self.block)
         if not block:
             raise BlockDoesNotExistsException
         super(Block, self).__init__(block)
@@ -50,3 +58,26 @@ class Block(dict):
         """ Return a datatime instance for the timestamp of this block
         """
         return parse_time(self['timestamp'])
+
+
+class BlockHeader(Block):
+    """ Read the header of a single block from the chain
+
+        :param int block: block number
+        :param peerplays.peerplays.PeerPlays peerplays_instance: PeerPlays instance
+
+        Same as :class:`Block` with ``header_only=True``:
+
+        .. code-block:: python
+
+            from peerplays.block import BlockHeader
+            header = BlockHeader(1)
+            print(header["witness"], header.time())
+    """
+    def __init__(
+        self,
+        block,
+        peerplays_instance=None,
+    ):
+        super(BlockHeader, self).__init__(
+            block, peerplays_instance=peerplays_instance, header_only=True)
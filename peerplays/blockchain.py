@@ -1,8 +1,235 @@
+import os
 import time
-from .block import Block
+import queue
+import logging
+import threading
+import calendar
+import collections
+from concurrent import futures
+from .block import Block, BlockHeader
+from .blockstore import BlockStore
+from .exceptions import BlockStoreCorruptException
+from .cursor import Cursor
+from peerplaysapi.websocket import PeerPlaysWebsocket
+from peerplaysapi.pool import PooledNodeRPC
 from peerplays.instance import shared_peerplays_instance
-from .utils import parse_time
-from peerplaysbase.operationids import operations, getOperationNameForId
+from .utils import parse_time, formatTimeString
+from peerplaysbase.operationids import (
+    getOperationNameForId, getOperationIdsForNames)
+
+log = logging.getLogger(__name__)
+
+
+class BlockNotifier(object):
+    """ Wakes up waiting threads as soon as the node has applied a block
+
+        :param list urls: Websocket URLs of the nodes
+        :param str user: Username for Authentication
+        :param str password: Password for Authentication
+
+        The notifications are received on a
+        :class:`peerplaysapi.websocket.PeerPlaysWebsocket` running in a
+        background thread.
+    """
+    def __init__(self, urls, user="", password=""):
+        self.condition = threading.Condition()
+        self.head_block_number = 0
+        self.ws = PeerPlaysWebsocket(
+            urls, user, password,
+            on_block=self.on_block,
+            replay_blocks=False)
+        self.thread = threading.Thread(
+            target=self.ws.run_forever, name="block notifier")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def on_block(self, block_id):
+        with self.condition:
+            self.head_block_number = max(
+                self.head_block_number, int(block_id[:8], 16))
+            self.condition.notify_all()
+
+    def wait(self, seen, timeout):
+        """ Wait until a block newer than ``seen`` has been applied, at
+            most ``timeout`` seconds. Returns the newest block number
+            notified so far.
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.head_block_number > seen, timeout)
+            return self.head_block_number
+
+    def close(self):
+        self.ws.close()
+
+
+class ReversibleBlocks(object):
+    """ Keeps the blocks that are not irreversible yet and tells apart
+        blocks to apply, blocks to undo because they have been orphaned
+        by a micro-fork, and blocks that became irreversible
+
+        :param rpc: Connection to obtain blocks from
+        :param int start: First block
+
+        Block ids are not part of the blocks. The id of a block is taken
+        from the ``previous`` field of its successor, or, for the head
+        block, from the dynamic global properties (if the block has the
+        head block's timestamp and witness).
+    """
+    def __init__(self, rpc, start):
+        self.rpc = rpc
+        self.next_num = start
+        self.blocks = []
+        self.ids = dict()
+
+    def get_block(self, block_num):
+        block = self.rpc.get_block(block_num)
+        if block:
+            block["block_num"] = block_num
+        return block
+
+    def is_head(self, block, info):
+        """ Has ``block`` the timestamp and witness of the head block?
+        """
+        return block["timestamp"] == info.get("time") and block["witness"] == info.get("current_witness")
+
+    def apply(self, block):
+        block_num = block["block_num"]
+        if self.blocks and self.blocks[-1]["block_num"] == block_num - 1:
+            self.ids[block_num - 1] = block["previous"]
+        self.blocks.append(block)
+        self.next_num = block_num + 1
+        return ("apply", block)
+
+    def undo(self):
+        block = self.blocks.pop()
+        self.ids.pop(block["block_num"], None)
+        self.next_num = block["block_num"]
+        return ("undo", block)
+
+    def reorg(self, block):
+        """ ``block`` is part of the chain, but does not fit onto our
+            blocks: undo our blocks down to the fork and apply the ones of
+            the chain instead
+        """
+        events = []
+        while self.blocks and self.blocks[-1]["block_num"] >= block["block_num"]:
+            events.append(self.undo())
+        chain = [block]
+        while self.blocks and self.ids.get(self.blocks[-1]["block_num"]) != chain[-1]["previous"]:
+            events.append(self.undo())
+            replacement = self.get_block(self.next_num)
+            if not replacement:
+                break
+            chain.append(replacement)
+        for replacement in reversed(chain):
+            events.append(self.apply(replacement))
+        return events
+
+    def update(self, info, stop=None):
+        """ Returns the events to catch up with the chain described by the
+            dynamic global properties ``info``
+        """
+        events = []
+        head = info["head_block_number"]
+        tip = [x for x in self.blocks if x["block_num"] == head]
+        if tip:
+            tip = tip[0]
+            known = self.ids.get(head)
+            if known is None and self.is_head(tip, info):
+                known = self.ids[head] = info["head_block_id"]
+            if known != info["head_block_id"]:
+                block = self.get_block(head)
+                if block:
+                    events.extend(self.reorg(block))
+            # The chain got shorter
+            while self.blocks and self.blocks[-1]["block_num"] > head:
+                events.append(self.undo())
+
+        if stop:
+            head = min(head, stop)
+        while self.next_num <= head:
+            block = self.get_block(self.next_num)
+            if not block:
+                break
+            last = self.ids.get(self.next_num - 1)
+            if last is not None and last != block["previous"]:
+                events.extend(self.reorg(block))
+            else:
+                events.append(self.apply(block))
+
+        if self.blocks and self.blocks[-1]["block_num"] == info["head_block_number"]:
+            tip = self.blocks[-1]
+            if self.is_head(tip, info):
+                self.ids.setdefault(tip["block_num"], info["head_block_id"])
+        return events
+
+    def release(self, last_irreversible_block_num):
+        """ Returns the events for blocks that became irreversible
+        """
+        events = []
+        while self.blocks and self.blocks[0]["block_num"] <= last_irreversible_block_num:
+            block = self.blocks.pop(0)
+            self.ids.pop(block["block_num"] - 1, None)
+            events.append(("irreversible", block))
+        return events
+
+
+#: Fields of a block header
+header_fields = [
+    "previous", "timestamp", "witness", "transaction_merkle_root",
+    "extensions", "block_num",
+]
+
+
+def timestamp(block_time):
+    """ Seconds since epoch of a time string of the blockchain
+    """
+    return calendar.timegm(parse_time(block_time).timetuple())
+
+
+#: Connections of a :meth:`Blockchain.scan` worker process, by
+#: ``(rpc_class, urls, user, password)``
+scan_rpcs = dict()
+
+
+def get_scan_rpc(connection):
+    """ Return the connection of a :meth:`Blockchain.scan` worker
+        process, opening it with the first chunk
+    """
+    if connection not in scan_rpcs:
+        rpc_class, urls, user, password = connection
+        scan_rpcs[connection] = rpc_class(list(urls), user, password, lazy=True)
+    return scan_rpcs[connection]
+
+
+def scan_chunk(connection, start, stop, function=None, prefetch=50):
+    """ Obtain the blocks ``start`` to ``stop`` (inclusive) in a worker
+        process and return their operations, in the format of
+        :meth:`Blockchain.ops`, mapped through ``function``
+
+        :param tuple connection: ``(rpc_class, urls, user, password)``
+            of the node connection
+    """
+    rpc = get_scan_rpc(connection)
+    results = []
+    for i in range(start, stop + 1, prefetch):
+        nums = range(i, min(i + prefetch, stop + 1))
+        blocks = rpc.pipeline([("get_block", [n]) for n in nums])
+        for blocknum, block in zip(nums, blocks):
+            for tx in block["transactions"]:
+                for op in tx["operations"]:
+                    op = {
+                        "block_num": blocknum,
+                        "op": [getOperationNameForId(op[0]), op[1]],
+                        "timestamp": block["timestamp"]
+                    }
+                    if function is not None:
+                        op = function(op)
+                        if op is None:
+                            continue
+                    results.append(op)
+    return results
 
 
 class Blockchain(object):
@@ -11,16 +238,27 @@ class Blockchain(object):
 
         :param peerplays.peerplays.PeerPlays peerplays_instance: PeerPlays instance
         :param str mode: (default) Irreversible block (``irreversible``) or actual head block (``head``)
+        :param blockstore: Local block archive
+            (:class:`peerplays.blockstore.BlockStore`, or the directory of
+            one) that blocks are read from if stored, and that
+            irreversible blocks obtained from the node are appended to
 
         This class let's you deal with blockchain related data and methods.
     """
     def __init__(
         self,
         peerplays_instance=None,
-        mode="irreversible"
+        mode="irreversible",
+        blockstore=None,
     ):
         self.peerplays = peerplays_instance or shared_peerplays_instance()
 
+        if isinstance(blockstore, str):
+            blockstore = BlockStore(
+                blockstore,
+                chain_id=self.peerplays.rpc.chain_params["chain_id"])
+        self.blockstore = blockstore
+
         if mode == "irreversible":
             self.mode = 'last_irreversible_block_num'
         elif mode == "head":
@@ -65,13 +303,18 @@ class Blockchain(object):
         """
         return self.info().get(self.mode)
 
-    def get_current_block(self):
+    def get_current_block(self, header_only=False):
         """ This call returns the current block
 
+            :param bool header_only: Only obtain the block header
+
             .. note:: The block number returned depends on the ``mode`` used
                       when instanciating from this class.
         """
-        return Block(self.get_current_block_num())
+        return Block(
+            self.get_current_block_num(),
+            peerplays_instance=self.peerplays,
+            header_only=header_only)
 
     def block_time(self, block_num):
         """ Returns a datetime of the block with the given block
@@ -79,7 +322,7 @@ class Blockchain(object):
 
             :param int block_num: Block number
         """
-        return Block(block_num).time()
+        return BlockHeader(block_num, peerplays_instance=self.peerplays).time()
 
     def block_timestamp(self, block_num):
         """ Returns the timestamp of the block with the given block
@@ -87,13 +330,91 @@ class Blockchain(object):
 
             :param int block_num: Block number
         """
-        return int(Block(block_num).time().timestamp())
-
-    def blocks(self, start=None, stop=None):
+        return timestamp(
+            BlockHeader(block_num, peerplays_instance=self.peerplays)["timestamp"])
+
+    def get_block_num_at(self, when, index=None):
+        """ Returns the number of the last block produced not after
+            ``when``, i.e. the head block at that time
+
+            :param datetime when: Time (UTC), or a string such as
+                ``2018-05-01T12:00:00``
+            :param index: Sparse index of block timestamps that is used
+                and extended by the lookups (defaults to the SQLite3
+                database, :class:`peerplays.storage.BlockTimestamps`)
+            :raises ValueError: if ``when`` is before the first block
+
+            The block is found with an interpolation search on the block
+            timestamps. Since blocks are ``block_interval`` seconds
+            apart (or more, if blocks have been missed), the search
+            usually needs a handful of ``get_block_header`` calls. The
+            timestamps of irreversible blocks visited along the way are
+            kept in ``index``, so that later lookups start from a narrow
+            range.
+        """
+        if isinstance(when, str):
+            when = formatTimeString(when)
+        target = calendar.timegm(when.utctimetuple())
+        if index is None:
+            from .storage import blockTimestampStorage
+            index = blockTimestampStorage
+        chain_id = self.peerplays.rpc.chain_params["chain_id"]
+        info = self.info()
+        irreversible = info["last_irreversible_block_num"]
+        head = (info["head_block_number"], timestamp(info["time"]))
+        if target >= head[1]:
+            return head[0]
+        interval = self.chainParameters().get("block_interval") or 1
+
+        def probe(block_num):
+            header = self.peerplays.rpc.get_block_header(block_num)
+            if not header:
+                raise ValueError("Block %d does not exist" % block_num)
+            block = (block_num, timestamp(header["timestamp"]))
+            if block_num <= irreversible:
+                index.add(chain_id, block_num, block[1])
+            return block
+
+        low, high = index.bracket(chain_id, target)
+        if not high or high[0] > head[0]:
+            high = head
+        if not low:
+            low = probe(1)
+            if low[1] > target:
+                raise ValueError("%s is before the first block" % when)
+
+        bisect = False
+        while high[0] - low[0] > 1 and low[1] != target:
+            if bisect:
+                guess = (low[0] + high[0]) // 2
+            else:
+                guess = low[0] + (target - low[1]) * (high[0] - low[0]) // (high[1] - low[1])
+            # Blocks are at least one interval apart
+            guess = min(guess, low[0] + (target - low[1]) // interval)
+            guess = max(low[0] + 1, min(high[0] - 1, guess))
+            span = high[0] - low[0]
+            block = probe(guess)
+            if block[1] <= target:
+                low = block
+            else:
+                high = block
+            # Fall back to bisection while interpolation converges slowly
+            bisect = not bisect and high[0] - low[0] > span // 2
+        return low[0]
+
+    def blocks(self, start=None, stop=None, prefetch=1, push=False, header_only=False):
         """ Yields blocks starting from ``start``.
 
             :param int start: Starting block
             :param int stop: Stop at this block
+            :param int prefetch: Number of blocks to obtain at once while
+                catching up (defaults to ``1``). Blocks are still yielded
+                in order.
+            :param bool push: Once caught up, wait for block notifications
+                of the node instead of polling once per block interval.
+                Polling is kept as a fallback if notifications stop.
+            :param bool header_only: Only obtain the block headers (see
+                :meth:`block_headers`)
             :param str mode: We here have the choice between
                  * "head": the last block
                  * "irreversible": the block that is confirmed by 2/3 of all block producers and is thus irreversible!
@@ -104,28 +425,230 @@ class Blockchain(object):
         if not start:
             start = self.get_current_block_num()
 
-        # We are going to loop indefinitely
-        while True:
+        notifier = None
+        if push:
+            rpc = self.peerplays.rpc
+            notifier = BlockNotifier(rpc.url_list, rpc.user, rpc.password)
+        seen = 0
+
+        try:
+            # We are going to loop indefinitely
+            while True:
+
+                # Get chain properies to identify the
+                info = self.info()
+                head_block = info.get(self.mode)
+                if stop:
+                    head_block = min(head_block, stop)
+
+                # Blocks from start until head block
+                for block in self.block_range(
+                    start, head_block,
+                    prefetch=prefetch,
+                    header_only=header_only,
+                    irreversible=info["last_irreversible_block_num"],
+                ):
+                    yield block
+                # Set new start
+                start = max(start, head_block + 1)
+
+                if stop and start > stop:
+                    return
+
+                if notifier:
+                    # Wake up as soon as the next block has been applied
+                    seen = notifier.wait(seen, block_interval)
+                else:
+                    # Sleep for one block
+                    time.sleep(block_interval)
+        finally:
+            if notifier:
+                notifier.close()
+
+    def block_headers(self, start=None, stop=None, **kwargs):
+        """ Yields block headers starting from ``start``. Headers carry
+            the ``timestamp``, ``witness``, ``previous`` block id and
+            Merkle root of a block, but neither its transactions nor its
+            signature, and are hence much cheaper to obtain.
+
+            :param int start: Starting block
+            :param int stop: Stop at this block
+
+            All other arguments (``prefetch``, ``push``) are those of
+            :meth:`blocks`.
 
-            # Get chain properies to identify the
-            head_block = self.get_current_block_num()
+            .. code-block:: python
 
-            # Blocks from start until head block
-            for blocknum in range(start, head_block + 1):
+                for header in chain.block_headers(start=1000000, stop=1100000, prefetch=100):
+                    print(header["block_num"], header["witness"])
+        """
+        return self.blocks(start=start, stop=stop, header_only=True, **kwargs)
+
+    def head_blocks(self, start=None, stop=None, push=False):
+        """ Yields ``(action, block)`` tuples following the head block,
+            where ``action`` is
+
+            * ``apply``: a new head block,
+            * ``undo``: a block that has been applied before, but has been
+              orphaned by a micro-fork. Undo events come newest first and
+              are followed by the blocks that replace them,
+            * ``irreversible``: a block that has been applied before and
+              cannot be undone anymore.
+
+            :param int start: Starting block
+            :param int stop: Stop once this block is irreversible
+            :param bool push: Wait for block notifications instead of
+                polling (see :meth:`blocks`)
+
+            .. code-block:: python
+
+                for action, block in chain.head_blocks():
+                    if action == "apply":
+                        show_odds(block)
+                    elif action == "undo":
+                        revert_odds(block)
+                    elif action == "irreversible":
+                        settle(block)
+        """
+        block_interval = self.chainParameters().get("block_interval")
+        if not start:
+            start = self.info()["head_block_number"]
+        blocks = ReversibleBlocks(self.peerplays.rpc, start)
+
+        notifier = None
+        if push:
+            rpc = self.peerplays.rpc
+            notifier = BlockNotifier(rpc.url_list, rpc.user, rpc.password)
+        seen = 0
+
+        try:
+            while True:
+                info = self.info()
+                for event in blocks.update(info, stop=stop):
+                    yield event
+                for event in blocks.release(info["last_irreversible_block_num"]):
+                    yield event
+
+                if stop and blocks.next_num > stop and not blocks.blocks:
+                    return
+
+                if notifier:
+                    seen = notifier.wait(seen, block_interval)
+                else:
+                    time.sleep(block_interval)
+        finally:
+            if notifier:
+                notifier.close()
+
+    def block_range(self, start, stop, prefetch=1, header_only=False, irreversible=None):
+        """ Yields the blocks ``start`` to ``stop`` (inclusive) in order
+
+            :param int start: First block
+            :param int stop: Last block
+            :param int prefetch: Number of blocks to obtain at once
+            :param bool header_only: Only obtain the block headers
+            :param int irreversible: Number of the last irreversible block,
+                if known (otherwise, it is obtained from the node when
+                needed)
+
+            With ``prefetch``, a background thread obtains the next blocks
+            with pipelined ``get_block`` calls while the current ones are
+            being processed. At most about twice ``prefetch`` blocks are
+            held in memory.
+
+            With a ``blockstore``, stored blocks are read from it. Blocks
+            obtained from the node are appended to it if they are
+            irreversible and follow the last stored block. Corrupt stored
+            blocks are obtained from the node instead.
+        """
+        store = self.blockstore
+        if store is None:
+            for block in self.fetch_block_range(start, stop, prefetch, header_only):
+                yield block
+            return
+
+        while start <= stop and start in store:
+            try:
+                block = store.get(start)
+            except BlockStoreCorruptException as e:
+                log.warning("%s, obtaining it from the node" % str(e))
+                block = next(self.fetch_block_range(start, start, header_only=header_only))
+            if header_only:
+                block = {
+                    key: value for key, value in block.items()
+                    if key in header_fields
+                }
+            block.update({"block_num": start})
+            yield block
+            start += 1
+        if start > stop:
+            return
+
+        if irreversible is None:
+            irreversible = self.info()["last_irreversible_block_num"]
+        blocks = self.fetch_block_range(start, stop, prefetch, header_only)
+        try:
+            for block in blocks:
+                blocknum = block["block_num"]
+                archive = blocknum == store.head + 1 and blocknum <= irreversible
+                if archive and not header_only:
+                    # Before the block is handed out and possibly modified
+                    store.append(blocknum, block)
+                yield block
+        finally:
+            blocks.close()
+
+    def fetch_block_range(self, start, stop, prefetch=1, header_only=False):
+        """ Same as :meth:`block_range`, but always obtains the blocks
+            from the node
+        """
+        method = "get_block_header" if header_only else "get_block"
+        if prefetch <= 1 or stop <= start:
+            for blocknum in range(start, stop + 1):
                 # Get full block
-                block = self.peerplays.rpc.get_block(blocknum)
+                block = getattr(self.peerplays.rpc, method)(blocknum)
                 block.update({"block_num": blocknum})
                 yield block
-            # Set new start
-            start = head_block + 1
-
-            if stop and start > stop:
-                raise StopIteration
-
-            # Sleep for one block
-            time.sleep(block_interval)
+            return
+
+        blocks = queue.Queue(maxsize=prefetch)
+        done = threading.Event()
+
+        def put(item):
+            while not done.is_set():
+                try:
+                    blocks.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def fetch():
+            try:
+                for i in range(start, stop + 1, prefetch):
+                    nums = range(i, min(i + prefetch, stop + 1))
+                    chunk = self.peerplays.rpc.pipeline(
+                        [(method, [blocknum]) for blocknum in nums])
+                    for blocknum, block in zip(nums, chunk):
+                        block.update({"block_num": blocknum})
+                        if not put(block):
+                            return
+            except Exception as e:
+                put(e)
+
+        thread = threading.Thread(target=fetch, name="prefetch blocks")
+        thread.daemon = True
+        thread.start()
+        try:
+            for _ in range(start, stop + 1):
+                block = blocks.get()
+                if isinstance(block, Exception):
+                    raise block
+                yield block
+        finally:
+            done.set()
 
-    def ops(self, start=None, stop=None, **kwargs):
+    def ops(self, start=None, stop=None, cursor=None, opNames=None, **kwargs):
         """ Yields all operations (including virtual operations) starting from ``start``.
 
             :param int start: Starting block
@@ -134,21 +657,151 @@ class Blockchain(object):
                  * "head": the last block
                  * "irreversible": the block that is confirmed by 2/3 of all block producers and is thus irreversible!
             :param bool only_virtual_ops: Only yield virtual operations
+            :param int prefetch: Number of blocks to obtain at once (see
+                :meth:`blocks`)
+            :param bool push: Wait for block notifications instead of
+                polling (see :meth:`blocks`)
+            :param cursor: Name of a cursor or
+                :class:`peerplays.cursor.Cursor` to resume from (instead of
+                ``start``) and to record the progress in
+            :param array opNames: Only yield operations of these types.
+                Other operations are skipped by their id, before anything
+                is built for them.
 
             This call returns a list that only carries one operation and
             its type!
         """
+        if isinstance(cursor, str):
+            cursor = Cursor(cursor)
+        skip = 0
+        if cursor is not None and cursor.block_num is not None:
+            start = cursor.block_num
+            skip = cursor.op_index
+
+        op_ids = None
+        if opNames:
+            op_ids = getOperationIdsForNames(opNames)
+
+        blocks = self.blocks(start=start, stop=stop, **kwargs)
+        try:
+            for block in blocks:
+                op_index = 0
+                for tx in block["transactions"]:
+                    for op in tx["operations"]:
+                        if skip and block["block_num"] == start and op_index < skip:
+                            # Processed before
+                            op_index += 1
+                            continue
+                        if op_ids is not None and op[0] not in op_ids:
+                            op_index += 1
+                            continue
+                        # Replace opid by op name
+                        op[0] = getOperationNameForId(op[0])
+                        if cursor is not None:
+                            cursor.delivered = (block["block_num"], op_index + 1)
+                        yield {
+                            "block_num": block["block_num"],
+                            "op": op,
+                            "timestamp": block["timestamp"]
+                        }
+                        op_index += 1
+                        if cursor is not None:
+                            cursor.advance(block["block_num"], op_index)
+                if cursor is not None:
+                    cursor.advance(block["block_num"] + 1, 0)
+        finally:
+            blocks.close()
+            if cursor is not None:
+                cursor.commit()
+
+    def scan(
+        self,
+        start=1,
+        stop=None,
+        function=None,
+        workers=None,
+        ordered=True,
+        chunk_size=1000,
+        prefetch=50,
+    ):
+        """ Yields the operations of a (large) range of historical
+            blocks, which are obtained and decoded by a pool of worker
+            processes
 
-        for block in self.blocks(start=start, stop=stop, **kwargs):
-            for tx in block["transactions"]:
-                for op in tx["operations"]:
-                    # Replace opid by op name
-                    op[0] = getOperationNameForId(op[0])
-                    yield {
-                        "block_num": block["block_num"],
-                        "op": op,
-                        "timestamp": block["timestamp"]
-                    }
+            :param int start: Starting block
+            :param int stop: Last block (defaults to the current block,
+                see ``mode``)
+            :param fnt function: Called in the worker processes with each
+                operation (as yielded by :meth:`ops`). Whatever it returns
+                is yielded instead, unless it returns ``None``, in which
+                case the operation is dropped. Must be picklable, i.e.
+                defined at module level.
+            :param int workers: Number of worker processes (defaults to
+                the number of CPUs)
+            :param bool ordered: Yield the operations in the order of the
+                chain. With ``False``, the operations of each chunk are
+                yielded as soon as the chunk is done, which keeps all
+                workers busy even if some chunks take longer.
+            :param int chunk_size: Number of blocks per chunk
+            :param int prefetch: Number of blocks each worker obtains at
+                once
+
+            .. code-block:: python
+
+                def large_bets(op):
+                    if op["op"][0] == "bet_place" and op["op"][1]["amount_to_bet"]["amount"] > 10 ** 8:
+                        return op["block_num"], op["op"][1]["bettor_id"]
+
+                for block_num, bettor in chain.scan(1, 1000000, function=large_bets, workers=8):
+                    print(block_num, bettor)
+
+            Each worker opens its own connection. Only what ``function``
+            returns is handed back to this process.
+        """
+        if stop is None:
+            stop = self.get_current_block_num()
+        rpc = self.peerplays.rpc
+        if isinstance(rpc, PooledNodeRPC):
+            rpc_class = rpc.rpc_class
+        else:
+            rpc_class = rpc.__class__
+        chunks = iter([
+            (i, min(i + chunk_size - 1, stop))
+            for i in range(start, stop + 1, chunk_size)])
+        if not workers:
+            workers = os.cpu_count() or 1
+        connection = (rpc_class, tuple(rpc.url_list), rpc.user, rpc.password)
+        executor = futures.ProcessPoolExecutor(max_workers=workers)
+        # Keep every worker busy without queueing up all chunks at once
+        max_pending = 2 * workers
+        pending = collections.deque()
+
+        def submit():
+            while len(pending) < max_pending:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    return
+                pending.append(executor.submit(
+                    scan_chunk, connection, chunk[0], chunk[1], function, prefetch))
+
+        try:
+            submit()
+            while pending:
+                if ordered:
+                    done = pending.popleft()
+                else:
+                    done = next(futures.as_completed(pending))
+                    pending.remove(done)
+                results = done.result()
+                submit()
+                for result in results:
+                    yield result
+        finally:
+            # If the caller stops early, do not wait for the chunks that
+            # are being obtained already
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=not pending)
 
     def stream(self, opNames=[], *args, **kwargs):
         """ Yield specific operations (e.g. comments) only
@@ -156,6 +809,13 @@ class Blockchain(object):
             :param array opNames: List of operations to filter for
             :param int start: Start at this block
             :param int stop: Stop at this block
+            :param int prefetch: Number of blocks to obtain at once (see
+                :meth:`blocks`)
+            :param bool push: Wait for block notifications instead of
+                polling (see :meth:`blocks`)
+            :param cursor: Name of a cursor or
+                :class:`peerplays.cursor.Cursor` to resume from (see
+                :meth:`ops`)
             :param str mode: We here have the choice between
                  * "head": the last block
                  * "irreversible": the block that is confirmed by 2/3 of all block producers and is thus irreversible!
@@ -165,8 +825,9 @@ class Blockchain(object):
             block the operation was stored in and the other key depend
             on the actualy operation.
         """
-        for op in self.ops(**kwargs):
-            if not opNames or op["op"][0] in opNames:
+        ops = self.ops(opNames=opNames, **kwargs)
+        try:
+            for op in ops:
                 r = {
                     "type": op["op"][0],
                     "timestamp": op.get("timestamp"),
@@ -174,6 +835,8 @@ class Blockchain(object):
                 }
                 r.update(op["op"][1])
                 yield r
+        finally:
+            ops.close()
 
     def awaitTxConfirmation(self, transaction, limit=50):
         """ Returns the transaction as seen by the blockchain after being included into a block
@@ -212,9 +875,9 @@ class Blockchain(object):
             for account in ret:
                 yield account[0]
                 if account[0] == stop:
-                    raise StopIteration
+                    return
             if lastname == ret[-1][0]:
-                raise StopIteration
+                return
             lastname = ret[-1][0]
             if len(ret) < steps:
-                raise StopIteration
+                return
@@ -0,0 +1,229 @@
+import os
+import mmap
+import zlib
+import struct
+import logging
+import threading
+from peerplaysapi.codec import get_codec
+from .storage import DataDir
+from .exceptions import BlockStoreCorruptException
+
+log = logging.getLogger(__name__)
+
+#: Entry of the index per block: offset and length of the compressed
+#: block in the segment file, and the CRC32 of the compressed block
+index_entry = struct.Struct("<QII")
+
+
+class BlockStore(object):
+    """ Local append-only archive of blocks
+
+        :param str path: Directory of the archive (defaults to
+            ``blocks/`` in the user's data directory)
+        :param str chain_id: Chain id of the network. It is recorded
+            with the first call and compared on later ones, so that
+            blocks of different networks are not mixed up.
+        :param str codec: Codec to serialize blocks with (see
+            :mod:`peerplaysapi.codec`)
+        :param int level: zlib compression level
+
+        Blocks are stored compressed, one after the other, in the segment
+        file ``blocks.dat``. The index file ``blocks.idx`` holds an entry
+        of fixed width per block number (see ``index_entry``) and is
+        memory-mapped, so that any block is found without a search.
+        Blocks can only be appended in order, starting with block ``1``,
+        and should be irreversible. Segment data is written before its
+        index entry, hence an interrupted write is dropped when the
+        archive is opened next.
+
+        .. code-block:: python
+
+            from peerplays.blockstore import BlockStore
+            from peerplays.blockchain import Blockchain
+
+            chain = Blockchain(blockstore=BlockStore())
+            for block in chain.blocks(start=1, stop=1000000, prefetch=100):
+                ...
+
+        An archive must not be written to by several processes at once.
+    """
+    data_file = "blocks.dat"
+    index_file = "blocks.idx"
+    chain_file = "chain_id"
+
+    def __init__(self, path=None, chain_id=None, codec=None, level=6):
+        if path is None:
+            path = os.path.join(DataDir.data_dir, "blocks")
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.codec = get_codec(codec)
+        self.level = level
+        self.lock = threading.RLock()
+        self.map = None
+        self.mapped = 0
+        if chain_id:
+            self.check_chain_id(chain_id)
+        self.data = open(os.path.join(path, self.data_file), "a+b")
+        self.index = open(os.path.join(path, self.index_file), "a+b")
+        self.recover()
+
+    def __repr__(self):
+        return "<BlockStore %s with %d blocks>" % (self.path, self.head)
+
+    def __contains__(self, block_num):
+        return 1 <= block_num <= self.head
+
+    def check_chain_id(self, chain_id):
+        """ Make sure the archive holds blocks of the network ``chain_id``
+        """
+        filename = os.path.join(self.path, self.chain_file)
+        if os.path.exists(filename):
+            with open(filename) as fp:
+                stored = fp.read().strip()
+            if stored != chain_id:
+                raise ValueError(
+                    "Block store %s holds blocks of chain %s" % (self.path, stored))
+        else:
+            with open(filename, "w") as fp:
+                fp.write(chain_id)
+
+    def recover(self):
+        """ Drop incomplete writes, e.g. after a crash
+        """
+        with self.lock:
+            self.index.seek(0, os.SEEK_END)
+            count = self.index.tell() // index_entry.size
+            self.data.seek(0, os.SEEK_END)
+            data_size = self.data.tell()
+            end = 0
+            while count:
+                self.index.seek((count - 1) * index_entry.size)
+                offset, length, _ = index_entry.unpack(
+                    self.index.read(index_entry.size))
+                if offset + length <= data_size:
+                    end = offset + length
+                    break
+                count -= 1
+            self.resize(count, end)
+
+    def resize(self, count, end):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+            self.mapped = 0
+        if self.index.seek(0, os.SEEK_END) != count * index_entry.size:
+            log.warning("Dropping block store index beyond block %d" % count)
+            self.index.truncate(count * index_entry.size)
+        if self.data.seek(0, os.SEEK_END) != end:
+            log.warning("Dropping block store data beyond block %d" % count)
+            self.data.truncate(end)
+        self.count = count
+
+    @property
+    def head(self):
+        """ Number of the last stored block
+        """
+        return self.count
+
+    def entry(self, block_num):
+        """ Returns the index entry ``(offset, length, crc32)`` of a block
+        """
+        if block_num > self.mapped:
+            if self.map is not None:
+                self.map.close()
+            self.map = mmap.mmap(self.index.fileno(), 0, access=mmap.ACCESS_READ)
+            self.mapped = len(self.map) // index_entry.size
+        return index_entry.unpack_from(self.map, (block_num - 1) * index_entry.size)
+
+    def read(self, block_num):
+        """ Returns the compressed block and its checksum from the index
+        """
+        with self.lock:
+            offset, length, crc = self.entry(block_num)
+            self.data.seek(offset)
+            return self.data.read(length), crc
+
+    def get(self, block_num):
+        """ Returns a block, or ``None`` if it is not stored
+
+            :param int block_num: Block number
+            :raises peerplays.exceptions.BlockStoreCorruptException: if
+                the stored block does not match its checksum or cannot
+                be decoded
+        """
+        if block_num not in self:
+            return None
+        raw, crc = self.read(block_num)
+        if zlib.crc32(raw) != crc:
+            raise BlockStoreCorruptException(
+                "Block %d in %s: checksum mismatch" % (block_num, self.path))
+        try:
+            return self.codec.loads(zlib.decompress(raw))
+        except Exception as e:
+            raise BlockStoreCorruptException(
+                "Block %d in %s cannot be decoded (%s)" % (block_num, self.path, str(e)))
+
+    def append(self, block_num, block):
+        """ Store the block following the last stored one
+
+            :param int block_num: Block number
+            :param dict block: Block as returned by ``get_block``
+        """
+        raw = zlib.compress(self.codec.dumps(block), self.level)
+        with self.lock:
+            if block_num != self.count + 1:
+                raise ValueError("Expected block %d, got block %d" % (
+                    self.count + 1, block_num))
+            offset = self.data.seek(0, os.SEEK_END)
+            self.data.write(raw)
+            self.data.flush()
+            self.index.write(index_entry.pack(offset, len(raw), zlib.crc32(raw)))
+            self.index.flush()
+            self.count += 1
+
+    def truncate(self, block_num):
+        """ Drop block ``block_num`` and all blocks after it
+        """
+        with self.lock:
+            if block_num > self.count:
+                return
+            end = 0
+            if block_num > 1:
+                offset, length, _ = self.entry(block_num - 1)
+                end = offset + length
+            self.resize(max(0, block_num - 1), end)
+
+    def verify(self):
+        """ Check every stored block and yield ``(block_num, problem)``
+            for blocks that are corrupt or stored under the wrong number
+
+            The block number is taken from the ``previous`` block id,
+            which starts with the number of the preceding block. Block
+            ids are not stored, hence it is not checked that the blocks
+            actually link to each other.
+        """
+        for block_num in range(1, self.head + 1):
+            raw, crc = self.read(block_num)
+            if zlib.crc32(raw) != crc:
+                yield block_num, "checksum mismatch"
+                continue
+            try:
+                block = self.codec.loads(zlib.decompress(raw))
+            except Exception as e:
+                yield block_num, "cannot be decoded (%s)" % str(e)
+                continue
+            previous = block.get("previous")
+            if previous is not None and int(previous[:8], 16) != block_num - 1:
+                yield block_num, "previous block is %d" % int(previous[:8], 16)
+
+    def close(self):
+        """ Close the archive
+        """
+        with self.lock:
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+                self.mapped = 0
+            self.data.close()
+            self.index.close()
@@ -0,0 +1,76 @@
+import click
+from peerplays.blockchain import Blockchain
+from peerplays.blockstore import BlockStore
+from .decorators import (
+    onlineChain,
+    offlineChain,
+)
+from .main import main
+
+
+@main.command()
+@click.pass_context
+@onlineChain
+@click.option(
+    '--path',
+    type=str,
+    help="Directory of the block store (defaults to blocks/ in the data directory)"
+)
+@click.option(
+    '--stop',
+    type=int,
+    help="Last block to store (defaults to the last irreversible block)"
+)
+@click.option(
+    '--prefetch',
+    type=int,
+    default=100,
+    help="Number of blocks to obtain at once"
+)
+def syncblocks(ctx, path, stop, prefetch):
+    """ Store irreversible blocks in the local block store
+    """
+    store = BlockStore(
+        path, chain_id=ctx.peerplays.rpc.chain_params["chain_id"])
+    chain = Blockchain(peerplays_instance=ctx.peerplays, blockstore=store)
+    irreversible = chain.info()["last_irreversible_block_num"]
+    if not stop or stop > irreversible:
+        stop = irreversible
+    start = store.head + 1
+    if start <= stop:
+        with click.progressbar(length=stop - start + 1, label="Storing blocks") as bar:
+            for block in chain.block_range(
+                    start, stop, prefetch=prefetch, irreversible=irreversible):
+                bar.update(1)
+    store.close()
+    click.echo("Blocks 1 to %d are stored in %s" % (store.head, store.path))
+
+
+@main.command()
+@click.pass_context
+@offlineChain
+@click.option(
+    '--path',
+    type=str,
+    help="Directory of the block store (defaults to blocks/ in the data directory)"
+)
+@click.option(
+    '--repair',
+    is_flag=True,
+    default=False,
+    help="Drop the first bad block and all blocks after it"
+)
+def verifyblocks(ctx, path, repair):
+    """ Verify the blocks in the local block store
+    """
+    store = BlockStore(path)
+    problems = []
+    for block_num, problem in store.verify():
+        click.echo("Block %d: %s" % (block_num, problem))
+        problems.append(block_num)
+    if problems and repair:
+        store.truncate(problems[0])
+        click.echo("Dropped blocks from %d on" % problems[0])
+    elif not problems:
+        click.echo("Blocks 1 to %d are fine" % store.head)
+    store.close()
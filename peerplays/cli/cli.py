@@ -40,6 +40,7 @@ from datetime import datetime
 from .main import main
 from . import (
     account,
+    blockstore,
     info,
     proposal,
     wallet,
@@ -0,0 +1,117 @@
+import threading
+
+
+class MemoryCursorStore(object):
+    """ Keeps cursor positions in memory only, e.g. for testing
+    """
+    def __init__(self):
+        self.positions = dict()
+
+    def load(self, name):
+        return self.positions.get(name)
+
+    def save(self, name, block_num, op_index):
+        self.positions[name] = (block_num, op_index)
+
+    def delete(self, name):
+        self.positions.pop(name, None)
+
+
+class Cursor(object):
+    """ A named position in the chain that allows to resume processing
+        operations after a restart
+
+        :param str name: Name of the cursor
+        :param store: Where positions are stored. Any object with the
+            methods ``load(name)``, ``save(name, block_num, op_index)``
+            and ``delete(name)`` can be used. Defaults to the SQLite3
+            database (:class:`peerplays.storage.Cursors`).
+        :param int commit_every: Store the position after this many
+            processed operations (defaults to ``100``)
+
+        .. code-block:: python
+
+            from peerplays.blockchain import Blockchain
+            from peerplays.cursor import Cursor
+
+            cursor = Cursor("settlement")
+            for op in Blockchain().stream(["bet_place"], cursor=cursor):
+                process(op)
+
+        The position (``block_num``, ``op_index``) denotes the next
+        operation to process, where ``op_index`` counts the operations
+        within the block. An operation counts as processed once the next
+        one is requested from the iterator, or once the iterator is
+        exhausted. The position is stored every ``commit_every``
+        operations and when the iterator is closed.
+
+        Delivery is at-least-once: after a crash, processing continues
+        with the last stored position, hence up to ``commit_every``
+        operations are handed out again. The operation being processed
+        when the iterator is closed, be it by an exception in the loop
+        or by ``break``, is handed out again as well, unless it has been
+        acknowledged with :meth:`ack`:
+
+        .. code-block:: python
+
+            for op in Blockchain().stream(["bet_place"], cursor=cursor):
+                process(op)
+                if done:
+                    cursor.ack()
+                    break
+
+        Consumers should therefore be idempotent.
+    """
+    def __init__(self, name, store=None, commit_every=100):
+        if store is None:
+            from .storage import cursorStorage
+            store = cursorStorage
+        self.name = name
+        self.store = store
+        self.commit_every = commit_every
+        self.lock = threading.RLock()
+        self.pending = 0
+        self.delivered = None
+        position = store.load(name)
+        if position:
+            self.block_num, self.op_index = position
+        else:
+            self.block_num, self.op_index = None, 0
+
+    def __repr__(self):
+        return "<Cursor %s at %s:%d>" % (self.name, self.block_num, self.op_index)
+
+    def advance(self, block_num, op_index):
+        """ Move the cursor to the operation ``op_index`` of block
+            ``block_num`` (i.e. everything before has been processed)
+        """
+        with self.lock:
+            self.block_num = block_num
+            self.op_index = op_index
+            self.pending += 1
+            if self.pending >= self.commit_every:
+                self.commit()
+
+    def ack(self):
+        """ Mark the operation handed out last as processed
+        """
+        with self.lock:
+            if self.delivered is not None and self.delivered != (
+                    self.block_num, self.op_index):
+                self.advance(*self.delivered)
+
+    def commit(self):
+        """ Store the position
+        """
+        with self.lock:
+            if self.block_num is not None:
+                self.store.save(self.name, self.block_num, self.op_index)
+            self.pending = 0
+
+    def reset(self):
+        """ Forget the position
+        """
+        with self.lock:
+            self.store.delete(self.name)
+            self.block_num, self.op_index = None, 0
+            self.pending = 0
@@ -118,3 +118,9 @@ class SportDoesNotExistException(Exception):
     """ Sport does not exist
     """
     pass
+
+
+class BlockStoreCorruptException(Exception):
+    """ A block in the local block store is corrupt
+    """
+    pass
@@ -80,7 +80,7 @@ class Notify(Events):
 
         # Open the websocket
         self.websocket = PeerPlaysWebsocket(
-            urls=self.peerplays.rpc.urls,
+            urls=self.peerplays.rpc.url_list,
             user=self.peerplays.rpc.user,
             password=self.peerplays.rpc.password,
             accounts=account_ids,
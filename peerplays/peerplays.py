@@ -5,6 +5,7 @@ import re
 from datetime import datetime, timedelta
 
 from peerplaysapi.node import PeerPlaysNodeRPC
+from peerplaysapi.pool import PooledNodeRPC
 from peerplaysbase.account import PrivateKey, PublicKey
 from peerplaysbase import transactions, operations
 from .asset import Asset
@@ -40,6 +41,13 @@ class PeerPlays(object):
         :param int proposal_expiration: Expiration time (in seconds) for the proposal *(optional)*
         :param int expiration: Delay in seconds until transactions are supposed to expire *(optional)*
         :param bool bundle: Do not broadcast transactions right away, but allow to bundle operations *(optional)*
+        :param int pool_size: Use a pool of this many connections that
+            can be shared among threads (see
+            :class:`peerplaysapi.pool.PooledNodeRPC`) *(optional)*
+        :param float pool_timeout: Seconds to wait for a free connection
+            of the pool *(optional)*
+        :param bool lazy: Connect on the first call instead of right away
+            (defaults to ``True``) *(optional)*
 
         Three wallet operation modes are possible:
 
@@ -150,7 +158,22 @@ class PeerPlays(object):
         if not rpcpassword and "rpcpassword" in config:
             rpcpassword = config["rpcpassword"]
 
-        self.rpc = PeerPlaysNodeRPC(node, rpcuser, rpcpassword, **kwargs)
+        # Connect on the first call and reuse the chain parameters
+        # obtained from this node before
+        kwargs.setdefault("lazy", True)
+        cached = json.loads(config["chain_params"] or "{}")
+        if cached.get("node") == node:
+            kwargs.setdefault("chain_params", cached["chain_params"])
+
+        def network_callback(params):
+            config["chain_params"] = json.dumps({
+                "node": node, "chain_params": params})
+        kwargs.setdefault("network_callback", network_callback)
+
+        if kwargs.get("pool_size"):
+            self.rpc = PooledNodeRPC(node, rpcuser, rpcpassword, **kwargs)
+        else:
+            self.rpc = PeerPlaysNodeRPC(node, rpcuser, rpcpassword, **kwargs)
 
     def finalizeOp(self, ops, account, permission):
         """ This method obtains the required private keys if present in
@@ -2,6 +2,7 @@ import shutil
 import time
 import os
 import sqlite3
+import threading
 from .aes import AESCipher
 from appdirs import user_data_dir
 from datetime import datetime
@@ -44,10 +45,25 @@ class DataDir(object):
     data_dir = user_data_dir(appname, appauthor)
     sqlDataBaseFile = os.path.join(data_dir, storageDatabase)
 
+    #: Open database connections of the current thread
+    connections = threading.local()
+
     def __init__(self):
         #: Storage
         self.mkdir_p()
 
+    def connection(self):
+        """ Return a connection to the database. Connections are kept
+            open and reused per thread instead of opening the database
+            for every query.
+        """
+        connections = getattr(DataDir.connections, "databases", None)
+        if connections is None:
+            connections = DataDir.connections.databases = dict()
+        if self.sqlDataBaseFile not in connections:
+            connections[self.sqlDataBaseFile] = sqlite3.connect(self.sqlDataBaseFile)
+        return connections[self.sqlDataBaseFile]
+
     def mkdir_p(self):
         """ Ensure that the directory in which the data is stored
             exists
@@ -71,7 +87,7 @@ class DataDir(object):
             backupdir,
             os.path.basename(self.storageDatabase) +
             datetime.now().strftime("-" + timeformat))
-        connection = sqlite3.connect(self.sqlDataBaseFile)
+        connection = self.connection()
         cursor = connection.cursor()
         # Lock database before making a backup
         cursor.execute('begin immediate')
@@ -117,7 +133,7 @@ class Key(DataDir):
         query = ("SELECT name FROM sqlite_master " +
                  "WHERE type='table' AND name=?",
                  (self.__tablename__, ))
-        connection = sqlite3.connect(self.sqlDataBaseFile)
+        connection = self.connection()
         cursor = connection.cursor()
         cursor.execute(*query)
         return True if cursor.fetchone() else False
@@ -130,7 +146,7 @@ class Key(DataDir):
                  'pub STRING(256),' +
                  'wif STRING(256)' +
                  ')')
-        connection = sqlite3.connect(self.sqlDataBaseFile)
+        connection = self.connection()
         cursor = connection.cursor()
         cursor.execute(query)
         connection.commit()
@@ -139,7 +155,7 @@ class Key(DataDir):
         """ Returns the public keys stored in the database
         """
         query = ("SELECT pub from %s " % (self.__tablename__))
-        connection = sqlite3.connect(self.sqlDataBaseFile)
+        connection = self.connection()
         cursor = connection.cursor()
         cursor.execute(query)
         results = cursor.fetchall()
@@ -156,7 +172,7 @@ class Key(DataDir):
         query = ("SELECT wif from %s " % (self.__tablename__) +
                  "WHERE pub=?",
                  (pub,))
-        connection = sqlite3.connect(self.sqlDataBaseFile)
+        connection = self.connection()
         cursor = connection.cursor()
         cursor.execute(*query)
         key = cursor.fetchone()
@@ -174,7 +190,7 @@ class Key(DataDir):
         query = ("UPDATE %s " % self.__tablename__ +
                  "SET wif=? WHERE pub=?",
                  (wif, pub))
-        connection = sqlite3.connect(self.sqlDataBaseFile)
+        connection = self.connection()
         cursor = connection.cursor()
         cursor.execute(*query)
         connection.commit()
@@ -191,7 +207,7 @@ class Key(DataDir):
         query = ('INSERT INTO %s (pub, wif) ' % self.__tablename__ +
                  'VALUES (?, ?)',
                  (pub, wif))
-        connection = sqlite3.connect(self.sqlDataBaseFile)
+        connection = self.connection()
         cursor = connection.cursor()
         cursor.execute(*query)
         connection.commit()
@@ -204,7 +220,7 @@ class Key(DataDir):
         query = ("DELETE FROM %s " % (self.__tablename__) +
                  "WHERE pub=?",
                  (pub,))
-        connection = sqlite3.connect(self.sqlDataBaseFile)
+        connection = self.connection()
         cursor = connection.cursor()
         cursor.execute(*query)
         connection.commit()
@@ -232,7 +248,7 @@ class Configuration(DataDir):
         query = ("SELECT name FROM sqlite_master " +
                  "WHERE type='table' AND name=?",
                  (self.__tablename__, ))
-        connection = sqlite3.connect(self.sqlDataBaseFile)
+        connection = self.connection()
         cursor = connection.cursor()
         cursor.execute(*query)
         return True if cursor.fetchone() else False
@@ -245,7 +261,7 @@ class Configuration(DataDir):
                  'key STRING(256),' +
                  'value STRING(256)' +
                  ')')
-        connection = sqlite3.connect(self.sqlDataBaseFile)
+        connection = self.connection()
         cursor = connection.cursor()
         cursor.execute(query)
         connection.commit()
@@ -275,7 +291,7 @@ class Configuration(DataDir):
                  "WHERE key=?",
                  (key,)
                  )
-        connection = sqlite3.connect(self.sqlDataBaseFile)
+        connection = self.connection()
         cursor = connection.cursor()
         cursor.execute(*query)
         return True if cursor.fetchone() else False
@@ -288,7 +304,7 @@ class Configuration(DataDir):
                  "WHERE key=?",
                  (key,)
                  )
-        connection = sqlite3.connect(self.sqlDataBaseFile)
+        connection = self.connection()
         cursor = connection.cursor()
         cursor.execute(*query)
         result = cursor.fetchone()
@@ -323,7 +339,7 @@ class Configuration(DataDir):
             query = ("INSERT INTO %s " % self.__tablename__ +
                      "(key, value) VALUES (?, ?)",
                      (key, value))
-        connection = sqlite3.connect(self.sqlDataBaseFile)
+        connection = self.connection()
         cursor = connection.cursor()
         cursor.execute(*query)
         connection.commit()
@@ -334,14 +350,14 @@ class Configuration(DataDir):
         query = ("DELETE FROM %s " % (self.__tablename__) +
                  "WHERE key=?",
                  (key,))
-        connection = sqlite3.connect(self.sqlDataBaseFile)
+        connection = self.connection()
         cursor = connection.cursor()
         cursor.execute(*query)
         connection.commit()
 
     def __iter__(self):
         query = ("SELECT key, value from %s " % (self.__tablename__))
-        connection = sqlite3.connect(self.sqlDataBaseFile)
+        connection = self.connection()
         cursor = connection.cursor()
         cursor.execute(query)
         r = {}
@@ -351,12 +367,150 @@ class Configuration(DataDir):
 
     def __len__(self):
         query = ("SELECT id from %s " % (self.__tablename__))
-        connection = sqlite3.connect(self.sqlDataBaseFile)
+        connection = self.connection()
         cursor = connection.cursor()
         cursor.execute(query)
         return len(cursor.fetchall())
 
 
+class Cursors(DataDir):
+    """ Stores the position of named cursors (see
+        :class:`peerplays.cursor.Cursor`) in the `cursors` table of the
+        SQLite3 database.
+    """
+    __tablename__ = "cursors"
+
+    def __init__(self):
+        super(Cursors, self).__init__()
+
+    def exists_table(self):
+        """ Check if the database table exists
+        """
+        query = ("SELECT name FROM sqlite_master "
+                 "WHERE type='table' AND name=?",
+                 (self.__tablename__, ))
+        connection = self.connection()
+        cursor = connection.cursor()
+        cursor.execute(*query)
+        return True if cursor.fetchone() else False
+
+    def create_table(self):
+        """ Create the new table in the SQLite database
+        """
+        query = ('CREATE TABLE %s ('
+                 'name STRING(256) PRIMARY KEY,'
+                 'block_num INTEGER,'
+                 'op_index INTEGER'
+                 ')' % self.__tablename__)
+        connection = self.connection()
+        cursor = connection.cursor()
+        cursor.execute(query)
+        connection.commit()
+
+    def load(self, name):
+        """ Returns ``(block_num, op_index)`` of the next operation the
+            cursor ``name`` has to process, or ``None``
+        """
+        query = ("SELECT block_num, op_index FROM %s "
+                 "WHERE name=?" % self.__tablename__,
+                 (name,))
+        connection = self.connection()
+        cursor = connection.cursor()
+        cursor.execute(*query)
+        return cursor.fetchone()
+
+    def save(self, name, block_num, op_index):
+        """ Store the position of the cursor ``name``
+        """
+        query = ("INSERT OR REPLACE INTO %s "
+                 "(name, block_num, op_index) VALUES (?, ?, ?)" % self.__tablename__,
+                 (name, block_num, op_index))
+        connection = self.connection()
+        cursor = connection.cursor()
+        cursor.execute(*query)
+        connection.commit()
+
+    def delete(self, name):
+        """ Forget the cursor ``name``
+        """
+        query = ("DELETE FROM %s "
+                 "WHERE name=?" % self.__tablename__,
+                 (name,))
+        connection = self.connection()
+        cursor = connection.cursor()
+        cursor.execute(*query)
+        connection.commit()
+
+
+class BlockTimestamps(DataDir):
+    """ Sparse index of block timestamps (see
+        :meth:`peerplays.blockchain.Blockchain.get_block_num_at`) in the
+        `block_timestamps` table of the SQLite3 database.
+    """
+    __tablename__ = "block_timestamps"
+
+    def __init__(self):
+        super(BlockTimestamps, self).__init__()
+
+    def exists_table(self):
+        """ Check if the database table exists
+        """
+        query = ("SELECT name FROM sqlite_master "
+                 "WHERE type='table' AND name=?",
+                 (self.__tablename__, ))
+        connection = self.connection()
+        cursor = connection.cursor()
+        cursor.execute(*query)
+        return True if cursor.fetchone() else False
+
+    def create_table(self):
+        """ Create the new table in the SQLite database
+        """
+        query = ('CREATE TABLE %s ('
+                 'chain_id STRING(64),'
+                 'block_num INTEGER,'
+                 'timestamp INTEGER,'
+                 'PRIMARY KEY (chain_id, block_num)'
+                 ')' % self.__tablename__)
+        connection = self.connection()
+        cursor = connection.cursor()
+        cursor.execute(query)
+        cursor.execute(
+            'CREATE INDEX %s_timestamp ON %s (chain_id, timestamp)' % (
+                self.__tablename__, self.__tablename__))
+        connection.commit()
+
+    def add(self, chain_id, block_num, timestamp):
+        """ Store the timestamp (seconds since epoch) of a block
+        """
+        query = ("INSERT OR REPLACE INTO %s "
+                 "(chain_id, block_num, timestamp) VALUES (?, ?, ?)" % self.__tablename__,
+                 (chain_id, block_num, timestamp))
+        connection = self.connection()
+        cursor = connection.cursor()
+        cursor.execute(*query)
+        connection.commit()
+
+    def bracket(self, chain_id, timestamp):
+        """ Returns the ``(block_num, timestamp)`` of the last known block
+            not after ``timestamp`` and of the first known block after
+            it. Either is ``None`` if unknown.
+        """
+        connection = self.connection()
+        cursor = connection.cursor()
+        cursor.execute(
+            "SELECT block_num, timestamp FROM %s "
+            "WHERE chain_id=? AND timestamp<=? ORDER BY timestamp DESC LIMIT 1" % self.__tablename__,
+            (chain_id, timestamp))
+        before = cursor.fetchone()
+        cursor.execute(
+            "SELECT block_num, timestamp FROM %s "
+            "WHERE chain_id=? AND timestamp>? ORDER BY timestamp ASC LIMIT 1" % self.__tablename__,
+            (chain_id, timestamp))
+        after = cursor.fetchone()
+        return before, after
+
+
 class MasterPassword(object):
     """ The keys are encrypted with a Masterpassword that is stored in
         the configurationStore. It has a checksum to verify correctness
@@ -457,3 +611,11 @@ newKeyStorage = False
 if not keyStorage.exists_table():
     newKeyStorage = True
     keyStorage.create_table()
+
+cursorStorage = Cursors()
+if not cursorStorage.exists_table():
+    cursorStorage.create_table()
+
+blockTimestampStorage = BlockTimestamps()
+if not blockTimestampStorage.exists_table():
+    blockTimestampStorage.create_table()
@@ -1,5 +1,14 @@
 __all__ = [
+    "asyncnode",
+    "batch",
+    "cache",
+    "codec",
+    "dispatch",
     "exceptions",
+    "metrics",
     "node",
+    "nodepool",
+    "pool",
+    "ratelimit",
     "websocket"
 ]
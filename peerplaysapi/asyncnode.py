@@ -0,0 +1,468 @@
+import time
+import asyncio
+import ssl
+import logging
+from itertools import cycle
+from peerplaysbase.chains import known_chains
+from . import exceptions
+from .exceptions import NumRetriesReached, ConnectionClosed
+from .websocket import PeerPlaysWebsocket
+from .codec import get_codec
+from .metrics import Metrics, byte_size
+
+try:
+    import websockets
+    from websockets.exceptions import (
+        ConnectionClosed as WebsocketClosed,
+        WebSocketException
+    )
+except ImportError:
+    raise ImportError(
+        "Please install websockets to use the asyncio client: "
+        "pip install peerplays[async]")
+
+log = logging.getLogger(__name__)
+
+
+class NoticeStream(object):
+    """ Asynchronous iterator over the notices of one event
+
+        :param AsyncPeerPlaysNodeRPC rpc: Connection the notices are received on
+        :param str event: One of ``on_tx``, ``on_object``, ``on_block``,
+            ``on_account``, ``on_market``
+        :param list args: Arguments for the subscription call (e.g. the
+            accounts for ``on_account`` or the assets for ``on_market``)
+        :param int maxsize: Maximum number of notices to buffer. If the
+            consumer falls behind, the oldest notices are dropped (defaults
+            to ``0``, unbounded)
+    """
+    def __init__(self, rpc, event, args=[], maxsize=0):
+        self.rpc = rpc
+        self.event = event
+        self.args = args
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.subscribed = False
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.subscribed:
+            await self.rpc.subscribe(self)
+        if self.closed and self.queue.empty():
+            raise StopAsyncIteration
+        notice = await self.queue.get()
+        if notice is StopAsyncIteration:
+            raise StopAsyncIteration
+        return notice
+
+    def put(self, notice):
+        """ Hand a notice over to the consumer of this stream
+        """
+        if self.queue.full():
+            log.warning("Dropping notice for %s, consumer too slow" % self.event)
+            self.queue.get_nowait()
+        self.queue.put_nowait(notice)
+
+    def close(self):
+        """ Stop this stream. Consumers waiting in ``async for`` return.
+        """
+        self.closed = True
+        self.rpc.unsubscribe(self)
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(StopAsyncIteration)
+
+
+class AsyncPeerPlaysNodeRPC(object):
+    """ This class is the asyncio counterpart of
+        :class:`peerplaysapi.node.PeerPlaysNodeRPC`. API methods are
+        mapped to coroutines and many calls can be in flight on the same
+        connection at once.
+
+        :param str urls: Either a single Websocket URL, or a list of URLs
+        :param str user: Username for Authentication
+        :param str password: Password for Authentication
+        :param int num_retries: Try x times to num_retries to a node on
+            disconnect, -1 for indefinitely
+        :param str codec: JSON codec to use (``orjson``, ``ujson`` or
+            ``json``), defaults to the fastest one installed
+        :param peerplaysapi.metrics.Metrics metrics: Collect metrics in
+            this instance
+
+        Usage:
+
+        .. code-block:: python
+
+            async def main():
+                async with AsyncPeerPlaysNodeRPC("wss://node.testnet.peerplays.eu") as rpc:
+                    print(await rpc.get_objects(["2.0.0"]))
+                    async for block_id in rpc.notices("on_block"):
+                        print(block_id)
+
+            asyncio.get_event_loop().run_until_complete(main())
+
+        The same errors as raised by
+        :meth:`peerplaysapi.node.PeerPlaysNodeRPC.rpcexec` are raised
+        here.
+    """
+    __events__ = PeerPlaysWebsocket.__events__
+
+    def __init__(self, urls, user="", password="", **kwargs):
+        self.api_id = {}
+        self._request_id = 0
+        self._requests = dict()
+        self._streams = dict()
+        self._subscriptions = []
+        self._connecting = None
+        self._closed = False
+        if isinstance(urls, cycle):
+            self.urls = urls
+        elif isinstance(urls, list):
+            self.urls = cycle(urls)
+        else:
+            self.urls = cycle([urls])
+        self.user = user
+        self.password = password
+        self.num_retries = kwargs.get("num_retries", -1)
+        self.codec = get_codec(kwargs.get("codec"))
+        self.metrics = kwargs.get("metrics") or Metrics()
+        self.chain_params = None
+        self.url = None
+        self.ws = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    def get_request_id(self):
+        self._request_id += 1
+        return self._request_id
+
+    async def connect(self):
+        """ Connect to the next node, login, register to the APIs and
+            restore subscriptions of open notice streams
+        """
+        if self._connecting is None:
+            self._connecting = asyncio.Lock()
+        async with self._connecting:
+            if self.ws is not None:
+                return
+            await self.wsconnect()
+            # Calls within the handshake must not reconnect, as this
+            # would wait for the lock held here
+            await self.rpcexec(self._query("login", [self.user, self.password], 1), retry=False)
+            await self.register_apis(retry=False)
+            if not self.chain_params:
+                self.chain_params = await self.get_network(retry=False)
+            for name, args in self._subscriptions:
+                await self.rpcexec(self._query(name, args, 0), retry=False)
+
+    async def wsconnect(self):
+        cnt = 0
+        while True:
+            cnt += 1
+            self.url = next(self.urls)
+            log.debug("Trying to connect to node %s" % self.url)
+            sslopt = None
+            if self.url[:3] == "wss":
+                sslopt = ssl.create_default_context()
+                sslopt.check_hostname = False
+                sslopt.verify_mode = ssl.CERT_NONE
+            try:
+                self.ws = await websockets.connect(self.url, ssl=sslopt, max_size=None)
+                break
+            except (OSError, WebSocketException):
+                if (self.num_retries >= 0 and cnt > self.num_retries):
+                    raise NumRetriesReached()
+
+                sleeptime = (cnt - 1) * 2 if cnt < 10 else 10
+                if sleeptime:
+                    log.warning(
+                        "Lost connection to node during wsconnect(): %s (%d/%d) "
+                        "Retrying in %d seconds" % (
+                            self.url, cnt, self.num_retries, sleeptime))
+                    await asyncio.sleep(sleeptime)
+        asyncio.ensure_future(self.receive(self.ws))
+
+    async def register_apis(self, retry=True):
+        self.api_id["database"] = await self.database(api_id=1, retry=retry)
+        self.api_id["history"] = await self.history(api_id=1, retry=retry)
+        self.api_id["network_broadcast"] = await self.network_broadcast(
+            api_id=1, retry=retry)
+
+    async def close(self):
+        """ Close the connection and all open notice streams
+        """
+        self._closed = True
+        for streams in list(self._streams.values()):
+            for stream in list(streams):
+                stream.close()
+        if self.ws is not None:
+            await self.ws.close()
+
+    async def receive(self, ws):
+        """ Read messages from the connection ``ws`` until it is closed
+        """
+        try:
+            async for message in ws:
+                try:
+                    self.process_message(message)
+                except Exception as e:
+                    log.critical("Error in process_message: {}".format(str(e)))
+        except WebsocketClosed:
+            pass
+        finally:
+            if self.ws is ws:
+                self.ws = None
+            for id, (_ws, future) in list(self._requests.items()):
+                if _ws is ws:
+                    self._requests.pop(id, None)
+                    if not future.done():
+                        future.set_exception(
+                            ConnectionClosed("Connection closed before reply was received"))
+            if self._streams and not self._closed:
+                log.warning("Lost connection to node %s, reconnecting" % self.url)
+                asyncio.ensure_future(self.connect())
+
+    def process_message(self, reply):
+        """ Resolve replies to RPC calls and dispatch notices to the
+            notice streams
+        """
+        self.metrics.observe_bytes(self.url, received=byte_size(reply))
+        try:
+            data = self.codec.loads(reply)
+        except ValueError:
+            raise ValueError("API node returned invalid format. Expected JSON!")
+
+        if data.get("method") == "notice":
+            id = data["params"][0]
+            if id >= len(self.__events__):
+                log.critical(
+                    "Received an id that is out of range\n\n%s" % str(data))
+                return
+            if id == self.__events__.index('on_object'):
+                for notice in data["params"][1]:
+                    if "id" in notice:
+                        self.process_notice(notice)
+                    else:
+                        for obj in notice:
+                            if "id" in obj:
+                                self.process_notice(obj)
+            else:
+                for notice in data["params"][1]:
+                    self.dispatch(self.__events__[id], notice)
+
+        elif "id" in data:
+            _ws, future = self._requests.pop(data["id"], (None, None))
+            if future is None or future.done():
+                return
+            if "error" in data:
+                if "detail" in data["error"]:
+                    e = exceptions.RPCError(data["error"]["detail"])
+                else:
+                    e = exceptions.RPCError(data["error"]["message"])
+                future.set_exception(exceptions.translateRPCError(e))
+            else:
+                future.set_result(data.get("result"))
+
+    def process_notice(self, notice):
+        """ Object notices go to ``on_object`` streams, account updates
+            additionally to ``on_account`` streams
+        """
+        self.dispatch("on_object", notice)
+        if notice["id"][:4] == "2.6.":
+            self.dispatch("on_account", notice)
+
+    def dispatch(self, event, notice):
+        for stream in self._streams.get(event, []):
+            stream.put(notice)
+
+    def notices(self, event, *args, maxsize=0):
+        """ Returns an asynchronous iterator over the notices of ``event``
+
+            :param str event: One of ``on_tx``, ``on_object``,
+                ``on_block``, ``on_account``, ``on_market``
+            :param list args: Accounts for ``on_account``, or the pair of
+                asset ids for ``on_market``
+            :param int maxsize: Maximum number of buffered notices
+
+            .. code-block:: python
+
+                async for tx in rpc.notices("on_tx"):
+                    print(tx)
+        """
+        if event not in self.__events__:
+            raise ValueError("Unknown event %s" % event)
+        return NoticeStream(self, event, list(args), maxsize=maxsize)
+
+    async def subscribe(self, stream):
+        """ Issue the subscription call(s) for a notice stream
+
+            :raises ValueError: if the stream lacks the arguments its
+                event requires
+        """
+        if stream.event == "on_account" and not stream.args:
+            raise ValueError("on_account requires an account name or id")
+        if stream.event == "on_market" and len(stream.args) < 2:
+            raise ValueError("on_market requires two asset ids")
+        stream.subscribed = True
+        self._streams.setdefault(stream.event, []).append(stream)
+        id = self.__events__.index(stream.event)
+        if stream.event == "on_object":
+            calls = [("set_subscribe_callback", [id, False])]
+        elif stream.event == "on_account":
+            calls = [
+                ("set_subscribe_callback", [self.__events__.index("on_object"), False]),
+                ("get_full_accounts", [stream.args[0], True])
+            ]
+        elif stream.event == "on_tx":
+            calls = [("set_pending_transaction_callback", [id])]
+        elif stream.event == "on_block":
+            calls = [("set_block_applied_callback", [id])]
+        elif stream.event == "on_market":
+            calls = [("subscribe_to_market", [id] + stream.args[:2])]
+        for name, args in calls:
+            if (name, args) not in self._subscriptions:
+                self._subscriptions.append((name, args))
+                await self.rpcexec(self._query(name, args, 0))
+
+    def unsubscribe(self, stream):
+        """ Stop dispatching notices to ``stream``. The subscription on the
+            node is kept alive until the connection is closed.
+        """
+        streams = self._streams.get(stream.event, [])
+        if stream in streams:
+            streams.remove(stream)
+        if not streams:
+            self._streams.pop(stream.event, None)
+
+    """ RPC Calls
+    """
+    def _query(self, name, args, api_id):
+        return {"method": "call",
+                "params": [api_id, name, list(args)],
+                "jsonrpc": "2.0",
+                "id": self.get_request_id()}
+
+    async def rpcexec(self, payload, retry=True):
+        """ Execute a call by sending the payload and wait for the reply
+            with the same request id
+
+            :param json payload: Payload data
+            :param bool retry: Reconnect and retry if the connection is lost
+            :raises ValueError: if the server does not respond in proper JSON format
+            :raises RPCError: if the server returns an error
+        """
+        data = self.codec.dumps(payload).decode("utf8")
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(data)
+        cnt = 0
+        while True:
+            cnt += 1
+            try:
+                ws = self.ws
+                if ws is None:
+                    raise ConnectionClosed()
+                future = asyncio.get_event_loop().create_future()
+                self._requests[payload["id"]] = (ws, future)
+                start = time.time()
+                await ws.send(data)
+                self.metrics.observe_bytes(self.url, sent=byte_size(data))
+                try:
+                    result = await future
+                except Exception as e:
+                    self.metrics.observe_call(payload["params"][1], time.time() - start, error=e)
+                    raise
+                self.metrics.observe_call(payload["params"][1], time.time() - start)
+                return result
+            except (ConnectionClosed, OSError, WebsocketClosed):
+                self._requests.pop(payload["id"], None)
+                if not retry:
+                    raise
+                if self.num_retries > -1 and cnt > self.num_retries:
+                    raise NumRetriesReached()
+                sleeptime = (cnt - 1) * 2 if cnt < 10 else 10
+                if sleeptime:
+                    log.warning(
+                        "Lost connection to node during rpcexec(): %s (%d/%d) "
+                        "Retrying in %d seconds" % (
+                            self.url, cnt, self.num_retries, sleeptime))
+                    await asyncio.sleep(sleeptime)
+                await self.connect()
+
+    def __getattr__(self, name):
+        """ Map all methods to RPC calls and pass through the arguments
+        """
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        async def method(*args, **kwargs):
+
+            # Sepcify the api to talk to
+            if "api_id" not in kwargs:
+                if ("api" in kwargs):
+                    if kwargs["api"] in self.api_id and self.api_id[kwargs["api"]]:
+                        api_id = self.api_id[kwargs["api"]]
+                    else:
+                        raise ValueError(
+                            "Unknown API! "
+                            "Verify that you have registered to %s"
+                            % kwargs["api"]
+                        )
+                else:
+                    api_id = 0
+            else:
+                api_id = kwargs["api_id"]
+
+            # let's be able to define the num_retries per query
+            self.num_retries = kwargs.get("num_retries", self.num_retries)
+
+            return await self.rpcexec(
+                self._query(name, args, api_id),
+                retry=kwargs.get("retry", True))
+        return method
+
+    async def get_account(self, name, **kwargs):
+        """ Get full account details from account name or id
+
+            :param str name: Account name or account id
+        """
+        if len(name.split(".")) == 3:
+            return (await self.get_objects([name]))[0]
+        else:
+            return await self.get_account_by_name(name, **kwargs)
+
+    async def get_asset(self, name, **kwargs):
+        """ Get full asset from name of id
+
+            :param str name: Symbol name or asset id (e.g. 1.3.0)
+        """
+        if len(name.split(".")) == 3:
+            return (await self.get_objects([name], **kwargs))[0]
+        else:
+            return (await self.lookup_asset_symbols([name], **kwargs))[0]
+
+    async def get_object(self, o, **kwargs):
+        """ Get object with id ``o``
+
+            :param str o: Full object id
+        """
+        return (await self.get_objects([o], **kwargs))[0]
+
+    async def get_network(self, retry=True):
+        """ Identify the connected network. This call returns a
+            dictionary with keys chain_id, core_symbol and prefix
+
+            :param bool retry: Reconnect and retry if the connection is lost
+        """
+        props = await self.get_chain_properties(retry=retry)
+        chain_id = props["chain_id"]
+        for k, v in known_chains.items():
+            if v["chain_id"] == chain_id:
+                return v
+        raise Exception("Connecting to unknown network!")
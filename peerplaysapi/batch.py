@@ -0,0 +1,96 @@
+import time
+import logging
+import threading
+from concurrent.futures import Future
+
+log = logging.getLogger(__name__)
+
+
+class ObjectBatch(object):
+    """ Collects single object lookups and resolves them with as few
+        ``get_objects`` calls as possible
+
+        :param int max_size: Maximum number of ids per ``get_objects`` call
+    """
+    def __init__(self, max_size=100):
+        self.max_size = max_size
+        self.futures = dict()
+
+    def __len__(self):
+        return len(self.futures)
+
+    def add(self, id):
+        """ Add a lookup for object ``id``
+
+            :returns: Future that resolves to the object
+            :rtype: concurrent.futures.Future
+        """
+        future = Future()
+        self.futures.setdefault(id, []).append(future)
+        return future
+
+    def flush(self, rpc):
+        """ Obtain all objects from ``rpc`` and resolve the futures
+        """
+        ids = list(self.futures.keys())
+        for i in range(0, len(ids), self.max_size):
+            chunk = ids[i:i + self.max_size]
+            try:
+                objects = rpc.get_objects(chunk)
+            except Exception as e:
+                for id in chunk:
+                    for future in self.futures[id]:
+                        future.set_exception(e)
+            else:
+                for id, obj in zip(chunk, objects):
+                    for future in self.futures[id]:
+                        future.set_result(obj)
+        log.debug("Resolved %d lookups of %d objects" % (
+            sum(len(x) for x in self.futures.values()), len(ids)))
+
+
+class ObjectBatcher(object):
+    """ Merges single object lookups issued by concurrent threads within
+        ``window`` seconds into one ``get_objects`` call
+
+        :param rpc: Connection to issue ``get_objects`` calls on
+        :param float window: Seconds to wait for more lookups to join
+        :param int max_size: Flush right away once this many distinct
+            objects have been requested
+
+        The first thread to request an object waits for ``window``
+        seconds, then obtains all objects requested in the meantime and
+        hands them out to the waiting threads. A single thread blocks on
+        each lookup, so lookups it issues one after the other are never
+        merged.
+    """
+    def __init__(self, rpc, window=0.005, max_size=100):
+        self.rpc = rpc
+        self.window = window
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.pending = None
+
+    def get(self, id):
+        """ Return object ``id``
+        """
+        with self.lock:
+            leader = self.pending is None
+            if leader:
+                self.pending = ObjectBatch(self.max_size)
+            batch = self.pending
+            future = batch.add(id)
+            full = len(batch) >= self.max_size
+            if full:
+                self.pending = None
+        if full:
+            batch.flush(self.rpc)
+        elif leader:
+            time.sleep(self.window)
+            with self.lock:
+                flush = self.pending is batch
+                if flush:
+                    self.pending = None
+            if flush:
+                batch.flush(self.rpc)
+        return future.result()
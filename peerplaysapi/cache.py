@@ -0,0 +1,232 @@
+import time
+import threading
+from collections import OrderedDict
+from .codec import get_codec
+
+#: Status of events, betting market groups and betting markets that do
+#: not change anymore
+final_status = ["settled", "canceled"]
+
+
+def is_irreversible_block(cache, args, result):
+    return bool(result) and args[0] <= cache.irreversible_block_num
+
+
+def is_final_object(cache, id, obj):
+    """ Objects that never change again: operation history entries and
+        settled/canceled events, betting market groups and betting markets
+    """
+    if not obj:
+        return False
+    space_type = id[:id.rfind(".") + 1]
+    if space_type == "1.11.":
+        return True
+    if space_type in ["1.19.", "1.20.", "1.21."]:
+        return obj.get("status") in final_status
+    return False
+
+
+#: Default policies per API method
+#:
+#: * ``immutable``: cached until evicted
+#: * ``ttl``: cached for ``ttl`` seconds
+#: * ``block``: cached until a new head block has been observed (and at
+#:   most for ``ttl`` seconds)
+#:
+#: ``cacheable`` decides if a particular result may be cached at all.
+#: ``get_objects`` is cached per object with ``object_policy``.
+default_policies = {
+    "get_chain_properties": {"policy": "immutable"},
+    "get_chain_id": {"policy": "immutable"},
+    "get_config": {"policy": "immutable"},
+    "get_block": {"policy": "immutable", "cacheable": is_irreversible_block},
+    "get_block_header": {"policy": "immutable", "cacheable": is_irreversible_block},
+    "lookup_asset_symbols": {"policy": "ttl", "ttl": 300},
+    "get_required_fees": {"policy": "ttl", "ttl": 60, "fee_schedule": True},
+}
+
+default_object_policy = {"policy": "immutable", "cacheable": is_final_object}
+
+
+class ResponseCache(object):
+    """ Caches replies of pure API calls
+
+        :param dict policies: Policies per API method (defaults to
+            ``default_policies``)
+        :param dict object_policy: Policy for objects obtained via
+            ``get_objects``, which are cached per object
+        :param int max_bytes: Upper bound of the memory used for cached
+            replies. Least recently used entries are evicted first.
+        :param str codec: Codec to store replies with
+
+        Replies are stored serialized, so that callers can modify what
+        they obtain without altering the cache, and so that the memory
+        bound can be enforced exactly.
+
+        The cache learns about the head block and the last irreversible
+        block from the dynamic global properties (``2.1.0``), and about
+        the fee schedule from the global properties (``2.0.0``) whenever
+        they pass through.
+    """
+    def __init__(
+        self,
+        policies=None,
+        object_policy=None,
+        max_bytes=64 * 1024 * 1024,
+        codec=None,
+    ):
+        self.policies = dict(default_policies)
+        self.policies.update(policies or {})
+        self.object_policy = object_policy or default_object_policy
+        self.max_bytes = max_bytes
+        self.codec = get_codec(codec)
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.head_block_number = 0
+        self.irreversible_block_num = 0
+        self.fee_schedule = None
+        self.hits = dict()
+        self.misses = dict()
+        self.evictions = 0
+
+    def call(self, method, args, fetch):
+        """ Return the cached reply for ``method(*args)`` or obtain it
+            with ``fetch(args)``
+
+            :param str method: Name of the API method
+            :param list args: Arguments of the call
+            :param fnt fetch: Called with the arguments to obtain a reply
+                from the node
+        """
+        if method == "get_objects" and len(args) == 1:
+            return self.call_objects(args[0], fetch)
+        policy = self.policies.get(method)
+        if not policy:
+            result = fetch(args)
+            self.observe(method, args, result)
+            return result
+
+        key = (method, self.codec.dumps(args))
+        found, result = self.lookup(key, method)
+        if found:
+            return result
+        result = fetch(args)
+        self.observe(method, args, result)
+        cacheable = policy.get("cacheable")
+        if not cacheable or cacheable(self, args, result):
+            self.store(key, policy, result)
+        return result
+
+    def call_objects(self, ids, fetch):
+        """ ``get_objects`` is cached per object. Only objects that are
+            not cached are obtained from the node.
+        """
+        results = dict()
+        missing = []
+        for id in ids:
+            found, obj = self.lookup(("object", id), "get_objects")
+            if found:
+                results[id] = obj
+            elif id not in missing:
+                missing.append(id)
+        if missing:
+            objects = fetch([missing])
+            self.observe("get_objects", [missing], objects)
+            cacheable = self.object_policy.get("cacheable")
+            for id, obj in zip(missing, objects):
+                results[id] = obj
+                if not cacheable or cacheable(self, id, obj):
+                    self.store(("object", id), self.object_policy, obj)
+            if len(missing) == len(ids):
+                return objects
+        return [results[id] for id in ids]
+
+    def lookup(self, key, method):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                data, expires, head, size = entry
+                fresh = expires is None or expires > time.time()
+                if fresh and (head is None or head == self.head_block_number):
+                    self.entries.move_to_end(key)
+                    self.hits[method] = self.hits.get(method, 0) + 1
+                    return True, self.codec.loads(data)
+                self.remove(key)
+            self.misses[method] = self.misses.get(method, 0) + 1
+        return False, None
+
+    def store(self, key, policy, result):
+        data = self.codec.dumps(result)
+        size = len(data)
+        if size > self.max_bytes:
+            return
+        expires = None
+        head = None
+        if policy["policy"] in ["ttl", "block"] and policy.get("ttl"):
+            expires = time.time() + policy["ttl"]
+        if policy["policy"] == "block":
+            head = self.head_block_number
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (data, expires, head, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def remove(self, key):
+        entry = self.entries.pop(key)
+        self.bytes -= entry[3]
+
+    def observe(self, method, args, result):
+        """ Learn about head block, irreversible block and fee schedule
+            from replies passing through
+        """
+        objects = []
+        if method == "get_dynamic_global_properties":
+            objects = [result]
+        elif method == "get_global_properties":
+            objects = [result]
+        elif method == "get_objects" and isinstance(result, list):
+            objects = [x for x in result if x and x.get("id") in ["2.0.0", "2.1.0"]]
+        for obj in objects:
+            if not isinstance(obj, dict):
+                continue
+            if "head_block_number" in obj:
+                self.head_block_number = obj["head_block_number"]
+                self.irreversible_block_num = obj.get(
+                    "last_irreversible_block_num", self.irreversible_block_num)
+            if "parameters" in obj:
+                fee_schedule = self.codec.dumps(obj["parameters"].get("current_fees"))
+                if self.fee_schedule is not None and fee_schedule != self.fee_schedule:
+                    self.invalidate_fees()
+                self.fee_schedule = fee_schedule
+
+    def invalidate_fees(self):
+        """ Drop replies that depend on the fee schedule
+        """
+        methods = [m for m, p in self.policies.items() if p.get("fee_schedule")]
+        self.invalidate(*methods)
+
+    def invalidate(self, *methods):
+        """ Drop cached replies of ``methods`` (all, if none are given)
+        """
+        with self.lock:
+            for key in list(self.entries.keys()):
+                if not methods or key[0] in methods:
+                    self.remove(key)
+
+    def stats(self):
+        """ Returns hits and misses per method, the number of entries,
+            bytes used and evictions
+        """
+        with self.lock:
+            return {
+                "hits": dict(self.hits),
+                "misses": dict(self.misses),
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "evictions": self.evictions,
+            }
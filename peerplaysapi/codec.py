@@ -0,0 +1,92 @@
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+log = logging.getLogger(__name__)
+
+
+class JSONCodec(object):
+    """ Encode requests and decode replies with the standard library's
+        ``json`` module
+    """
+    name = "json"
+
+    def dumps(self, data):
+        """ Serialize ``data`` into UTF-8 encoded bytes
+        """
+        return json.dumps(data, ensure_ascii=False).encode("utf8")
+
+    def loads(self, data):
+        """ Deserialize ``data`` (``str`` or ``bytes``)
+        """
+        return json.loads(data, strict=False)
+
+
+class UJSONCodec(JSONCodec):
+    """ Codec using `ujson <https://pypi.org/project/ujson/>`_
+    """
+    name = "ujson"
+
+    def dumps(self, data):
+        return ujson.dumps(data, ensure_ascii=False).encode("utf8")
+
+    def loads(self, data):
+        try:
+            return ujson.loads(data)
+        except ValueError:
+            # e.g. control characters in strings
+            return super(UJSONCodec, self).loads(data)
+
+
+class ORJSONCodec(JSONCodec):
+    """ Codec using `orjson <https://pypi.org/project/orjson/>`_
+    """
+    name = "orjson"
+
+    def dumps(self, data):
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            # e.g. integers exceeding 64 bits
+            return super(ORJSONCodec, self).dumps(data)
+
+    def loads(self, data):
+        try:
+            return orjson.loads(data)
+        except ValueError:
+            # e.g. control characters in strings
+            return super(ORJSONCodec, self).loads(data)
+
+
+#: Available codecs, fastest first
+codecs = [c for c, lib in [
+    (ORJSONCodec, orjson),
+    (UJSONCodec, ujson),
+    (JSONCodec, json),
+] if lib]
+
+
+def get_codec(codec=None):
+    """ Return a codec instance
+
+        :param str codec: Name of the codec (``orjson``, ``ujson``,
+            ``json``), or a codec instance. Defaults to the fastest
+            installed codec.
+    """
+    if codec is None:
+        return codecs[0]()
+    if not isinstance(codec, str):
+        return codec
+    for c in codecs:
+        if c.name == codec:
+            return c()
+    raise ValueError("Codec %s is not available" % codec)
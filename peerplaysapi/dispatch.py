@@ -0,0 +1,216 @@
+import time
+import logging
+import threading
+import traceback
+from collections import deque, OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+class Dispatcher(object):
+    """ Hand notifications over to a pool of worker threads so that slow
+        callbacks do not stall the thread that receives from the socket.
+
+        :param int workers: Number of worker threads (defaults to ``4``)
+        :param int maxsize: Maximum number of pending notifications per
+            worker (defaults to ``1000``)
+        :param str policy: What to do if a worker's queue is full:
+
+            * ``block``: wait until there is room again (default)
+            * ``drop_oldest``: drop the oldest pending notification
+            * ``coalesce``: replace a pending notification for the same
+              object with the new one, block if there is none
+
+        Notifications are assigned to a worker by their ``key``. Hence,
+        all notifications with the same key (e.g. all ``on_block``
+        notices, or all updates of object ``1.21.42``) are delivered in
+        the order they have been received.
+    """
+    policies = ["block", "drop_oldest", "coalesce"]
+
+    def __init__(self, workers=4, maxsize=1000, policy="block"):
+        if policy not in self.policies:
+            raise ValueError(
+                "Unknown policy %s, use one of %s" % (policy, ", ".join(self.policies)))
+        if workers < 1:
+            raise ValueError("At least one worker is required")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.running = True
+        self.queues = [deque() for _ in range(workers)]
+        self.conditions = [threading.Condition() for _ in range(workers)]
+        self.counter_lock = threading.Lock()
+        self.counters = {
+            "dispatched": 0,
+            "dropped": 0,
+            "coalesced": 0,
+            "errors": 0,
+        }
+        self.threads = []
+        for index in range(workers):
+            thread = threading.Thread(
+                target=self.run,
+                args=(index,),
+                name="peerplays-dispatch-%d" % index,
+                daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def count(self, counter, n=1):
+        with self.counter_lock:
+            self.counters[counter] += n
+
+    def submit(self, key, callback, notice, coalesce=False):
+        """ Queue ``callback(notice)`` for execution by a worker
+
+            :param key: Ordering key
+            :param fnt callback: Callable to call with the notice
+            :param notice: The notification
+            :param bool coalesce: May this notification supersede a pending
+                notification with the same key (``coalesce`` policy only)?
+        """
+        index = hash(key) % len(self.queues)
+        queue = self.queues[index]
+        condition = self.conditions[index]
+        with condition:
+            if len(queue) >= self.maxsize:
+                if self.policy == "coalesce" and coalesce:
+                    for i in range(len(queue) - 1, -1, -1):
+                        if queue[i][0] == key and queue[i][1] == callback and queue[i][3]:
+                            queue[i] = (key, callback, notice, coalesce)
+                            self.count("coalesced")
+                            return
+                if self.policy == "drop_oldest":
+                    queue.popleft()
+                    self.count("dropped")
+                else:
+                    while len(queue) >= self.maxsize and self.running:
+                        condition.wait()
+            queue.append((key, callback, notice, coalesce))
+            condition.notify_all()
+
+    def run(self, index):
+        queue = self.queues[index]
+        condition = self.conditions[index]
+        while True:
+            with condition:
+                while not queue and self.running:
+                    condition.wait()
+                if not queue:
+                    return
+                key, callback, notice, _ = queue.popleft()
+                condition.notify_all()
+            try:
+                callback(notice)
+                self.count("dispatched")
+            except Exception as e:
+                self.count("errors")
+                log.critical("Error in callback for {}: {}\n\n{}".format(
+                    key, str(e), traceback.format_exc()))
+
+    def depth(self):
+        """ Number of notifications waiting to be dispatched
+        """
+        return sum(len(queue) for queue in self.queues)
+
+    def stats(self):
+        """ Returns the queue depth and the counters of dispatched,
+            dropped and coalesced notifications as well as callback errors
+        """
+        with self.counter_lock:
+            stats = dict(self.counters)
+        stats["depth"] = self.depth()
+        stats["workers"] = len(self.threads)
+        return stats
+
+    def stop(self, wait=True):
+        """ Stop the workers once all pending notifications have been
+            dispatched
+        """
+        self.running = False
+        for condition in self.conditions:
+            with condition:
+                condition.notify_all()
+        if wait:
+            for thread in self.threads:
+                if thread is not threading.current_thread():
+                    thread.join()
+
+
+class NoticeCoalescer(object):
+    """ Keep only the latest state per object id and hand the notices
+        over in batches
+
+        :param fnt callback: Called as ``callback(callbackname, notice, key=id)``
+            for every object that changed since the last flush
+        :param float window: Flush every ``window`` seconds. If ``None``,
+            :meth:`flush` needs to be called explicitly (e.g. once per
+            block)
+
+        Objects are flushed in the order in which they first changed
+        within a window.
+    """
+    def __init__(self, callback, window=None):
+        self.callback = callback
+        self.window = window
+        self.lock = threading.Lock()
+        self.pending = OrderedDict()
+        self.running = True
+        self.counters = {
+            "received": 0,
+            "superseded": 0,
+            "flushed": 0,
+        }
+        self.thread = None
+        if window:
+            self.thread = threading.Thread(
+                target=self.run,
+                name="peerplays-coalesce",
+                daemon=True
+            )
+            self.thread.start()
+
+    def add(self, callbackname, notice):
+        """ Remember ``notice``, superseding a pending notice for the same
+            object
+        """
+        with self.lock:
+            self.counters["received"] += 1
+            if notice["id"] in self.pending:
+                self.counters["superseded"] += 1
+            self.pending[notice["id"]] = (callbackname, notice)
+
+    def flush(self):
+        """ Hand over the latest state of all objects that changed
+        """
+        with self.lock:
+            pending = self.pending
+            self.pending = OrderedDict()
+            self.counters["flushed"] += len(pending)
+        for id, (callbackname, notice) in pending.items():
+            try:
+                self.callback(callbackname, notice, key=id)
+            except Exception as e:
+                log.critical("Error in {}: {}\n\n{}".format(
+                    callbackname, str(e), traceback.format_exc()))
+
+    def run(self):
+        while self.running:
+            time.sleep(self.window)
+            self.flush()
+
+    def stats(self):
+        """ Returns the number of received, superseded, flushed and
+            pending notices
+        """
+        with self.lock:
+            stats = dict(self.counters)
+            stats["pending"] = len(self.pending)
+        return stats
+
+    def stop(self):
+        """ Stop the flushing thread and flush what is pending
+        """
+        self.running = False
+        self.flush()
@@ -20,6 +20,21 @@ def decodeRPCErrorMsg(e):
         return str(e)
 
 
+def translateRPCError(e):
+    """ Helper function that turns a generic ``RPCError`` into the
+        PeerPlays specific exception that should be raised instead
+    """
+    msg = decodeRPCErrorMsg(e).strip()
+    if msg == "missing required active authority":
+        return MissingRequiredActiveAuthority()
+    elif re.match("^no method with name.*", msg):
+        return NoMethodWithName(msg)
+    elif msg:
+        return UnhandledRPCError(msg)
+    else:
+        return e
+
+
 class MissingRequiredActiveAuthority(RPCError):
     pass
 
@@ -34,3 +49,11 @@ class UnhandledRPCError(RPCError):
 
 class NumRetriesReached(Exception):
     pass
+
+
+class ConnectionClosed(Exception):
+    pass
+
+
+class PoolTimeout(Exception):
+    pass
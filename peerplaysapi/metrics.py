@@ -0,0 +1,249 @@
+import threading
+
+#: Default latency buckets in seconds
+default_buckets = [
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+]
+
+
+def byte_size(data):
+    """ Size of a websocket frame in bytes. Text frames (``str``) are
+        UTF-8 encoded on the wire.
+    """
+    if isinstance(data, str):
+        return len(data.encode("utf8"))
+    return len(data)
+
+
+class Histogram(object):
+    """ Latency histogram with fixed buckets
+
+        :param list buckets: Upper bounds of the buckets in seconds
+    """
+    def __init__(self, buckets=default_buckets):
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """ Returns a list of ``(upper bound, cumulative count)``
+        """
+        ret = []
+        total = 0
+        for bound, count in zip(self.buckets + [float("inf")], self.counts):
+            total += count
+            ret.append((bound, total))
+        return ret
+
+    def quantile(self, q):
+        """ Estimate the ``q`` quantile (``0 < q < 1``) as the upper bound
+            of the bucket it falls into
+        """
+        if not self.count:
+            return None
+        for bound, total in self.cumulative():
+            if total >= q * self.count:
+                return bound
+
+    def json(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": {
+                ("+Inf" if bound == float("inf") else bound): total
+                for bound, total in self.cumulative()
+            }
+        }
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def labels(**kwargs):
+    return "{" + ",".join(
+        '%s="%s"' % (k, escape(v)) for k, v in sorted(kwargs.items())
+    ) + "}"
+
+
+class Metrics(object):
+    """ Collects metrics of RPC calls: per method call counts, latency
+        histograms and errors (by exception class), as well as bytes
+        sent and received and gauges (e.g. ping round trip time) per node.
+
+        :param list buckets: Upper bounds of the latency buckets in seconds
+
+        An instance can be shared among several connections:
+
+        .. code-block:: python
+
+            from peerplaysapi.metrics import Metrics
+            metrics = Metrics()
+            rpc = PeerPlaysNodeRPC("wss://node.testnet.peerplays.eu", metrics=metrics)
+            ...
+            print(metrics.stats())
+            print(metrics.prometheus())
+    """
+    def __init__(self, buckets=default_buckets):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Reset all metrics
+        """
+        with self.lock:
+            self.calls = dict()
+            self.latency = dict()
+            self.errors = dict()
+            self.bytes_sent = dict()
+            self.bytes_received = dict()
+            self.gauges = dict()
+            self.counters = dict()
+
+    def observe_call(self, method, duration, error=None):
+        """ Record an RPC call
+
+            :param str method: Name of the API method
+            :param float duration: Seconds until the reply was received
+            :param Exception error: Exception raised by the call, if any
+        """
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            if method not in self.latency:
+                self.latency[method] = Histogram(self.buckets)
+            self.latency[method].observe(duration)
+            if error is not None:
+                key = (method, error.__class__.__name__)
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    def observe_bytes(self, node, sent=0, received=0):
+        """ Record bytes sent to and received from ``node``
+        """
+        with self.lock:
+            self.bytes_sent[node] = self.bytes_sent.get(node, 0) + sent
+            self.bytes_received[node] = self.bytes_received.get(node, 0) + received
+
+    def set_gauge(self, name, value, node=None):
+        """ Set the gauge ``name`` (e.g. ``ping_rtt_seconds``) of ``node``
+        """
+        with self.lock:
+            self.gauges[(name, node)] = value
+
+    def increment(self, name, n=1, node=None):
+        """ Increment the counter ``name`` of ``node`` by ``n``
+        """
+        with self.lock:
+            key = (name, node)
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def quantile(self, q, method=None):
+        """ Estimate the ``q`` quantile of the latency of calls to
+            ``method`` (or of all calls)
+        """
+        with self.lock:
+            if method:
+                histogram = self.latency.get(method)
+            else:
+                histogram = Histogram(self.buckets)
+                for h in self.latency.values():
+                    histogram.counts = [a + b for a, b in zip(histogram.counts, h.counts)]
+                    histogram.count += h.count
+            return histogram.quantile(q) if histogram else None
+
+    def stats(self):
+        """ Returns all metrics as a dictionary
+        """
+        with self.lock:
+            return {
+                "calls": dict(self.calls),
+                "latency": {
+                    method: h.json() for method, h in self.latency.items()
+                },
+                "errors": {
+                    method: {
+                        error: n for (m, error), n in self.errors.items()
+                        if m == method
+                    } for method, _ in self.errors
+                },
+                "bytes_sent": dict(self.bytes_sent),
+                "bytes_received": dict(self.bytes_received),
+                "gauges": {
+                    name: {
+                        node: v for (n, node), v in self.gauges.items()
+                        if n == name
+                    } for name, _ in self.gauges
+                },
+                "counters": {
+                    name: {
+                        node: v for (n, node), v in self.counters.items()
+                        if n == name
+                    } for name, _ in self.counters
+                },
+            }
+
+    def prometheus(self, prefix="peerplays_rpc"):
+        """ Returns all metrics in the Prometheus text exposition format
+
+            :param str prefix: Prefix for the metric names
+        """
+        lines = []
+
+        def header(name, type, help):
+            lines.append("# HELP %s_%s %s" % (prefix, name, help))
+            lines.append("# TYPE %s_%s %s" % (prefix, name, type))
+
+        with self.lock:
+            header("calls_total", "counter", "Number of RPC calls")
+            for method, n in sorted(self.calls.items()):
+                lines.append("%s_calls_total%s %d" % (prefix, labels(method=method), n))
+
+            header("latency_seconds", "histogram", "Latency of RPC calls")
+            for method, h in sorted(self.latency.items()):
+                for bound, total in h.cumulative():
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append("%s_latency_seconds_bucket%s %d" % (
+                        prefix, labels(method=method, le=le), total))
+                lines.append("%s_latency_seconds_sum%s %s" % (
+                    prefix, labels(method=method), repr(h.sum)))
+                lines.append("%s_latency_seconds_count%s %d" % (
+                    prefix, labels(method=method), h.count))
+
+            header("errors_total", "counter", "Number of failed RPC calls")
+            for (method, error), n in sorted(self.errors.items()):
+                lines.append("%s_errors_total%s %d" % (
+                    prefix, labels(method=method, error=error), n))
+
+            header("sent_bytes_total", "counter", "Bytes sent to a node")
+            for node, n in sorted(self.bytes_sent.items()):
+                lines.append("%s_sent_bytes_total%s %d" % (prefix, labels(node=node), n))
+
+            header("received_bytes_total", "counter", "Bytes received from a node")
+            for node, n in sorted(self.bytes_received.items()):
+                lines.append("%s_received_bytes_total%s %d" % (prefix, labels(node=node), n))
+
+            for name in sorted(set(n for n, _ in self.counters)):
+                header(name, "counter", name.replace("_", " "))
+                for (n, node), v in sorted(self.counters.items(), key=str):
+                    if n == name:
+                        lines.append("%s_%s%s %d" % (
+                            prefix, name, labels(node=node) if node else "", v))
+
+            for name in sorted(set(n for n, _ in self.gauges)):
+                header(name, "gauge", name.replace("_", " "))
+                for (n, node), v in sorted(self.gauges.items(), key=str):
+                    if n == name:
+                        lines.append("%s_%s%s %s" % (
+                            prefix, name, labels(node=node) if node else "", repr(v)))
+        return "\n".join(lines) + "\n"
@@ -1,46 +1,578 @@
-import re
-from grapheneapi.graphenewsrpc import GrapheneWebsocketRPC
+import math
+import time
+import threading
+import websocket
+from contextlib import contextmanager
+from concurrent.futures import Future
+from grapheneapi.graphenewsrpc import GrapheneWebsocketRPC, NumRetriesReached
 from peerplaysbase.chains import known_chains
 from . import exceptions
+from .codec import get_codec
+from .metrics import Metrics, byte_size
+from .batch import ObjectBatch, ObjectBatcher
+from .cache import ResponseCache
+from .ratelimit import RateLimiter, throttle_error
 import logging
 log = logging.getLogger(__name__)
 
+#: Prefixes of the read-only database API methods that may be hedged
+hedge_prefixes = ("get_", "lookup_", "list_")
+
+#: Seconds between checks whether a hedged call has been answered by the
+#: second node while waiting for the reply of the first one
+hedge_poll_interval = 0.01
+
 
 class PeerPlaysNodeRPC(GrapheneWebsocketRPC):
+    """ This class allows to call API methods exposed by the witness node
+        via websockets.
+
+        :param str urls: Either a single Websocket URL, or a list of URLs
+        :param str user: Username for Authentication
+        :param str password: Password for Authentication
+        :param int num_retries: Try x times to num_retries to a node on
+            disconnect, -1 for indefinitely
+        :param str codec: JSON codec to use (``orjson``, ``ujson`` or
+            ``json``), defaults to the fastest one installed
+        :param peerplaysapi.metrics.Metrics metrics: Collect metrics in
+            this instance (e.g. to share it among connections)
+
+        :param float batch_window: Merge single object lookups
+            (:meth:`get_object`) of concurrent threads issued within this
+            many seconds into one ``get_objects`` call (defaults to ``0``,
+            disabled). Every lookup waits up to this long, and consecutive
+            lookups of the same thread are not merged. Use
+            ``get_objects`` or :meth:`batch` for those.
+        :param cache: Cache replies of pure database API calls, either
+            ``True`` or a :class:`peerplaysapi.cache.ResponseCache`
+            instance (defaults to no caching)
+        :param bool lazy: Do not connect before the first call (defaults
+            to ``False``)
+        :param dict chain_params: Chain parameters known from a previous
+            connection. They are verified in the background once
+            connected instead of being requested before the first call.
+        :param fnt network_callback: Called with the chain parameters
+            whenever they have been obtained from the node (e.g. to
+            persist them)
+
+        :param bool hedge: Hedge read-only database calls: if no reply
+            arrived within the ``hedge_quantile`` of the recent latency of
+            the method, send the same call to a second node and return the
+            first reply (defaults to ``False``)
+        :param float hedge_quantile: Latency quantile after which a call is
+            hedged (defaults to ``0.95``)
+        :param float hedge_delay: Seconds after which a call is hedged as
+            long as no latency of the method has been observed (defaults
+            to ``0.25``)
+        :param list hedge_urls: Nodes to send hedged calls to (defaults
+            to the other ``urls``)
+        :param rate_limit: Limit and adapt requests per second and in
+            flight per node, either ``True`` or a
+            :class:`peerplaysapi.ratelimit.RateLimiter` instance (e.g. to
+            share it among connections)
+
+        Call counts, latencies, errors and bytes transferred are available
+        through :meth:`stats` and, in Prometheus text format, through
+        ``rpc.metrics.prometheus()``. With hedging, the counters
+        ``hedges_total`` and ``hedges_won_total`` tell how often a call has
+        been hedged and how often the second node answered first. The
+        metrics of the hedged calls themselves are found under
+        ``stats()["hedge"]``.
+
+        Instances can be used from multiple threads. Calls are serialized
+        on the connection.
+
+        APIs other than ``database`` are registered on their first use.
+    """
 
     def __init__(self, *args, **kwargs):
+        self._chain_params = kwargs.get("chain_params")
+        self.network_callback = kwargs.get("network_callback")
+        self.verified = False
+        self.verify_thread = None
+        self.deferred = True
+        self.codec = get_codec(kwargs.get("codec"))
+        self.metrics = kwargs.get("metrics") or Metrics()
+        self.lock = threading.RLock()
+        self.batches = threading.local()
+        self.batcher = None
+        if kwargs.get("batch_window"):
+            self.batcher = ObjectBatcher(self, window=kwargs["batch_window"])
+        self.cache = kwargs.get("cache") or None
+        if self.cache is True:
+            self.cache = ResponseCache(codec=self.codec)
+        self.limiter = kwargs.get("rate_limit") or None
+        if self.limiter is True:
+            self.limiter = RateLimiter()
+        self.url_list = args[0] if args else kwargs.get("urls")
+        if not isinstance(self.url_list, (list, tuple)):
+            self.url_list = [self.url_list]
+        self.hedge = kwargs.get("hedge", False)
+        self.hedge_quantile = kwargs.get("hedge_quantile", 0.95)
+        self.hedge_delay = kwargs.get("hedge_delay", 0.25)
+        self.hedge_urls = kwargs.get("hedge_urls")
+        self.hedge_rpc = None
+        self.hedge_lock = threading.Lock()
+        # Ids of requests whose replies are dropped once they arrive
+        self.stale = set()
+        # Connecting is deferred to connect()
         super(PeerPlaysNodeRPC, self).__init__(*args, **kwargs)
-        self.chain_params = self.get_network()
+        if not kwargs.get("lazy"):
+            self.connect()
+            if self._chain_params is None:
+                self.set_chain_params(self.get_network())
+
+    def __getattr__(self, name):
+        method = super(PeerPlaysNodeRPC, self).__getattr__(name)
+
+        def call(*args, **kwargs):
+            if "api" in kwargs and "api_id" not in kwargs:
+                kwargs["api_id"] = self.get_api_id(kwargs.pop("api"))
+            return method(*args, **kwargs)
+        return call
+
+    @property
+    def chain_params(self):
+        """ Chain parameters (``chain_id``, ``core_symbol`` and
+            ``prefix``) of the connected network
+        """
+        if self._chain_params is None:
+            self.set_chain_params(self.get_network())
+        return self._chain_params
+
+    @chain_params.setter
+    def chain_params(self, params):
+        self._chain_params = params
+
+    def set_chain_params(self, params):
+        self._chain_params = params
+        self.verified = True
+        if self.network_callback:
+            self.network_callback(params)
+
+    def connect(self):
+        """ Connect to the node. With ``lazy=True``, this happens
+            automatically on the first call.
+        """
+        with self.lock:
+            self.deferred = False
+            self.wsconnect()
+            self.register_apis()
+        if self._chain_params is not None and not self.verified:
+            self.verify_thread = threading.Thread(
+                target=self.verify_chain_params,
+                name="verify chain parameters")
+            self.verify_thread.daemon = True
+            self.verify_thread.start()
+
+    def verify_chain_params(self):
+        """ Compare the chain parameters provided to the constructor with
+            the ones of the connected network
+        """
+        try:
+            params = self.get_network()
+        except Exception as e:
+            log.warning("Could not verify the chain parameters: %s" % str(e))
+            return
+        if params != self._chain_params:
+            log.warning(
+                "Chain parameters do not match the network of %s (%s)" % (
+                    self.url, params["chain_id"]))
+            self.set_chain_params(params)
+        else:
+            self.verified = True
+
+    def wsconnect(self):
+        if self.deferred:
+            return
+        self.stale.clear()
+        super(PeerPlaysNodeRPC, self).wsconnect()
 
     def register_apis(self):
-        self.api_id["database"] = self.database(api_id=1)
-        self.api_id["history"] = self.history(api_id=1)
-        self.api_id["network_broadcast"] = self.network_broadcast(api_id=1)
+        """ APIs are registered on first use (see :meth:`get_api_id`).
+            After reconnecting, the APIs registered so far are registered
+            again in the same order, so their ids remain valid.
+        """
+        if self.deferred:
+            return
+        for api in list(self.api_id.keys()):
+            self.api_id[api] = getattr(self, api)(api_id=1)
+
+    def get_api_id(self, api):
+        """ Return the id of ``api`` (e.g. ``network_broadcast``),
+            registering to it if needed
+        """
+        with self.lock:
+            if not self.api_id.get(api):
+                self.api_id[api] = getattr(self, api)(api_id=1)
+                if not self.api_id[api]:
+                    raise ValueError(
+                        "Unknown API! Verify that you have access to %s" % api)
+            return self.api_id[api]
 
     def rpcexec(self, payload):
         """ Execute a call by sending the payload.
-            It makes use of the GrapheneRPC library.
             In here, we mostly deal with PeerPlays specific error handling
 
             :param json payload: Payload data
             :raises ValueError: if the server does not respond in proper JSON format
             :raises RPCError: if the server returns an error
         """
+        if self.cache is not None and payload["params"][0] == 0:
+            def fetch(args):
+                payload["params"][2] = args
+                return self.execute(payload)
+            return self.cache.call(payload["params"][1], payload["params"][2], fetch)
+        return self.execute(payload)
+
+    def execute(self, payload):
+        """ Execute a call, hedged if enabled and the call is read-only
+        """
+        api_id, method = payload["params"][:2]
+        read_only = method.startswith(hedge_prefixes) and "broadcast" not in method
+        if self.hedge and api_id == 0 and read_only:
+            return self.hedgedexec(payload)
+        return self.timedexec(payload)
+
+    def hedgedexec(self, payload):
+        """ Execute a call and, if it did not answer in time, the same
+            call on a second connection. The first successful reply wins.
+
+            The call itself runs in the calling thread. The hedge is sent
+            from a timer thread, so it never queues behind other calls.
+            If the hedge wins, the connection is kept and the reply of
+            the call is dropped once it arrives.
+        """
+        method = payload["params"][1]
+        delay = self.metrics.quantile(self.hedge_quantile, method)
+        if not delay or math.isinf(delay):
+            # No latency observed yet, or beyond the largest bucket
+            delay = self.hedge_delay
+        hedge = Future()
+
+        def send_hedge():
+            if not hedge.set_running_or_notify_cancel():
+                return
+            self.metrics.increment("hedges_total")
+            try:
+                hedge.set_result(
+                    self.get_hedge_connection().timedexec(dict(payload)))
+            except Exception as e:
+                hedge.set_exception(e)
+
+        data = self.codec.dumps(payload)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(data.decode("utf8"))
+        timer = threading.Timer(delay, send_hedge)
+        timer.daemon = True
+        start = time.time()
+        error = None
+        with self.lock:
+            timer.start()
+            try:
+                reply = self.sendrecv(
+                    data, method=method, request_id=payload["id"], hedge=hedge)
+            except Exception as e:
+                reply, error = None, e
+            timer.cancel()
+            hedge.cancel()
+
+        if reply is None and error is None:
+            self.metrics.increment("hedges_won_total")
+            return hedge.result()
+        if error is None:
+            try:
+                result = self.decode(reply)
+            except exceptions.RPCError as e:
+                error = exceptions.translateRPCError(e)
+            except Exception as e:
+                error = e
+        self.metrics.observe_call(method, time.time() - start, error=error)
+        if error is None:
+            return result
+        if not hedge.cancelled():
+            # The hedge is still out there and may succeed
+            try:
+                return hedge.result()
+            except Exception:
+                pass
+        raise error
+
+    def get_hedge_connection(self):
+        """ Return the connection hedged calls are sent to, preferring a
+            different node than the one we are connected to
+        """
+        with self.hedge_lock:
+            if self.hedge_rpc is None:
+                urls = self.hedge_urls
+                if not urls:
+                    urls = [x for x in self.url_list if x != self.url]
+                    urls += [x for x in self.url_list if x == self.url]
+                # Latencies of hedges are kept apart, so that they do
+                # not shift the threshold calls are hedged after
+                self.hedge_rpc = self.__class__(
+                    urls, self.user, self.password,
+                    lazy=True,
+                    codec=self.codec,
+                    rate_limit=self.limiter,
+                    num_retries=self.num_retries)
+            return self.hedge_rpc
+
+    def timedexec(self, payload):
+        """ Execute a call and record its metrics
+        """
+        start = time.time()
+        error = None
         try:
-            # Forward call to GrapheneWebsocketRPC and catch+evaluate errors
-            return super(PeerPlaysNodeRPC, self).rpcexec(payload)
+            return self.wsexec(payload)
         except exceptions.RPCError as e:
-            msg = exceptions.decodeRPCErrorMsg(e).strip()
-            if msg == "missing required active authority":
-                raise exceptions.MissingRequiredActiveAuthority
-            elif re.match("^no method with name.*", msg):
-                raise exceptions.NoMethodWithName(msg)
-            elif msg:
-                raise exceptions.UnhandledRPCError(msg)
-            else:
-                raise e
+            error = exceptions.translateRPCError(e)
+            raise error
         except Exception as e:
+            error = e
             raise e
+        finally:
+            self.metrics.observe_call(
+                payload["params"][1], time.time() - start, error=error)
+
+    def stats(self):
+        """ Returns call counts, latency histograms, errors by exception
+            class and bytes sent/received per node, as well as cache hits
+            and misses if caching is enabled
+        """
+        stats = self.metrics.stats()
+        if self.cache is not None:
+            stats["cache"] = self.cache.stats()
+        if self.limiter is not None:
+            stats["rate_limit"] = self.limiter.stats()
+        if self.hedge_rpc is not None:
+            stats["hedge"] = self.hedge_rpc.metrics.stats()
+        return stats
+
+    def wsexec(self, payload):
+        """ Send the payload and wait for the reply. This follows
+            ``GrapheneWebsocketRPC.rpcexec`` but serializes with the
+            configured codec and only once.
+
+            :param json payload: Payload data
+            :raises ValueError: if the server does not respond in proper JSON format
+            :raises RPCError: if the server returns an error
+        """
+        data = self.codec.dumps(payload)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(data.decode("utf8"))
+        with self.lock:
+            reply = self.sendrecv(data, method=payload["params"][1])
+        return self.decode(reply)
+
+    def decode(self, reply):
+        """ Return the result of a reply
+
+            :raises ValueError: if the server does not respond in proper JSON format
+            :raises RPCError: if the server returns an error
+        """
+        try:
+            ret = self.codec.loads(reply)
+        except ValueError:
+            raise ValueError("Client returned invalid format. Expected JSON!")
+
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(reply)
+
+        if 'error' in ret:
+            if 'detail' in ret['error']:
+                error = exceptions.RPCError(ret['error']['detail'])
+            else:
+                error = exceptions.RPCError(ret['error']['message'])
+            raise error
+        else:
+            return ret["result"]
+
+    def sendrecv(self, data, method=None, request_id=None, hedge=None):
+        """ Send the serialized request and return the reply, reconnect
+            and retry if the connection is lost
+
+            :param int request_id: Id of the request
+            :param concurrent.futures.Future hedge: Hedge of the request.
+                If it succeeds before the reply arrives, ``None`` is
+                returned and the reply is dropped once it arrives.
+        """
+        if self.deferred:
+            self.connect()
+        cnt = 0
+        while True:
+            cnt += 1
+
+            url = self.url
+            if self.limiter is not None:
+                self.limiter.acquire(url)
+            start = time.time()
+            try:
+                self.ws.send(data)
+                self.metrics.observe_bytes(url, sent=byte_size(data))
+                reply = self.recv(hedge)
+                if reply is None:
+                    # The hedge answered first
+                    self.stale.add(request_id)
+                    if self.limiter is not None:
+                        self.limiter.release(url)
+                    return None
+                if self.limiter is not None:
+                    self.limiter.release(
+                        url, method, time.time() - start, throttle_error(reply))
+                break
+            except KeyboardInterrupt:
+                if self.limiter is not None:
+                    self.limiter.release(url)
+                raise
+            except Exception as e:
+                if self.limiter is not None:
+                    self.limiter.release(url, error=e)
+                if self.num_retries > -1 and cnt > self.num_retries:
+                    raise NumRetriesReached()
+                sleeptime = (cnt - 1) * 2 if cnt < 10 else 10
+                if sleeptime:
+                    log.warning(
+                        "Lost connection to node during rpcexec(): %s (%d/%d) "
+                        "Retrying in %d seconds" % (
+                            self.url, cnt, self.num_retries, sleeptime))
+                    time.sleep(sleeptime)
+
+                # retry
+                try:
+                    self.ws.close()
+                    time.sleep(sleeptime)
+                    self.wsconnect()
+                    self.register_apis()
+                except Exception:
+                    pass
+        return reply
+
+    def recv(self, hedge=None):
+        """ Receive the next reply, dropping replies of calls whose hedge
+            has won. With ``hedge``, ``None`` is returned as soon as the
+            hedge has succeeded.
+        """
+        while True:
+            if hedge is None:
+                reply = self.ws.recv()
+            else:
+                reply = self.poll(hedge)
+                if reply is None:
+                    return None
+            self.metrics.observe_bytes(self.url, received=byte_size(reply))
+            if self.stale:
+                request_id = self.codec.loads(reply).get("id")
+                if request_id in self.stale:
+                    self.stale.discard(request_id)
+                    continue
+            return reply
+
+    def poll(self, hedge):
+        """ Wait for the next message until ``hedge`` has succeeded
+        """
+        timeout = self.ws.gettimeout()
+        deadline = None if timeout is None else time.time() + timeout
+        self.ws.settimeout(hedge_poll_interval)
+        try:
+            while True:
+                try:
+                    return self.ws.recv()
+                except websocket.WebSocketTimeoutException:
+                    if hedge.done() and not hedge.cancelled() and hedge.exception() is None:
+                        return None
+                    if deadline is not None and time.time() > deadline:
+                        raise
+        finally:
+            self.ws.settimeout(timeout)
+
+    def pipeline(self, calls):
+        """ Send several database API calls at once and wait for all
+            replies, so that they cost about one round trip instead of
+            one each:
+
+            .. code-block:: python
+
+                blocks = rpc.pipeline([("get_block", [n]) for n in range(1, 51)])
+
+            :param list calls: List of ``(method, args)`` tuples
+            :returns: List of the results, in the order of ``calls``
+            :raises RPCError: if the server returns an error for any call
+
+            If the connection is lost, the calls are sent one by one
+            (with the usual retries). Pipelined calls bypass the cache and
+            are not hedged.
+        """
+        with self.lock:
+            payloads = [{
+                "method": "call",
+                "params": [0, method, list(args)],
+                "jsonrpc": "2.0",
+                "id": self.get_request_id(),
+            } for method, args in calls]
+            start = time.time()
+            try:
+                replies = self.sendrecv_many(payloads)
+            except Exception as e:
+                log.warning("Pipelined calls failed (%s), retrying one by one" % str(e))
+                return [self.timedexec(payload) for payload in payloads]
+        duration = time.time() - start
+
+        results = []
+        for payload in payloads:
+            ret = replies.get(payload["id"])
+            error = None
+            if ret is None:
+                error = ValueError("No reply for request %d" % payload["id"])
+            elif "error" in ret:
+                error = exceptions.translateRPCError(exceptions.RPCError(
+                    ret["error"].get("detail", ret["error"].get("message"))))
+            self.metrics.observe_call(payload["params"][1], duration, error=error)
+            if error:
+                raise error
+            results.append(ret["result"])
+        return results
+
+    def sendrecv_many(self, payloads):
+        """ Send all payloads, then receive all replies. Returns the
+            decoded replies by request id. The connection is closed if
+            anything goes wrong, since replies might still be pending.
+        """
+        if self.deferred:
+            self.connect()
+        url = self.url
+        replies = dict()
+        window = len(payloads)
+        if self.limiter is not None:
+            window = self.limiter.window(url)
+        for i in range(0, len(payloads), window):
+            chunk = payloads[i:i + window]
+            sent = 0
+            try:
+                for j, payload in enumerate(chunk):
+                    if self.limiter is not None:
+                        self.limiter.acquire(url, wait=(j == 0))
+                    sent += 1
+                    data = self.codec.dumps(payload)
+                    self.ws.send(data)
+                    self.metrics.observe_bytes(url, sent=byte_size(data))
+                for _ in chunk:
+                    reply = self.recv()
+                    ret = self.codec.loads(reply)
+                    replies[ret.get("id")] = ret
+                    if self.limiter is not None:
+                        sent -= 1
+                        self.limiter.release(url, error=throttle_error(reply))
+            except Exception as e:
+                if self.limiter is not None:
+                    for _ in range(sent):
+                        self.limiter.release(url, error=e)
+                try:
+                    self.ws.close()
+                except Exception:
+                    pass
+                raise
+        return replies
 
     def get_account(self, name, **kwargs):
         """ Get full account details from account name or id
@@ -48,7 +580,7 @@ class PeerPlaysNodeRPC(GrapheneWebsocketRPC):
             :param str name: Account name or account id
         """
         if len(name.split(".")) == 3:
-            return self.get_objects([name])[0]
+            return self.get_object(name)
         else:
             return self.get_account_by_name(name, **kwargs)
 
@@ -67,8 +599,40 @@ class PeerPlaysNodeRPC(GrapheneWebsocketRPC):
 
             :param str o: Full object id
         """
+        if self.batcher and not kwargs:
+            return self.batcher.get(o)
         return self.get_objects([o], **kwargs)[0]
 
+    @contextmanager
+    def batch(self, max_size=100):
+        """ Collect object lookups and obtain them with one
+            ``get_objects`` call when leaving the context. Lookups are
+            added explicitly to the batch, which returns futures that are
+            resolved on exit:
+
+            .. code-block:: python
+
+                with rpc.batch() as batch:
+                    markets = [batch.add(x) for x in ids]
+                markets = [BettingMarket(x.result()) for x in markets]
+
+            :param int max_size: Maximum number of ids per call
+
+            Calls such as :meth:`get_object` are not affected by the
+            batch and return their results right away.
+        """
+        if getattr(self.batches, "batch", None) is not None:
+            # Nested batches are merged into the outer one
+            yield self.batches.batch
+            return
+        batch = ObjectBatch(max_size)
+        self.batches.batch = batch
+        try:
+            yield batch
+        finally:
+            self.batches.batch = None
+            batch.flush(self)
+
     def get_network(self):
         """ Identify the connected network. This call returns a
             dictionary with keys chain_id, core_symbol and prefix
@@ -0,0 +1,221 @@
+import ssl
+import time
+import json
+import calendar
+import logging
+import threading
+import websocket
+
+log = logging.getLogger(__name__)
+
+
+class NodePool(object):
+    """ Keep track of the health of a set of API nodes and always hand
+        out the best healthy one.
+
+        :param list urls: Websocket URLs of the nodes
+        :param int max_lag: Nodes whose ``head_block_number`` lags more
+            than this many blocks behind the best node are evicted
+            (defaults to ``3``)
+        :param float alpha: Weight of a new sample in the moving RTT
+            average (defaults to ``0.3``)
+        :param float cooldown: Seconds a failed node is not handed out
+            again, unless no other node is healthy (defaults to ``10``)
+        :param float probe_timeout: Timeout in seconds for probing a node
+        :param float probe_interval: Re-probe all nodes when handing out a
+            node and the last probe is older than this many seconds
+        :param float block_interval: Seconds between blocks. Nodes whose
+            head block is older than ``max_lag + 1`` block intervals are
+            evicted as well, even if no other node is known to be ahead.
+
+        A node whose last probe failed is unreachable and is not handed
+        out, regardless of the cooldown, until it has been probed or used
+        successfully again. Only the heads reported by reachable nodes
+        are compared to find lagging nodes.
+
+        Nodes are probed by requesting the dynamic global properties
+        (object ``2.1.0``) which gives us a round trip time and the
+        node's ``head_block_number``. Instances of this class can be used
+        wherever an iterator over URLs is expected:
+
+        .. code-block:: python
+
+            nodes = NodePool(["wss://node1", "wss://node2"])
+            url = next(nodes)
+            ...
+            nodes.failure(url)
+    """
+    def __init__(
+        self,
+        urls,
+        max_lag=3,
+        alpha=0.3,
+        cooldown=10,
+        probe_timeout=5,
+        probe_interval=300,
+        block_interval=3,
+    ):
+        if not isinstance(urls, (list, tuple)):
+            urls = [urls]
+        self.urls = list(urls)
+        self.max_lag = max_lag
+        self.alpha = alpha
+        self.cooldown = cooldown
+        self.probe_timeout = probe_timeout
+        self.probe_interval = probe_interval
+        self.block_interval = block_interval
+        self.last_probe = None
+        self.lock = threading.Lock()
+        self.nodes = {
+            url: {
+                "rtt": None,
+                "errors": 0.0,
+                "head_block_number": None,
+                "head_age": None,
+                "failed_at": 0,
+                "reachable": True,
+            } for url in self.urls
+        }
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        stale = self.last_probe is None or time.time() - self.last_probe > self.probe_interval
+        if len(self.urls) > 1 and stale:
+            self.probe_all()
+        return self.best()
+
+    def __len__(self):
+        return len(self.urls)
+
+    def success(self, url, rtt=None, head_block_number=None, head_block_time=None):
+        """ Record a successful interaction with ``url``
+
+            :param str url: Node URL
+            :param float rtt: Measured round trip time in seconds
+            :param int head_block_number: Head block number reported by the node
+            :param str head_block_time: Time of the head block reported by
+                the node (e.g. ``2019-01-01T00:00:00``)
+        """
+        with self.lock:
+            node = self.nodes[url]
+            node["errors"] *= (1 - self.alpha)
+            node["reachable"] = True
+            if rtt is not None:
+                if node["rtt"] is None:
+                    node["rtt"] = rtt
+                else:
+                    node["rtt"] = (1 - self.alpha) * node["rtt"] + self.alpha * rtt
+            if head_block_number is not None:
+                node["head_block_number"] = head_block_number
+            if head_block_time is not None:
+                node["head_age"] = time.time() - calendar.timegm(
+                    time.strptime(head_block_time, "%Y-%m-%dT%H:%M:%S"))
+
+    def failure(self, url, reachable=True):
+        """ Record a failed interaction with ``url``
+
+            :param str url: Node URL
+            :param bool reachable: Set to ``False`` if the node could not
+                be reached at all, e.g. by a failed probe
+        """
+        with self.lock:
+            node = self.nodes[url]
+            node["errors"] += 1
+            node["failed_at"] = time.time()
+            if not reachable:
+                node["reachable"] = False
+        log.debug("Node %s failed (error score %.2f)" % (url, node["errors"]))
+
+    def head_block_number(self):
+        """ Highest head block number reported by a reachable node, or
+            ``None`` if no reachable node has reported one yet
+        """
+        heads = [
+            n["head_block_number"] for n in self.nodes.values()
+            if n["reachable"] and n["head_block_number"] is not None
+        ]
+        return max(heads) if heads else None
+
+    def healthy(self, url):
+        """ Is the node reachable, neither cooling down from a failure nor
+            lagging behind the other nodes?
+        """
+        node = self.nodes[url]
+        if not node["reachable"]:
+            return False
+        if time.time() - node["failed_at"] < self.cooldown:
+            return False
+        max_age = (self.max_lag + 1) * self.block_interval
+        if node["head_age"] is not None and node["head_age"] > max_age:
+            return False
+        head_block_number = self.head_block_number()
+        if node["head_block_number"] is not None and head_block_number is not None:
+            if node["head_block_number"] < head_block_number - self.max_lag:
+                return False
+        return True
+
+    def score(self, url):
+        """ The lower, the better. Unprobed nodes score ``0`` so that they
+            are tried at least once.
+        """
+        node = self.nodes[url]
+        return (node["rtt"] or 0.0) * (1 + node["errors"])
+
+    def best(self):
+        """ Return the URL of the best healthy node. If no node is healthy,
+            the node whose last failure is longest ago is returned.
+        """
+        with self.lock:
+            healthy = [url for url in self.urls if self.healthy(url)]
+            if healthy:
+                return min(healthy, key=self.score)
+            return min(self.urls, key=lambda url: self.nodes[url]["failed_at"])
+
+    def all_unhealthy(self):
+        return not any(self.healthy(url) for url in self.urls)
+
+    def probe(self, url):
+        """ Open a connection to ``url`` and time a request for the
+            dynamic global properties
+        """
+        try:
+            sslopt = {"cert_reqs": ssl.CERT_NONE} if url[:3] == "wss" else None
+            ws = websocket.create_connection(
+                url, timeout=self.probe_timeout, sslopt=sslopt)
+            try:
+                start = time.time()
+                ws.send(json.dumps({
+                    "method": "call",
+                    "params": [0, "get_objects", [["2.1.0"]]],
+                    "jsonrpc": "2.0",
+                    "id": 1}))
+                reply = json.loads(ws.recv(), strict=False)
+                rtt = time.time() - start
+            finally:
+                ws.close()
+            head_block_number = reply["result"][0]["head_block_number"]
+            head_block_time = reply["result"][0].get("time")
+        except Exception as e:
+            log.warning("Probing node %s failed: %s" % (url, str(e)))
+            self.failure(url, reachable=False)
+        else:
+            log.debug("Probed node %s: rtt=%.3fs head=%d" % (url, rtt, head_block_number))
+            self.success(
+                url, rtt=rtt,
+                head_block_number=head_block_number,
+                head_block_time=head_block_time)
+
+    def probe_all(self):
+        """ Probe all nodes in parallel
+        """
+        threads = [
+            threading.Thread(target=self.probe, args=(url,))
+            for url in self.urls
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.last_probe = time.time()
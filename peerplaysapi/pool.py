@@ -0,0 +1,253 @@
+import queue
+import logging
+import threading
+import websocket
+from contextlib import contextmanager
+from grapheneapi.graphenewsrpc import NumRetriesReached
+from .node import PeerPlaysNodeRPC
+from .metrics import Metrics
+from .cache import ResponseCache
+from .ratelimit import RateLimiter
+from . import exceptions
+
+log = logging.getLogger(__name__)
+
+#: Exceptions after which a connection is not reused
+connection_errors = (
+    NumRetriesReached,
+    exceptions.NumRetriesReached,
+    websocket.WebSocketException,
+    OSError,
+)
+
+
+class PooledNodeRPC(object):
+    """ Pool of :class:`peerplaysapi.node.PeerPlaysNodeRPC` connections
+        that can be shared among threads
+
+        :param str urls: Either a single Websocket URL, or a list of URLs
+        :param str user: Username for Authentication
+        :param str password: Password for Authentication
+        :param int pool_size: Maximum number of connections (defaults to
+            ``4``)
+        :param float pool_timeout: Seconds to wait for a free connection
+            before raising
+            :class:`peerplaysapi.exceptions.PoolTimeout` (defaults to
+            ``None``, wait indefinitely)
+
+        All other arguments are handed to the connections. Connections
+        are opened on demand and spread over all ``urls``, i.e. with
+        several nodes, concurrent calls go to different nodes. Metrics and
+        (with ``cache=True``) the response cache are shared by all
+        connections, and so is the rate limiter (with ``rate_limit=True``).
+
+        Every call checks out a connection and returns it afterwards:
+
+        .. code-block:: python
+
+            rpc = PooledNodeRPC(["wss://node1", "wss://node2"], pool_size=32)
+            rpc.get_objects(["2.1.0"])
+
+            with rpc.connection() as conn:
+                # consecutive calls on the same connection
+                ...
+
+        A connection that failed (see ``connection_errors``) or that has
+        been closed is discarded and replaced by a new one.
+    """
+    #: Class of the pooled connections
+    rpc_class = PeerPlaysNodeRPC
+
+    def __init__(
+        self,
+        urls,
+        user="",
+        password="",
+        pool_size=4,
+        pool_timeout=None,
+        **kwargs
+    ):
+        if not isinstance(urls, (list, tuple)):
+            urls = [urls]
+        self.urls = list(urls)
+        self.url_list = self.urls
+        self.user = user
+        self.password = password
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self.kwargs = kwargs
+        self.metrics = kwargs.get("metrics") or Metrics()
+        self.kwargs["metrics"] = self.metrics
+        self.cache = kwargs.get("cache") or None
+        if self.cache is True:
+            self.cache = ResponseCache(codec=kwargs.get("codec"))
+        self.kwargs["cache"] = self.cache
+        self.limiter = kwargs.get("rate_limit") or None
+        if self.limiter is True:
+            self.limiter = RateLimiter()
+        self.kwargs["rate_limit"] = self.limiter
+
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(pool_size)
+        self.idle = queue.LifoQueue()
+        self.connections = []
+        self.opened = 0
+        self.recycled = 0
+        self.timeouts = 0
+        self.local = threading.local()
+
+        if not kwargs.get("lazy"):
+            # Connect right away, like PeerPlaysNodeRPC does
+            with self.connection():
+                pass
+
+    @property
+    def chain_params(self):
+        """ Chain parameters of the connected network
+        """
+        with self.connection() as rpc:
+            return rpc.chain_params
+
+    def __getattr__(self, name):
+        """ Map all methods to calls on a checked out connection
+        """
+        def method(*args, **kwargs):
+            with self.connection() as rpc:
+                return getattr(rpc, name)(*args, **kwargs)
+        return method
+
+    def open(self):
+        """ Open a new connection, preferring the node the least
+            connections have been opened to so far
+        """
+        with self.lock:
+            i = self.opened % len(self.urls)
+            self.opened += 1
+        urls = self.urls[i:] + self.urls[:i]
+        rpc = self.rpc_class(urls, self.user, self.password, **self.kwargs)
+        if rpc.deferred:
+            # Opened to be used right away
+            rpc.connect()
+        with self.lock:
+            self.connections.append(rpc)
+        log.debug("Opened pooled connection to %s" % rpc.url)
+        return rpc
+
+    def discard(self, rpc):
+        """ Close a connection and remove it from the pool
+        """
+        with self.lock:
+            if rpc in self.connections:
+                self.connections.remove(rpc)
+            self.recycled += 1
+        try:
+            rpc.ws.close()
+        except Exception:
+            pass
+
+    def checkout(self, timeout=None):
+        """ Obtain a connection, opening one if none is idle and the pool
+            is not exhausted
+
+            :param float timeout: Seconds to wait for a free connection
+                (defaults to ``pool_timeout``)
+            :raises peerplaysapi.exceptions.PoolTimeout: if no connection
+                became available in time
+        """
+        if timeout is None:
+            timeout = self.pool_timeout
+        if not self.slots.acquire(timeout=timeout):
+            with self.lock:
+                self.timeouts += 1
+            raise exceptions.PoolTimeout(
+                "No connection available within %s seconds" % timeout)
+        try:
+            while True:
+                try:
+                    rpc = self.idle.get_nowait()
+                except queue.Empty:
+                    return self.open()
+                if getattr(getattr(rpc, "ws", None), "connected", True):
+                    return rpc
+                log.debug("Recycling closed connection to %s" % rpc.url)
+                self.discard(rpc)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def checkin(self, rpc):
+        """ Return a connection to the pool
+        """
+        self.idle.put(rpc)
+        self.slots.release()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """ Check out a connection for the duration of the context.
+            Within the context, all calls of the same thread use this
+            connection.
+
+            :param float timeout: Seconds to wait for a free connection
+                (defaults to ``pool_timeout``)
+        """
+        rpc = getattr(self.local, "rpc", None)
+        if rpc is not None:
+            yield rpc
+            return
+        rpc = self.checkout(timeout)
+        self.local.rpc = rpc
+        try:
+            yield rpc
+        except connection_errors + (KeyboardInterrupt,):
+            # A reply might still be pending on this connection
+            self.local.rpc = None
+            self.discard(rpc)
+            self.slots.release()
+            raise
+        except Exception:
+            self.local.rpc = None
+            self.checkin(rpc)
+            raise
+        else:
+            self.local.rpc = None
+            self.checkin(rpc)
+
+    @contextmanager
+    def batch(self, max_size=100):
+        """ Same as :meth:`peerplaysapi.node.PeerPlaysNodeRPC.batch` on a
+            connection checked out for the duration of the context
+        """
+        with self.connection() as rpc:
+            with rpc.batch(max_size) as batch:
+                yield batch
+
+    def stats(self):
+        """ Returns the metrics of all connections, and the pool's size,
+            idle connections, recycled connections and checkout timeouts
+        """
+        stats = self.metrics.stats()
+        if self.cache is not None:
+            stats["cache"] = self.cache.stats()
+        if self.limiter is not None:
+            stats["rate_limit"] = self.limiter.stats()
+        with self.lock:
+            stats["pool"] = {
+                "size": len(self.connections),
+                "max_size": self.pool_size,
+                "idle": self.idle.qsize(),
+                "recycled": self.recycled,
+                "timeouts": self.timeouts,
+            }
+        return stats
+
+    def close(self):
+        """ Close all connections
+        """
+        with self.lock:
+            connections = list(self.connections)
+            self.connections = []
+        for rpc in connections:
+            try:
+                rpc.ws.close()
+            except Exception:
+                pass
@@ -0,0 +1,247 @@
+import re
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from grapheneapi.graphenewsrpc import RPCError
+
+log = logging.getLogger(__name__)
+
+#: Error messages of nodes that throttle us
+throttle_errors = re.compile("too many|rate limit|throttl", flags=re.I)
+
+
+def is_congestion(error):
+    """ Errors that tell us to slow down: lost connections, timeouts and
+        errors of nodes that throttle us. Other errors reported by the
+        node are answers like any other.
+    """
+    if error is None:
+        return False
+    if isinstance(error, RPCError):
+        return bool(throttle_errors.search(str(error)))
+    return True
+
+
+def throttle_error(reply):
+    """ Returns an error if the raw (not yet decoded) ``reply`` is an
+        error of a node that throttles us, ``None`` otherwise
+    """
+    # The error key precedes any payload in the replies of the node
+    head = reply[:100]
+    if isinstance(head, bytes):
+        head = head.decode("utf8", "ignore")
+    if '"error"' not in head:
+        return None
+    if isinstance(reply, bytes):
+        reply = reply.decode("utf8", "ignore")
+    match = throttle_errors.search(reply)
+    if match:
+        return RPCError(match.group(0))
+
+
+class NodeLimit(object):
+    """ Token bucket and in-flight limit of a single node
+    """
+    def __init__(self, rate, concurrency):
+        self.rate = float(rate)
+        self.tokens = 1.0
+        self.updated = time.time()
+        self.concurrency = float(concurrency)
+        self.inflight = 0
+        self.baseline = dict()
+        self.decreased = 0
+        self.increases = 0
+        self.decreases = 0
+        self.waited = 0.0
+
+    def refill(self, now):
+        # A bucket holds up to one second worth of tokens
+        self.tokens = min(
+            max(self.rate, 1.0),
+            self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class RateLimiter(object):
+    """ Limits requests per second and requests in flight per node and
+        adapts both limits to what the node tolerates (additive increase,
+        multiplicative decrease)
+
+        :param float rate: Initial requests per second per node
+        :param float min_rate: Lower bound of the rate
+        :param float max_rate: Upper bound of the rate
+        :param int concurrency: Initial number of requests in flight per
+            node
+        :param int max_concurrency: Upper bound of requests in flight
+        :param float increase: Requests per second the rate grows by per
+            second of successful calls
+        :param float decrease: Factor both limits are multiplied with on
+            congestion
+        :param float latency_factor: A call is considered slow if it
+            takes longer than this many times the baseline latency of the
+            method
+        :param float baseline_decay: Fraction by which the baseline
+            latency moves towards slower replies per call
+        :param float cooldown: Seconds after a decrease during which
+            further congestion signals are ignored
+
+        Lost connections and errors of nodes that throttle us decrease
+        both limits. Slow replies only stop them from growing. The
+        baseline latency follows the fastest replies right away and
+        slower ones gradually, so that a single unusually fast reply
+        does not hold back the limits for long. An instance can be
+        shared among connections:
+
+        .. code-block:: python
+
+            from peerplaysapi.ratelimit import RateLimiter
+            limiter = RateLimiter(rate=50, max_rate=200)
+            rpc = PeerPlaysNodeRPC("wss://node.testnet.peerplays.eu", rate_limit=limiter)
+    """
+    def __init__(
+        self,
+        rate=20,
+        min_rate=1,
+        max_rate=500,
+        concurrency=8,
+        max_concurrency=64,
+        increase=1.0,
+        decrease=0.5,
+        latency_factor=4.0,
+        baseline_decay=0.01,
+        cooldown=1.0,
+    ):
+        self.initial_rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.initial_concurrency = concurrency
+        self.max_concurrency = max_concurrency
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.baseline_decay = baseline_decay
+        self.cooldown = cooldown
+        self.condition = threading.Condition(threading.RLock())
+        self.nodes = dict()
+
+    def node(self, node):
+        if node not in self.nodes:
+            self.nodes[node] = NodeLimit(self.initial_rate, self.initial_concurrency)
+        return self.nodes[node]
+
+    def acquire(self, node, wait=True):
+        """ Wait until a request may be sent to ``node``
+
+            :param str node: URL of the node
+            :param bool wait: If ``False``, the request is accounted for
+                but sent right away (e.g. from the thread that processes
+                the replies, which must never block)
+        """
+        with self.condition:
+            limit = self.node(node)
+            start = time.time()
+            while True:
+                now = time.time()
+                limit.refill(now)
+                if not wait or (
+                    limit.tokens >= 1 and limit.inflight < int(limit.concurrency)
+                ):
+                    break
+                if limit.tokens < 1:
+                    timeout = (1 - limit.tokens) / limit.rate
+                else:
+                    timeout = None
+                self.condition.wait(timeout)
+            limit.tokens -= 1
+            limit.inflight += 1
+            limit.waited += now - start
+
+    def window(self, node):
+        """ Number of requests that may be in flight to ``node``
+        """
+        with self.condition:
+            return int(self.node(node).concurrency)
+
+    def release(self, node, method=None, latency=None, error=None):
+        """ Account for a finished request and adapt the limits of
+            ``node``
+
+            :param str node: URL of the node
+            :param str method: Name of the API method
+            :param float latency: Seconds until the reply was received
+            :param Exception error: Exception raised by the call, if any
+        """
+        with self.condition:
+            limit = self.node(node)
+            limit.inflight = max(0, limit.inflight - 1)
+            slow = False
+            if error is None and method and latency is not None:
+                baseline = limit.baseline.get(method)
+                if baseline is None or latency < baseline:
+                    limit.baseline[method] = latency
+                else:
+                    slow = latency > max(baseline, 0.001) * self.latency_factor
+                    limit.baseline[method] = (
+                        baseline + (latency - baseline) * self.baseline_decay)
+            if is_congestion(error):
+                self.slow_down(node)
+            elif error is None and not slow:
+                limit.increases += 1
+                limit.rate = min(self.max_rate, limit.rate + self.increase / limit.rate)
+                limit.concurrency = min(
+                    self.max_concurrency,
+                    limit.concurrency + 1.0 / limit.concurrency)
+            self.condition.notify_all()
+
+    def slow_down(self, node):
+        """ Decrease the limits of ``node``, e.g. because it told us to
+            slow down
+        """
+        with self.condition:
+            limit = self.node(node)
+            now = time.time()
+            if now - limit.decreased > self.cooldown:
+                limit.decreased = now
+                limit.decreases += 1
+                limit.rate = max(self.min_rate, limit.rate * self.decrease)
+                limit.concurrency = max(1.0, limit.concurrency * self.decrease)
+                log.info("Slowing down requests to %s: %.1f/s, %d in flight" % (
+                    node, limit.rate, limit.concurrency))
+
+    @contextmanager
+    def limit(self, node, method=None):
+        """ Acquire before and release after a call
+
+            .. code-block:: python
+
+                with limiter.limit(url, "get_block"):
+                    ...
+        """
+        self.acquire(node)
+        start = time.time()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.release(node, method, time.time() - start, error)
+
+    def stats(self):
+        """ Returns the current rate, in-flight limit, requests in flight,
+            number of increases and decreases and seconds spent waiting
+            per node
+        """
+        with self.condition:
+            return {
+                node: {
+                    "rate": limit.rate,
+                    "concurrency": int(limit.concurrency),
+                    "inflight": limit.inflight,
+                    "increases": limit.increases,
+                    "decreases": limit.decreases,
+                    "waited": limit.waited,
+                } for node, limit in self.nodes.items()
+            }
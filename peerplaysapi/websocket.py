@@ -7,23 +7,121 @@ import logging
 import websocket
 from itertools import cycle
 from threading import Thread
-from .exceptions import NumRetriesReached
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from .exceptions import NumRetriesReached, RPCError, ConnectionClosed
+from .nodepool import NodePool
+from .dispatch import Dispatcher, NoticeCoalescer
+from .codec import get_codec
+from .metrics import Metrics, byte_size
+from .ratelimit import RateLimiter
 from events import Events
 
 log = logging.getLogger(__name__)
 # logging.basicConfig(level=logging.DEBUG)
 
 
+class SubscriptionMatcher(object):
+    """ Matches object ids against a set of subscriptions.
+
+        :param list objects: Object ids (``1.21.42``) or wildcards for all
+            objects of a space and type (``1.21.x``)
+
+        Subscriptions are compiled into a set of exact ids and a set of
+        ``space.type`` prefixes, so that matching a notice is a constant
+        time operation regardless of the number of subscriptions. The sets
+        are replaced (not mutated) on changes, so that matching from
+        another thread is safe.
+    """
+    def __init__(self, objects=[]):
+        self.ids = frozenset()
+        self.prefixes = frozenset()
+        self.lock = threading.Lock()
+        self.add(objects)
+
+    def compile(self, objects):
+        ids = set()
+        prefixes = set()
+        for o in objects:
+            prefix, _, instance = o.rpartition(".")
+            if prefix.count(".") != 1:
+                raise ValueError("Invalid object id %s" % o)
+            if instance == "x":
+                prefixes.add(prefix)
+            else:
+                ids.add(o)
+        return ids, prefixes
+
+    def add(self, objects):
+        """ Add subscriptions
+        """
+        ids, prefixes = self.compile(objects)
+        with self.lock:
+            self.ids = self.ids | ids
+            self.prefixes = self.prefixes | prefixes
+
+    def remove(self, objects):
+        """ Remove subscriptions
+        """
+        ids, prefixes = self.compile(objects)
+        with self.lock:
+            self.ids = self.ids - ids
+            self.prefixes = self.prefixes - prefixes
+
+    def match(self, id):
+        """ Is the object ``id`` subscribed to?
+        """
+        return id in self.ids or id[:id.rfind(".")] in self.prefixes
+
+    __contains__ = match
+
+    def __iter__(self):
+        return iter(
+            sorted(self.ids) + sorted(p + ".x" for p in self.prefixes))
+
+    def __len__(self):
+        return len(self.ids) + len(self.prefixes)
+
+
 class PeerPlaysWebsocket(Events):
     """ Create a websocket connection and request push notifications
 
-        :param str urls: Either a single Websocket URL, or a list of URLs
+        :param str urls: Either a single Websocket URL, a list of URLs, or a
+            :class:`peerplaysapi.nodepool.NodePool`
         :param str user: Username for Authentication
         :param str password: Password for Authentication
         :param list accounts: list of account names or ids to get push notifications for
         :param list markets: list of asset_ids, e.g. ``[['1.3.0', '1.3.121']]``
         :param list objects: list of objects id's you'd like to be notified when changing
         :param int keep_alive: seconds between a ping to the backend (defaults to 25seconds)
+        :param int ping_timeout: seconds to wait for a reply to a ping
+            before reconnecting (defaults to 10 seconds)
+        :param int dispatch_workers: Number of threads that call the slots.
+            Defaults to ``0``, which calls the slots on the receiving thread
+        :param int dispatch_queue_size: Maximum number of pending notices
+            per dispatch thread
+        :param str dispatch_policy: ``block``, ``drop_oldest`` or
+            ``coalesce`` if the dispatch queue is full (see
+            :class:`peerplaysapi.dispatch.Dispatcher`)
+        :param float coalesce_window: Only hand over the latest state of
+            each object that changed within this many seconds, or within
+            one block if set to ``"block"`` (defaults to ``None``, every
+            notice is handed over)
+        :param str codec: JSON codec to use (``orjson``, ``ujson`` or
+            ``json``), defaults to the fastest one installed
+        :param peerplaysapi.metrics.Metrics metrics: Collect metrics in
+            this instance (see :meth:`stats`)
+        :param bool replay_blocks: Call ``on_block`` for blocks that have
+            been missed, e.g. while reconnecting (defaults to ``True``)
+        :param int replay_batch_size: Number of ``get_block`` requests in
+            flight while replaying missed blocks
+        :param rate_limit: Limit and adapt requests per second and in
+            flight per node, either ``True`` or a
+            :class:`peerplaysapi.ratelimit.RateLimiter` instance. Requests
+            issued from within callbacks are never delayed.
+
+        If multiple URLs are provided, the nodes are probed for latency
+        and head block and we always connect to the best healthy node
+        (see :class:`peerplaysapi.nodepool.NodePool`).
 
         After instanciating this class, you can add event slots for:
 
@@ -88,7 +186,24 @@ class PeerPlaysWebsocket(Events):
 
                 ['1.7.68612']
 
+        RPC calls issued on this class (e.g. ``ws.get_objects(["2.0.0"])``)
+        do not block. They return a :class:`concurrent.futures.Future`
+        that is resolved once the reply carrying the same request id is
+        received. Hence, many requests can be in flight on the same
+        connection at once:
+
+        .. code-block:: python
+
+            futures = [ws.get_objects([x]) for x in ["1.2.0", "1.2.1"]]
+            objects = [f.result(timeout=10) for f in futures]
+
+        .. note:: Do not wait for a future from within a callback/slot,
+                  since replies are received on the very same thread!
+
     """
+    #: Seconds to wait for replies to requests issued internally
+    rpc_timeout = 30
+
     __events__ = [
         'on_tx',
         'on_object',
@@ -112,23 +227,64 @@ class PeerPlaysWebsocket(Events):
         on_account=None,
         on_market=None,
         keep_alive=25,
+        ping_timeout=10,
         num_retries=-1,
+        dispatch_workers=0,
+        dispatch_queue_size=1000,
+        dispatch_policy="block",
+        coalesce_window=None,
+        codec=None,
+        metrics=None,
+        replay_blocks=True,
+        replay_batch_size=50,
+        rate_limit=None,
         **kwargs
     ):
 
         self.num_retries = num_retries
         self.keepalive = None
+        self.keepalive_stop = threading.Event()
+        self.connected = False
+        self.running = True
+        self.running_lock = threading.Lock()
+        self.ping_timeout = ping_timeout
+        self.ping_rtt = None
+        self.ping_rtt_avg = None
+        self.ping_timeouts = 0
         self._request_id = 0
+        self._requests = dict()
+        self._requests_lock = threading.Lock()
         self.ws = None
+        self.url = None
         self.user = user
         self.password = password
         self.keep_alive = keep_alive
-        if isinstance(urls, cycle):
+        self.connection_attempts = 0
+        self.codec = get_codec(codec)
+        self.metrics = metrics or Metrics()
+        self.replay_blocks = replay_blocks
+        self.replay_batch_size = replay_batch_size
+        self.limiter = RateLimiter() if rate_limit is True else rate_limit
+        self.receive_thread = None
+        self.last_block_num = None
+        self.held_blocks = []
+        self.backfill_thread = None
+        self.block_lock = threading.RLock()
+        self.dispatcher = None
+        if dispatch_workers:
+            self.dispatcher = Dispatcher(
+                workers=dispatch_workers,
+                maxsize=dispatch_queue_size,
+                policy=dispatch_policy)
+        self.coalescer = None
+        if coalesce_window:
+            self.coalescer = NoticeCoalescer(
+                self.dispatch,
+                window=None if coalesce_window == "block" else coalesce_window)
+        if isinstance(urls, (cycle, NodePool)):
             self.urls = urls
-        elif isinstance(urls, list):
-            self.urls = cycle(urls)
         else:
-            self.urls = cycle([urls])
+            self.urls = NodePool(urls)
 
         # Instanciate Events
         Events.__init__(self, *args, **kwargs)
@@ -137,7 +293,7 @@ class PeerPlaysWebsocket(Events):
         # Store the objects we are interested in
         self.subscription_accounts = accounts
         self.subscription_markets = markets
-        self.subscription_objects = objects
+        self.subscription_objects = SubscriptionMatcher(objects)
 
         if on_tx:
             self.on_tx += on_tx
@@ -153,6 +309,38 @@ class PeerPlaysWebsocket(Events):
     def cancel_subscriptions(self):
         self.cancel_all_subscriptions()
 
+    def subscribe_objects(self, objects):
+        """ Subscribe to more objects without reconnecting
+
+            :param list objects: Object ids (``1.21.42``) or wildcards
+                (``1.21.x``)
+        """
+        self.subscription_objects.add(objects)
+        if getattr(self.ws, "sock", None) and len(self.on_object):
+            self.fetch_subscribed_objects(
+                [o for o in objects if o[-2:] != ".x"])
+
+    def unsubscribe_objects(self, objects):
+        """ Stop being notified about objects without reconnecting
+
+            :param list objects: Object ids (``1.21.42``) or wildcards
+                (``1.21.x``) as previously subscribed to
+
+            .. note:: The node keeps sending notices for these objects
+                      until the next reconnect, but they are no longer
+                      handed to ``on_object``.
+        """
+        self.subscription_objects.remove(objects)
+
+    def fetch_subscribed_objects(self, ids, chunk_size=100):
+        """ The node only notifies about objects that have been looked up
+            after ``set_subscribe_callback``. Hence, we look up the
+            objects we are subscribed to.
+        """
+        ids = list(ids)
+        for i in range(0, len(ids), chunk_size):
+            self.get_objects(ids[i:i + chunk_size])
+
     def on_open(self, ws):
         """ This method will be called once the websocket connection is
             established. It will
@@ -162,6 +350,13 @@ class PeerPlaysWebsocket(Events):
             * subscribe to the objects defined if there is a
               callback/slot available for callbacks
         """
+        if not self.running:
+            # Closed while connecting
+            ws.close()
+            return
+        self.connection_attempts = 0
+        if isinstance(self.urls, NodePool):
+            self.urls.success(self.url)
         self.login(self.user, self.password, api_id=1)
         self.database(api_id=1)
         self.cancel_all_subscriptions()
@@ -172,12 +367,15 @@ class PeerPlaysWebsocket(Events):
             self.set_subscribe_callback(
                 self.__events__.index('on_object'),
                 False)
+            self.fetch_subscribed_objects(self.subscription_objects.ids)
 
         if len(self.on_tx):
             self.set_pending_transaction_callback(
                 self.__events__.index('on_tx'))
 
-        if len(self.on_block):
+        if len(self.on_block) or (
+            self.coalescer and not self.coalescer.window
+        ):
             self.set_block_applied_callback(
                 self.__events__.index('on_block'))
 
@@ -194,18 +392,105 @@ class PeerPlaysWebsocket(Events):
                     self.__events__.index('on_market'),
                     market[0], market[1])
 
-        # We keep the connetion alive by requesting a short object
-        def ping(self):
-            while 1:
-                log.debug('Sending ping')
-                self.get_objects(["2.8.0"])
-                time.sleep(self.keep_alive)
-
-        self.keepalive = threading.Thread(
-            target=ping,
-            args=(self,)
-        )
-        self.keepalive.start()
+        # We keep the connetion alive by requesting a short object. There
+        # is only one keepalive thread per instance across reconnects
+        self.connected = True
+        if not self.keepalive or not self.keepalive.is_alive():
+            self.keepalive_stop.clear()
+            self.keepalive = threading.Thread(
+                target=self.ping,
+                name="peerplays-keepalive",
+                daemon=True
+            )
+            self.keepalive.start()
+
+    def ping(self):
+        """ Request the dynamic global properties every ``keep_alive``
+            seconds while connected, and use the round trip as latency
+            sample. If the reply does not arrive within ``ping_timeout``
+            seconds, the connection is closed, which makes ``run_forever``
+            reconnect. With a :class:`peerplaysapi.nodepool.NodePool`, the
+            head block of the node is checked as well, and we reconnect
+            to another node once the node is lagging behind.
+        """
+        while not self.keepalive_stop.wait(self.keep_alive):
+            if not self.connected:
+                continue
+            log.debug('Sending ping')
+            start = time.time()
+            try:
+                props = self.get_objects(["2.1.0"]).result(timeout=self.ping_timeout)[0]
+            except FutureTimeoutError:
+                self.ping_timeouts += 1
+                self.metrics.increment("ping_timeouts_total", node=self.url)
+                log.warning(
+                    "Ping to %s timed out after %ds, reconnecting" %
+                    (self.url, self.ping_timeout))
+                if self.ws:
+                    self.ws.close()
+                continue
+            except Exception as e:
+                log.warning("Ping to %s failed: %s" % (self.url, str(e)))
+                continue
+            rtt = time.time() - start
+            self.ping_rtt = rtt
+            if self.ping_rtt_avg is None:
+                self.ping_rtt_avg = rtt
+            else:
+                self.ping_rtt_avg = 0.8 * self.ping_rtt_avg + 0.2 * rtt
+            self.metrics.set_gauge("ping_rtt_seconds", rtt, node=self.url)
+            if isinstance(self.urls, NodePool):
+                self.urls.success(
+                    self.url, rtt=rtt,
+                    head_block_number=props["head_block_number"],
+                    head_block_time=props["time"])
+                if not self.urls.healthy(self.url) and not self.urls.all_unhealthy():
+                    log.warning(
+                        "Node %s is lagging behind (head block %d), reconnecting" % (
+                            self.url, props["head_block_number"]))
+                    if self.ws:
+                        self.ws.close()
+
+    def stats(self):
+        """ Returns call counts, latency histograms, errors and bytes
+            sent/received per node, as well as the state of the dispatch
+            queue, the coalescer and the rate limiter (if any)
+        """
+        stats = self.metrics.stats()
+        if self.dispatcher:
+            stats["dispatch"] = self.dispatcher.stats()
+        if self.coalescer:
+            stats["coalesce"] = self.coalescer.stats()
+        if self.limiter is not None:
+            stats["rate_limit"] = self.limiter.stats()
+        return stats
+
+    def prometheus(self):
+        """ Returns the metrics in Prometheus text exposition format
+        """
+        if self.dispatcher:
+            for key, value in self.dispatcher.stats().items():
+                self.metrics.set_gauge("dispatch_" + key, value)
+        if self.coalescer:
+            for key, value in self.coalescer.stats().items():
+                self.metrics.set_gauge("coalesce_" + key, value)
+        return self.metrics.prometheus()
+
+    def close(self):
+        """ Stop the keepalive, close the connection and return from
+            ``run_forever``. Pending coalesced notices are handed over and
+            the dispatch threads end once they have delivered them.
+        """
+        with self.running_lock:
+            self.running = False
+            ws = self.ws
+        self.keepalive_stop.set()
+        if ws:
+            ws.close()
+        if self.coalescer:
+            self.coalescer.stop()
+        if self.dispatcher:
+            self.dispatcher.stop(wait=False)
 
     def process_notice(self, notice):
         """ This method is called on notices that need processing. Here,
@@ -213,17 +498,36 @@ class PeerPlaysWebsocket(Events):
         """
         id = notice["id"]
 
-        _a, _b, _ = id.split(".")
-
-        if id in self.subscription_objects:
-            self.on_object(notice)
-
-        elif ".".join([_a, _b, "x"]) in self.subscription_objects:
-            self.on_object(notice)
+        if self.subscription_objects.match(id):
+            callbackname = "on_object"
 
         elif id[:4] == "2.6.":
             # Treat account updates separately
-            self.on_account(notice)
+            callbackname = "on_account"
+
+        else:
+            return
+
+        if self.coalescer:
+            self.coalescer.add(callbackname, notice)
+        else:
+            self.dispatch(callbackname, notice, key=id)
+
+    def dispatch(self, callbackname, notice, key=None):
+        """ Call the slot ``callbackname`` with the notice. If a
+            dispatcher has been configured, the call is handed over to its
+            worker threads. Notices with the same ``key`` (defaults to the
+            name of the slot) are delivered in order.
+        """
+        callback = getattr(self.events, callbackname)
+        if self.dispatcher:
+            self.dispatcher.submit(
+                key or callbackname,
+                callback,
+                notice,
+                coalesce=key is not None)
+        else:
+            callback(notice)
 
     def on_message(self, ws, reply, *args):
         """ This method is called by the websocket connection on every
@@ -231,14 +535,19 @@ class PeerPlaysWebsocket(Events):
             hand over post-processing and signalling of events to
             ``process_notice``.
         """
-        log.debug("Received message: %s" % str(reply))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Received message: %s" % str(reply))
+        self.metrics.observe_bytes(self.url, received=byte_size(reply))
         data = {}
         try:
-            data = json.loads(reply, strict=False)
+            data = self.codec.loads(reply)
         except ValueError:
             raise ValueError("API node returned invalid format. Expected JSON!")
 
-        if data.get("method") == "notice":
+        if "id" in data and data.get("method") != "notice":
+            self.process_reply(data)
+
+        elif data.get("method") == "notice":
             id = data["params"][0]
 
             if id >= len(self.__events__):
@@ -265,57 +574,156 @@ class PeerPlaysWebsocket(Events):
                 try:
                     callbackname = self.__events__[id]
                     log.info("Patching through to call %s" % callbackname)
-                    [getattr(self.events, callbackname)(x) for x in data["params"][1]]
+                    if callbackname == "on_block":
+                        if self.coalescer:
+                            self.coalescer.flush()
+                        [self.process_block(x) for x in data["params"][1]]
+                    else:
+                        [self.dispatch(callbackname, x) for x in data["params"][1]]
                 except Exception as e:
                     log.critical("Error in {}: {}\n\n{}".format(
                         callbackname, str(e), traceback.format_exc()))
 
+    def process_block(self, block_id):
+        """ This method is called for every block that has been applied.
+            If we have missed blocks (e.g. while reconnecting), the ids of
+            the missing blocks are obtained first and ``on_block`` is
+            called for all of them in order. Live notices received in the
+            meantime are held back.
+        """
+        block_num = int(block_id[:8], 16)
+        with self.block_lock:
+            if self.backfill_thread:
+                self.held_blocks.append(block_id)
+                return
+            last = self.last_block_num
+            if self.replay_blocks and last and block_num > last + 1:
+                log.warning("Missed blocks %d to %d, backfilling" % (last + 1, block_num - 1))
+                self.held_blocks = [block_id]
+                self.backfill_thread = threading.Thread(
+                    target=self.backfill,
+                    args=(last + 1, block_num),
+                    daemon=True
+                )
+                self.backfill_thread.start()
+                return
+            self.last_block_num = block_num
+            self.dispatch("on_block", block_id)
+
+    def backfill(self, start, stop):
+        """ Call ``on_block`` for the blocks ``start`` to ``stop - 1``.
+
+            Block ids are not part of the blocks. Hence, we obtain
+            blocks ``start + 1`` to ``stop`` and take the id from their
+            ``previous`` field. Blocks are requested in batches of
+            ``replay_batch_size`` requests in flight.
+        """
+        try:
+            nums = list(range(start + 1, stop + 1))
+            for i in range(0, len(nums), self.replay_batch_size):
+                futures = [
+                    self.get_block(n)
+                    for n in nums[i:i + self.replay_batch_size]
+                ]
+                for future in futures:
+                    block = future.result(timeout=self.rpc_timeout)
+                    with self.block_lock:
+                        self.last_block_num = int(block["previous"][:8], 16)
+                        self.dispatch("on_block", block["previous"])
+        except Exception as e:
+            log.critical("Could not backfill blocks {} to {}: {}\n\n{}".format(
+                start, stop - 1, str(e), traceback.format_exc()))
+            with self.block_lock:
+                # Don't try again to backfill what we have just failed to
+                self.last_block_num = None
+        finally:
+            with self.block_lock:
+                held = self.held_blocks
+                self.held_blocks = []
+                self.backfill_thread = None
+                for block_id in held:
+                    self.process_block(block_id)
+
+    def process_reply(self, data):
+        """ This method is called on replies to RPC calls. It resolves the
+            future that has been handed out by ``rpcexec`` for the
+            request id carried by the reply.
+        """
+        with self._requests_lock:
+            future = self._requests.pop(data["id"], None)
+        if future is None:
+            log.warning("Received reply for unknown request id %s" % str(data["id"]))
+            return
+
+        error = None
+        if "error" in data:
+            if "detail" in data["error"]:
+                error = RPCError(data["error"]["detail"])
+            else:
+                error = RPCError(data["error"]["message"])
+        self.metrics.observe_call(future.method, time.time() - future.start, error=error)
+        if self.limiter is not None:
+            self.limiter.release(
+                future.node, future.method, time.time() - future.start, error)
+        if error:
+            future.set_exception(error)
+        else:
+            future.set_result(data.get("result"))
+
+    def cancel_requests(self):
+        """ Fail all requests that are still in flight, e.g. because
+            the connection has been closed
+        """
+        with self._requests_lock:
+            requests = self._requests
+            self._requests = dict()
+        for future in requests.values():
+            if self.limiter is not None:
+                self.limiter.release(future.node, error=ConnectionClosed())
+            if not future.done():
+                future.set_exception(
+                    ConnectionClosed("Connection closed before reply was received"))
+
     def on_error(self, ws, error):
         """ Called on websocket errors
         """
         log.exception(error)
 
-    def on_close(self, ws):
+    def on_close(self, ws, *args):
         """ Called when websocket connection is closed
         """
         log.debug('Closing WebSocket connection with {}'.format(self.url))
-        if self.keepalive and self.keepalive.is_alive():
-            self.keepalive.do_run = False
-            self.keepalive.join()
+        self.connected = False
+        self.cancel_requests()
 
     def run_forever(self):
         """ This method is used to run the websocket app continuously.
             It will execute callbacks as defined and try to stay
             connected with the provided APIs
         """
-        cnt = 0
-        while True:
-            cnt += 1
+        self.connection_attempts = 0
+        self.receive_thread = threading.current_thread()
+        while self.running:
+            self.connection_attempts += 1
             self.url = next(self.urls)
             log.debug("Trying to connect to node %s" % self.url)
             try:
-                # websocket.enableTrace(True)
-                self.ws = websocket.WebSocketApp(
-                    self.url,
-                    on_message=self.on_message,
-                    # on_data=self.on_message,
-                    on_error=self.on_error,
-                    on_close=self.on_close,
-                    on_open=self.on_open
-                )
+                # A close() from now on closes this connection
+                with self.running_lock:
+                    if not self.running:
+                        break
+                    # websocket.enableTrace(True)
+                    self.ws = websocket.WebSocketApp(
+                        self.url,
+                        on_message=self.on_message,
+                        # on_data=self.on_message,
+                        on_error=self.on_error,
+                        on_close=self.on_close,
+                        on_open=self.on_open
+                    )
                 self.ws.run_forever()
             except websocket.WebSocketException as exc:
-                if (self.num_retries >= 0 and cnt > self.num_retries):
-                    raise NumRetriesReached()
-
-                sleeptime = (cnt - 1) * 2 if cnt < 10 else 10
-                if sleeptime:
-                    log.warning(
-                        "Lost connection to node during wsconnect(): %s (%d/%d) "
-                        % (self.url, cnt, self.num_retries) +
-                        "Retrying in %d seconds" % sleeptime
-                    )
-                    time.sleep(sleeptime)
+                log.warning("Websocket error with node %s: %s" % (self.url, str(exc)))
 
             except KeyboardInterrupt:
                 self.ws.keep_running = False
@@ -324,9 +732,31 @@ class PeerPlaysWebsocket(Events):
             except Exception as e:
                 log.critical("{}\n\n{}".format(str(e), traceback.format_exc()))
 
+            # If we end up here, the connection could not be established,
+            # has been lost, or we have been closed
+            if not self.running:
+                break
+            cnt = self.connection_attempts
+            if isinstance(self.urls, NodePool):
+                self.urls.failure(self.url)
+            if (self.num_retries >= 0 and cnt > self.num_retries):
+                raise NumRetriesReached()
+
+            # Only back off if there is no healthy node to fail over to
+            if isinstance(self.urls, NodePool) and not self.urls.all_unhealthy():
+                continue
+            sleeptime = (cnt - 1) * 2 if cnt < 10 else 10
+            if sleeptime:
+                log.warning(
+                    "Lost connection to node during wsconnect(): %s (%d/%d) "
+                    "Retrying in %d seconds" % (
+                        self.url, cnt, self.num_retries, sleeptime))
+                time.sleep(sleeptime)
+
     def get_request_id(self):
-        self._request_id += 1
-        return self._request_id
+        with self._requests_lock:
+            self._request_id += 1
+            return self._request_id
 
     """ RPC Calls
     """
@@ -334,11 +764,37 @@ class PeerPlaysWebsocket(Events):
         """ Execute a call by sending the payload
 
             :param json payload: Payload data
-            :raises ValueError: if the server does not respond in proper JSON format
-            :raises RPCError: if the server returns an error
+            :returns: Future that resolves to the result of the call
+            :rtype: concurrent.futures.Future
+
+            The future raises ``RPCError`` if the server returns an
+            error, and ``ConnectionClosed`` if the connection is lost
+            before a reply is received.
         """
-        log.debug(json.dumps(payload))
-        self.ws.send(json.dumps(payload, ensure_ascii=False).encode('utf8'))
+        if self.limiter is not None:
+            # The receiving thread must never wait for replies
+            self.limiter.acquire(
+                self.url,
+                wait=threading.current_thread() is not self.receive_thread)
+        future = Future()
+        future.method = payload["params"][1]
+        future.node = self.url
+        future.start = time.time()
+        with self._requests_lock:
+            self._requests[payload["id"]] = future
+        data = self.codec.dumps(payload)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(data.decode("utf8"))
+        try:
+            self.ws.send(data)
+            self.metrics.observe_bytes(self.url, sent=byte_size(data))
+        except Exception as e:
+            with self._requests_lock:
+                self._requests.pop(payload["id"], None)
+            if self.limiter is not None:
+                self.limiter.release(future.node, error=e)
+            future.set_exception(e)
+        return future
 
     def __getattr__(self, name):
         """ Map all methods to RPC calls and pass through the arguments
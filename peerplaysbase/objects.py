@@ -13,7 +13,7 @@ from .chains import known_chains
 from .objecttypes import object_type
 from .account import PublicKey
 from graphenebase.objects import Operation as GPHOperation
-from .operationids import operations
+from .operationids import operations, getOperationNameForId
 from .types import Enum
 default_prefix = "PPY"
 
@@ -53,10 +53,7 @@ class Operation(GPHOperation):
     def getOperationNameForId(self, i):
         """ Convert an operation id into the corresponding string
         """
-        for key in operations:
-            if int(operations[key]) is int(i):
-                return key
-        return "Unknown Operation ID %d" % i
+        return getOperationNameForId(i)
 
     def json(self):
         return json.loads(str(self))
@@ -72,13 +72,20 @@ ops = [
     "betting_market_group_update",
     "betting_market_update",
 ]
-operations = {o: ops.index(o) for o in ops}
+operations = {o: i for i, o in enumerate(ops)}
 
 
 def getOperationNameForId(i):
     """ Convert an operation id into the corresponding string
     """
-    for key in operations:
-        if int(operations[key]) is int(i):
-            return key
+    i = int(i)
+    if 0 <= i < len(ops):
+        return ops[i]
     return "Unknown Operation ID %d" % i
+
+
+def getOperationIdsForNames(names):
+    """ Convert operation names into the set of their ids. Unknown names
+        are ignored.
+    """
+    return {operations[name] for name in names if name in operations}
@@ -52,6 +52,10 @@ setup(
         "pycrypto",
         "click-datetime"
     ],
+    extras_require={
+        "async": ["websockets"],
+        "fast": ["orjson"],
+    },
     setup_requires=['pytest-runner'],
     tests_require=['pytest'],
     include_package_data=True,
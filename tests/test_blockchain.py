@@ -0,0 +1,446 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from peerplays import blockchain
+from peerplays.blockchain import Blockchain, ReversibleBlocks
+from peerplays.blockstore import BlockStore, index_entry
+from peerplays.cursor import Cursor, MemoryCursorStore
+from peerplays.exceptions import BlockStoreCorruptException
+from peerplaysbase.operationids import (
+    operations, getOperationNameForId, getOperationIdsForNames)
+from peerplays.utils import formatTime
+from test_node import FakeNodeRPC
+
+
+class FakeChainRPC(FakeNodeRPC):
+    """ Serves a chain of ``head`` blocks
+    """
+    head = 100
+
+    def wsexec(self, payload):
+        _, method, args = payload["params"]
+        if method == "get_block":
+            self.requests.append((method, args))
+            return {
+                "timestamp": "2018-01-01T00:00:00",
+                "transactions": [{"operations": [
+                    [0, {"block": args[0], "i": 0}],
+                    [operations["bet_matched"], {"block": args[0], "i": 1}],
+                ]}],
+            }
+        elif method == "get_block_header":
+            self.requests.append((method, args))
+            return {"timestamp": formatTime(float(self.block_time(args[0])))}
+        elif method == "get_objects" and args[0] == ["2.0.0"]:
+            return [{"id": "2.0.0", "parameters": {"block_interval": 3}}]
+        elif method == "get_dynamic_global_properties":
+            return {
+                "head_block_number": self.head,
+                "time": formatTime(float(self.block_time(self.head))),
+                "last_irreversible_block_num": self.head}
+        return super(FakeChainRPC, self).wsexec(payload)
+
+    @staticmethod
+    def block_time(block_num):
+        # Every seventh slot has been missed
+        slot = block_num + block_num // 6
+        return 1514764800 + 3 * slot
+
+
+def second_ops(op):
+    if op["op"][1]["i"] == 1:
+        return op["block_num"]
+
+
+class FakeTimestampIndex(object):
+
+    def __init__(self):
+        self.blocks = dict()
+
+    def add(self, chain_id, block_num, timestamp):
+        self.blocks[block_num] = timestamp
+
+    def bracket(self, chain_id, timestamp):
+        before = [(n, t) for n, t in self.blocks.items() if t <= timestamp]
+        after = [(n, t) for n, t in self.blocks.items() if t > timestamp]
+        return (
+            max(before, key=lambda x: x[1]) if before else None,
+            min(after, key=lambda x: x[1]) if after else None)
+
+
+class FakeNotifier(object):
+    """ Applies a new block whenever we wait for one
+    """
+    instances = []
+
+    def __init__(self, urls, user="", password=""):
+        self.urls = urls
+        self.closed = False
+        FakeNotifier.instances.append(self)
+
+    def wait(self, seen, timeout):
+        FakePeerPlays.instance.rpc.head += 1
+        return FakePeerPlays.instance.rpc.head
+
+    def close(self):
+        self.closed = True
+
+
+class FakeForkRPC(object):
+    """ A chain whose blocks can be replaced to simulate micro-forks
+    """
+    def __init__(self):
+        self.chain = dict()
+        self.lib = 0
+
+    def block_id(self, num):
+        return "%08x" % num + self.chain[num]["witness"] * 32
+
+    def produce(self, num, witness):
+        """ Produce block ``num`` on top of block ``num - 1`` and drop
+            all blocks after it
+        """
+        for n in [x for x in self.chain if x >= num]:
+            self.chain.pop(n)
+        self.chain[num] = {
+            "previous": self.block_id(num - 1) if num > 1 else "00" * 20,
+            "timestamp": "2018-01-01T00:00:%02d" % num,
+            "witness": witness,
+            "transactions": [],
+        }
+
+    def get_block(self, num):
+        block = self.chain.get(num)
+        return dict(block) if block else None
+
+    def info(self):
+        head = max(self.chain)
+        return {
+            "head_block_number": head,
+            "head_block_id": self.block_id(head),
+            "time": self.chain[head]["timestamp"],
+            "current_witness": self.chain[head]["witness"],
+            "last_irreversible_block_num": self.lib,
+        }
+
+
+class FakePeerPlays(object):
+
+    def __init__(self):
+        self.rpc = FakeChainRPC()
+        FakePeerPlays.instance = self
+
+
+class Testcases(unittest.TestCase):
+
+    def setUp(self):
+        self.peerplays = FakePeerPlays()
+        self.chain = Blockchain(peerplays_instance=self.peerplays)
+
+    def test_blocks_in_order(self):
+        blocks = list(self.chain.blocks(start=1, stop=50))
+        self.assertEqual([b["block_num"] for b in blocks], list(range(1, 51)))
+
+    def test_blocks_prefetch(self):
+        blocks = list(self.chain.blocks(start=1, stop=95, prefetch=20))
+        self.assertEqual([b["block_num"] for b in blocks], list(range(1, 96)))
+        pipelined = [x for x in self.peerplays.rpc.requests if x[0] == "pipeline"]
+        self.assertEqual([x[1] for x in pipelined], [20, 20, 20, 20, 15])
+
+        ops = list(self.chain.stream(start=10, stop=12, prefetch=2))
+        self.assertEqual([op["block"] for op in ops], [10, 10, 11, 11, 12, 12])
+        self.assertEqual(ops[0]["type"], "transfer")
+
+    def test_blocks_prefetch_stops_early(self):
+        blocks = self.chain.blocks(start=1, stop=100, prefetch=10)
+        next(blocks)
+        blocks.close()
+        pipelined = [x for x in self.peerplays.rpc.requests if x[0] == "pipeline"]
+        self.assertLessEqual(len(pipelined), 3)
+
+    def test_blocks_push(self):
+        notifier = blockchain.BlockNotifier
+        blockchain.BlockNotifier = FakeNotifier
+        try:
+            start = time.time()
+            blocks = list(self.chain.blocks(start=99, stop=103, push=True))
+        finally:
+            blockchain.BlockNotifier = notifier
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual([b["block_num"] for b in blocks], [99, 100, 101, 102, 103])
+        self.assertEqual(FakeNotifier.instances[-1].urls, ["ws://localhost:8090"])
+        self.assertTrue(FakeNotifier.instances[-1].closed)
+
+    def test_cursor(self):
+        store = MemoryCursorStore()
+        cursor = Cursor("test", store=store, commit_every=1000)
+        ops = self.chain.stream(start=10, stop=20, cursor=cursor)
+        self.assertEqual([(x["block"], x["i"]) for x in [next(ops) for i in range(3)]], [
+            (10, 0), (10, 1), (11, 0)])
+        self.assertEqual(store.load("test"), None)
+        ops.close()
+        # The last operation handed out has not been processed yet
+        self.assertEqual(store.load("test"), (11, 0))
+
+        cursor = Cursor("test", store=store)
+        ops = self.chain.stream(start=1, stop=20, cursor=cursor)
+        self.assertEqual((next(ops)["block"], next(ops)["i"]), (11, 1))
+        ops.close()
+        self.assertEqual(store.load("test"), (11, 1))
+
+        cursor = Cursor("test", store=store, commit_every=2)
+        ops = list(self.chain.stream(stop=12, cursor=cursor))
+        self.assertEqual([(x["block"], x["i"]) for x in ops], [(11, 1), (12, 0), (12, 1)])
+        self.assertEqual(store.load("test"), (13, 0))
+
+    def test_cursor_break_and_resume(self):
+        store = MemoryCursorStore()
+        received = []
+        for op in self.chain.ops(start=10, stop=20, cursor=Cursor("test", store=store)):
+            received.append((op["block_num"], op["op"][1]["i"]))
+            if len(received) == 3:
+                break
+        # The operation the loop was left at is handed out again
+        for op in self.chain.ops(start=10, stop=11, cursor=Cursor("test", store=store)):
+            received.append((op["block_num"], op["op"][1]["i"]))
+        self.assertEqual(received, [(10, 0), (10, 1), (11, 0), (11, 0), (11, 1)])
+
+        # unless it has been acknowledged
+        store = MemoryCursorStore()
+        cursor = Cursor("test", store=store)
+        for op in self.chain.ops(start=10, stop=20, cursor=cursor):
+            if op["block_num"] == 11:
+                cursor.ack()
+                break
+        self.assertEqual(store.load("test"), (11, 1))
+
+        # Until stored, a crash hands out operations again
+        cursor = Cursor("test", store=store, commit_every=1000)
+        ops = self.chain.ops(stop=20, cursor=cursor)
+        self.assertEqual(next(ops)["block_num"], 11)
+        self.assertEqual(next(ops)["block_num"], 12)
+        self.assertEqual(cursor.block_num, 12)
+        self.assertEqual(store.load("test"), (11, 1))
+
+    def test_cursor_handler_raises(self):
+        store = MemoryCursorStore()
+
+        def consume():
+            for op in self.chain.ops(start=10, stop=20, cursor=Cursor("test", store=store)):
+                if (op["block_num"], op["op"][1]["i"]) == (11, 0):
+                    raise ValueError("handler failed")
+
+        with self.assertRaises(ValueError):
+            consume()
+        # The failed operation is handed out again
+        self.assertEqual(store.load("test"), (11, 0))
+        ops = self.chain.ops(stop=20, cursor=Cursor("test", store=store))
+        op = next(ops)
+        self.assertEqual((op["block_num"], op["op"][1]["i"]), (11, 0))
+        ops.close()
+
+    def test_operation_ids(self):
+        self.assertEqual(getOperationNameForId(0), "transfer")
+        self.assertEqual(
+            getOperationNameForId(operations["bet_matched"]), "bet_matched")
+        self.assertEqual(getOperationNameForId(1000), "Unknown Operation ID 1000")
+        self.assertEqual(
+            getOperationIdsForNames(["transfer", "foobar"]), {0})
+
+    def test_stream_filter(self):
+        ops = list(self.chain.stream(["bet_matched"], start=10, stop=12))
+        self.assertEqual([(x["block"], x["i"]) for x in ops], [(10, 1), (11, 1), (12, 1)])
+        self.assertEqual(set(x["type"] for x in ops), {"bet_matched"})
+
+        # Positions count all operations, including the skipped ones
+        store = MemoryCursorStore()
+        cursor = Cursor("test", store=store, commit_every=1)
+        ops = self.chain.stream(["transfer"], start=10, stop=12, cursor=cursor)
+        self.assertEqual(next(ops)["block"], 10)
+        self.assertEqual(next(ops)["block"], 11)
+        ops.close()
+        self.assertEqual(store.load("test"), (11, 0))
+
+    def test_block_headers(self):
+        rpc = self.peerplays.rpc
+        headers = list(self.chain.block_headers(start=1, stop=30, prefetch=20))
+        self.assertEqual([b["block_num"] for b in headers], list(range(1, 31)))
+        self.assertNotIn("transactions", headers[0])
+        self.assertNotIn("get_block", [x[0] for x in rpc.requests])
+
+        self.assertEqual(
+            self.chain.block_timestamp(7), rpc.block_time(7))
+        self.assertEqual(
+            self.chain.block_time(7), datetime.utcfromtimestamp(rpc.block_time(7)))
+        self.assertEqual(rpc.requests[-1], ("get_block_header", [7]))
+
+    def test_get_block_num_at(self):
+        rpc = self.peerplays.rpc
+        rpc.head = 100000
+        index = FakeTimestampIndex()
+        for block_num in [1, 2, 5, 6, 7, 7777, 99998, 99999, 100000]:
+            when = datetime.utcfromtimestamp(rpc.block_time(block_num))
+            self.assertEqual(self.chain.get_block_num_at(when, index=index), block_num)
+            # Between this block and the next one
+            when += timedelta(seconds=2)
+            self.assertEqual(self.chain.get_block_num_at(when, index=index), block_num)
+        self.assertEqual(self.chain.get_block_num_at(
+            datetime.utcfromtimestamp(rpc.block_time(100001)), index=index), 100000)
+        with self.assertRaises(ValueError):
+            self.chain.get_block_num_at(datetime(2017, 1, 1), index=index)
+
+        rpc.requests = []
+        self.assertEqual(self.chain.get_block_num_at(
+            formatTime(float(rpc.block_time(50000))), index=index), 50000)
+        self.assertLess(len([x for x in rpc.requests if x[0] == "get_block_header"]), 10)
+
+    def test_blockstore(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        rpc = self.peerplays.rpc
+        store = BlockStore(path, chain_id="00" * 32)
+        self.chain.blockstore = store
+
+        # Write-through of irreversible blocks only
+        rpc.head = 30
+        blocks = list(self.chain.blocks(start=1, stop=20, prefetch=8))
+        self.assertEqual(store.head, 20)
+        self.assertEqual(store.get(7), blocks[6])
+        self.assertIsNone(store.get(21))
+        with self.assertRaises(ValueError):
+            store.append(22, {})
+
+        # Read-through, without asking for the irreversible block again
+        rpc.requests = []
+        calls = []
+        info = self.chain.info
+        self.chain.info = lambda: calls.append(1) or info()
+        ops = list(self.chain.ops(start=15, stop=25))
+        del self.chain.info
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([op["op"][1]["block"] for op in ops[::2]], list(range(15, 26)))
+        self.assertEqual(
+            [x[1][0] for x in rpc.requests if x[0] == "get_block"], list(range(21, 26)))
+        self.assertEqual(store.head, 25)
+        # Operations renamed by ops() are stored unchanged
+        self.assertEqual(store.get(21)["transactions"][0]["operations"][0][0], 0)
+        self.assertEqual(list(store.verify()), [])
+        store.close()
+
+        # An interrupted write is dropped when opened again
+        with open(os.path.join(path, "blocks.idx"), "ab") as fp:
+            fp.write(index_entry.pack(10 ** 9, 10, 0)[:10])
+        store = BlockStore(path)
+        self.assertEqual(store.head, 25)
+        self.assertEqual(store.get(25)["block_num"], 25)
+
+        # Corruption is found and repaired
+        offset, length, _ = store.entry(10)
+        store.close()
+        with open(os.path.join(path, "blocks.dat"), "r+b") as fp:
+            fp.seek(offset + 2)
+            fp.write(b"\xff\xff")
+        store = BlockStore(path)
+        self.assertEqual([x[0] for x in store.verify()], [10])
+        with self.assertRaises(BlockStoreCorruptException):
+            store.get(10)
+        # Replays obtain the corrupt block from the node
+        self.chain.blockstore = store
+        rpc.requests = []
+        blocks = list(self.chain.block_range(9, 11, irreversible=30))
+        self.assertEqual([b["block_num"] for b in blocks], [9, 10, 11])
+        self.assertEqual(blocks[1]["transactions"][0]["operations"][0][1]["block"], 10)
+        self.assertEqual([x for x in rpc.requests if x[0] != "pipeline"], [("get_block", [10])])
+        store.truncate(10)
+        self.assertEqual(store.head, 9)
+        self.assertEqual(list(store.verify()), [])
+        store.close()
+
+        with self.assertRaises(ValueError):
+            BlockStore(path, chain_id="11" * 32)
+
+    def test_scan(self):
+        ops = list(self.chain.scan(1, 20, workers=2, chunk_size=3))
+        self.assertEqual(len(ops), 40)
+        self.assertEqual(
+            [(op["block_num"], op["op"][1]["i"]) for op in ops],
+            [(n, i) for n in range(1, 21) for i in range(2)])
+        self.assertEqual(
+            list(self.chain.scan(1, 20, function=second_ops, workers=2, chunk_size=3)),
+            list(range(1, 21)))
+        self.assertEqual(
+            sorted(self.chain.scan(
+                5, 20, function=second_ops, workers=3, chunk_size=2, ordered=False)),
+            list(range(5, 21)))
+
+        # Stopping early does not obtain the remaining chunks
+        ops = self.chain.scan(1, 2000, workers=2, chunk_size=10)
+        self.assertEqual(next(ops)["block_num"], 1)
+        start = time.time()
+        ops.close()
+        self.assertLess(time.time() - start, 1)
+
+    def test_reversible_blocks(self):
+        rpc = FakeForkRPC()
+        for num in range(1, 6):
+            rpc.produce(num, "a")
+        blocks = ReversibleBlocks(rpc, 1)
+
+        def events():
+            info = rpc.info()
+            return [
+                (action, block["block_num"], block["witness"])
+                for action, block in
+                blocks.update(info) + blocks.release(info["last_irreversible_block_num"])
+            ]
+
+        self.assertEqual(events(), [("apply", n, "a") for n in range(1, 6)])
+
+        # Blocks 4 and 5 are replaced by a longer fork
+        rpc.lib = 2
+        for num in range(4, 7):
+            rpc.produce(num, "b")
+        self.assertEqual(events(), [
+            ("undo", 5, "a"), ("undo", 4, "a"),
+            ("apply", 4, "b"), ("apply", 5, "b"), ("apply", 6, "b"),
+            ("irreversible", 1, "a"), ("irreversible", 2, "a"),
+        ])
+
+        # The head block is replaced at the same height
+        rpc.produce(6, "c")
+        self.assertEqual(events(), [("undo", 6, "b"), ("apply", 6, "c")])
+        self.assertEqual(events(), [])
+
+        # A shorter fork wins
+        rpc.produce(5, "d")
+        self.assertEqual(events(), [
+            ("undo", 6, "c"), ("undo", 5, "b"), ("apply", 5, "d")])
+
+        rpc.lib = 5
+        rpc.produce(6, "d")
+        self.assertEqual(events(), [
+            ("apply", 6, "d"),
+            ("irreversible", 3, "a"), ("irreversible", 4, "b"),
+            ("irreversible", 5, "d"),
+        ])
+
+    def test_head_blocks(self):
+        rpc = FakeForkRPC()
+        for num in range(1, 4):
+            rpc.produce(num, "a")
+        rpc.lib = 3
+        rpc.get_object = self.peerplays.rpc.get_object
+        rpc.get_dynamic_global_properties = rpc.info
+        self.peerplays.rpc = rpc
+        events = list(self.chain.head_blocks(start=1, stop=3))
+        self.assertEqual(
+            [(action, block["block_num"]) for action, block in events],
+            [("apply", 1), ("apply", 2), ("apply", 3),
+             ("irreversible", 1), ("irreversible", 2), ("irreversible", 3)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,504 @@
+import json
+import time
+import threading
+import unittest
+import collections
+import websocket
+from peerplaysapi.node import PeerPlaysNodeRPC
+from peerplaysbase.chains import known_chains
+from peerplaysapi.nodepool import NodePool
+from peerplaysapi.codec import get_codec, codecs
+from peerplaysapi.metrics import Metrics
+from peerplaysapi.cache import ResponseCache
+from peerplaysapi.pool import PooledNodeRPC
+from peerplaysapi.exceptions import PoolTimeout, UnhandledRPCError
+from peerplaysapi.ratelimit import RateLimiter, throttle_error
+from peerplaysapi.exceptions import NoMethodWithName
+
+
+class FakeNodeRPC(PeerPlaysNodeRPC):
+    """ PeerPlaysNodeRPC that answers calls locally instead of
+        connecting to a node
+    """
+    def __init__(self, *args, **kwargs):
+        self.requests = []
+        self.objects = {}
+        self.delay = kwargs.get("delay", 0)
+        super(FakeNodeRPC, self).__init__("ws://localhost:8090", **kwargs)
+
+    def wsconnect(self):
+        self.url = next(self.urls)
+        if not self.deferred:
+            self.requests.append(("connect", self.url))
+
+    def wsexec(self, payload):
+        if self.deferred:
+            self.connect()
+        _, method, args = payload["params"]
+        self.requests.append((method, args))
+        time.sleep(self.delay)
+        return self.answer(method, args)
+
+    def answer(self, method, args):
+        if method in ["database", "history", "network_broadcast"]:
+            return ["database", "history", "network_broadcast"].index(method) + 2
+        elif method == "get_chain_properties":
+            return {"chain_id": known_chains["PPY"]["chain_id"]}
+        elif method == "get_objects":
+            return [dict(self.objects.get(x, {"id": x})) for x in args[0]]
+        elif method == "get_block":
+            return {"block_num": args[0]}
+        elif method == "get_dynamic_global_properties":
+            return self.objects["2.1.0"]
+        elif method == "disconnect":
+            raise OSError("Connection reset")
+
+    def sendrecv_many(self, payloads):
+        self.requests.append(("pipeline", len(payloads)))
+        return {
+            payload["id"]: {"id": payload["id"], "result": self.wsexec(payload)}
+            for payload in payloads
+        }
+
+
+class FakeWebSocket(object):
+    """ Websocket that answers each request after the delay of the node
+        it was sent to
+    """
+    def __init__(self, rpc):
+        self.rpc = rpc
+        self.timeout = None
+        self.replies = collections.deque()
+        self.condition = threading.Condition()
+
+    def gettimeout(self):
+        return self.timeout
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def send(self, data):
+        payload = json.loads(data.decode("utf8"))
+        _, method, args = payload["params"]
+        self.rpc.requests.append((method, args))
+        reply = json.dumps({"id": payload["id"], "result": self.rpc.answer(method, args)})
+        with self.condition:
+            self.replies.append((time.time() + self.rpc.delay, reply))
+            self.condition.notify_all()
+
+    def recv(self):
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        with self.condition:
+            while True:
+                now = time.time()
+                if self.replies and self.replies[0][0] <= now:
+                    return self.replies.popleft()[1]
+                if deadline is not None and now >= deadline:
+                    raise websocket.WebSocketTimeoutException("timed out")
+                waits = [0.1]
+                if self.replies:
+                    waits.append(self.replies[0][0] - now)
+                if deadline is not None:
+                    waits.append(deadline - now)
+                self.condition.wait(max(0, min(waits)))
+
+    def close(self):
+        pass
+
+
+class SocketNodeRPC(FakeNodeRPC):
+    """ FakeNodeRPC that sends and receives the calls through a
+        :class:`FakeWebSocket`
+    """
+    wsexec = PeerPlaysNodeRPC.wsexec
+    sendrecv_many = PeerPlaysNodeRPC.sendrecv_many
+
+    def wsconnect(self):
+        super(SocketNodeRPC, self).wsconnect()
+        self.ws = FakeWebSocket(self)
+
+
+class FakePooledNodeRPC(PooledNodeRPC):
+    rpc_class = FakeNodeRPC
+
+
+class Testcases(unittest.TestCase):
+
+    def test_nodepool_prefers_fast_nodes(self):
+        pool = NodePool(["ws://a", "ws://b", "ws://c"])
+        pool.success("ws://a", rtt=0.5, head_block_number=100)
+        pool.success("ws://b", rtt=0.1, head_block_number=100)
+        pool.success("ws://c", rtt=0.2, head_block_number=100)
+        self.assertEqual(pool.best(), "ws://b")
+
+        # Failed nodes cool down
+        pool.failure("ws://b")
+        self.assertEqual(pool.best(), "ws://c")
+
+    def test_nodepool_evicts_lagging_nodes(self):
+        pool = NodePool(["ws://a", "ws://b"], max_lag=3)
+        pool.success("ws://a", rtt=0.1, head_block_number=90)
+        pool.success("ws://b", rtt=0.5, head_block_number=100)
+        self.assertFalse(pool.healthy("ws://a"))
+        self.assertEqual(pool.best(), "ws://b")
+
+    def test_nodepool_failed_probe(self):
+        pool = NodePool(["ws://a", "ws://b"], max_lag=3, cooldown=0)
+        pool.success("ws://a", rtt=0.1, head_block_number=100)
+        pool.success("ws://b", rtt=0.5, head_block_number=90)
+        # A failed probe marks the node unreachable, beyond the cooldown
+        pool.failure("ws://a", reachable=False)
+        self.assertFalse(pool.healthy("ws://a"))
+        # and its stale head no longer makes the other node lag
+        self.assertTrue(pool.healthy("ws://b"))
+        self.assertEqual(pool.head_block_number(), 90)
+        self.assertEqual(pool.best(), "ws://b")
+
+        # Reachable again after a successful probe
+        pool.success("ws://a", rtt=0.1, head_block_number=101)
+        self.assertTrue(pool.healthy("ws://a"))
+        self.assertEqual(pool.best(), "ws://a")
+
+        # Nodes whose head block is too old are lagging
+        pool = NodePool(["ws://a", "ws://b"], max_lag=3, block_interval=3)
+        pool.success("ws://a", head_block_number=100, head_block_time="2019-01-01T00:00:00")
+        pool.success("ws://b", head_block_number=100, head_block_time=time.strftime(
+            "%Y-%m-%dT%H:%M:%S", time.gmtime()))
+        self.assertFalse(pool.healthy("ws://a"))
+        self.assertTrue(pool.healthy("ws://b"))
+
+        # Unprobed nodes are not considered lagging
+        pool = NodePool(["ws://a", "ws://b"])
+        pool.success("ws://b", head_block_number=100)
+        self.assertTrue(pool.healthy("ws://a"))
+
+    def test_nodepool_all_unhealthy(self):
+        pool = NodePool(["ws://a", "ws://b"])
+        pool.failure("ws://a")
+        time.sleep(0.01)
+        pool.failure("ws://b")
+        self.assertTrue(pool.all_unhealthy())
+        # Least recently failed node is handed out
+        self.assertEqual(pool.best(), "ws://a")
+
+    def test_codecs(self):
+        for codec in codecs:
+            codec = codec()
+            data = {"a": [1, "ü", None], "b": 2 ** 70}
+            self.assertEqual(codec.loads(codec.dumps(data)), data)
+            # control characters are accepted in replies
+            self.assertEqual(codec.loads('{"a": "x\ny"}'), {"a": "x\ny"})
+        self.assertEqual(get_codec("json").name, "json")
+        with self.assertRaises(ValueError):
+            get_codec("foobar")
+
+    def test_metrics(self):
+        metrics = Metrics(buckets=[0.1, 1])
+        metrics.observe_call("get_objects", 0.05)
+        metrics.observe_call("get_objects", 0.5)
+        metrics.observe_call("foobar", 2, error=NoMethodWithName())
+        metrics.observe_bytes("ws://a", sent=10, received=100)
+        metrics.set_gauge("ping_rtt_seconds", 0.2, node="ws://a")
+        stats = metrics.stats()
+        self.assertEqual(stats["calls"], {"get_objects": 2, "foobar": 1})
+        self.assertEqual(stats["errors"], {"foobar": {"NoMethodWithName": 1}})
+        self.assertEqual(
+            stats["latency"]["get_objects"]["buckets"],
+            {0.1: 1, 1: 2, "+Inf": 2})
+        self.assertEqual(metrics.quantile(0.5, "get_objects"), 0.1)
+        self.assertEqual(metrics.quantile(0.9), float("inf"))
+
+        text = metrics.prometheus()
+        self.assertIn('peerplays_rpc_calls_total{method="get_objects"} 2', text)
+        self.assertIn(
+            'peerplays_rpc_latency_seconds_bucket{le="+Inf",method="get_objects"} 2',
+            text)
+        self.assertIn(
+            'peerplays_rpc_errors_total{error="NoMethodWithName",method="foobar"} 1',
+            text)
+        self.assertIn('peerplays_rpc_received_bytes_total{node="ws://a"} 100', text)
+        self.assertIn('peerplays_rpc_ping_rtt_seconds{node="ws://a"} 0.2', text)
+
+    def test_batch(self):
+        rpc = FakeNodeRPC()
+        rpc.requests = []
+        with rpc.batch() as batch:
+            futures = [batch.add("1.21.%d" % i) for i in range(5)]
+            futures.append(batch.add("1.2.0"))
+            futures.append(batch.add("1.21.0"))
+            # Lookups outside of the batch return objects right away
+            self.assertEqual(rpc.get_object("1.21.8"), {"id": "1.21.8"})
+            self.assertEqual(rpc.get_account("1.2.1"), {"id": "1.2.1"})
+            rpc.requests = []
+        self.assertEqual(rpc.requests, [
+            ("get_objects", [["1.21.0", "1.21.1", "1.21.2", "1.21.3", "1.21.4", "1.2.0"]])
+        ])
+        self.assertEqual(futures[0].result(), {"id": "1.21.0"})
+        self.assertEqual(futures[-1].result(), {"id": "1.21.0"})
+        self.assertEqual(futures[-2].result(), {"id": "1.2.0"})
+
+    def test_batch_window(self):
+        rpc = FakeNodeRPC(batch_window=0.05)
+        rpc.requests = []
+        results = {}
+
+        def lookup(id):
+            results[id] = rpc.get_object(id)
+
+        threads = [
+            threading.Thread(target=lookup, args=("1.21.%d" % i,))
+            for i in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(rpc.requests), 1)
+        self.assertEqual(results["1.21.7"], {"id": "1.21.7"})
+
+    def test_cache(self):
+        rpc = FakeNodeRPC(cache=True)
+        self.assertEqual(rpc.stats()["cache"]["misses"]["get_chain_properties"], 1)
+        rpc.get_network()
+        self.assertEqual(rpc.stats()["cache"]["hits"]["get_chain_properties"], 1)
+
+        # Only irreversible blocks are cached
+        rpc.objects["2.1.0"] = {
+            "id": "2.1.0", "head_block_number": 20,
+            "last_irreversible_block_num": 10}
+        rpc.get_dynamic_global_properties()
+        rpc.requests = []
+        block = rpc.get_block(10)
+        block["witness"] = "1.6.1"
+        self.assertEqual(rpc.get_block(10), {"block_num": 10})
+        rpc.get_block(11)
+        rpc.get_block(11)
+        self.assertEqual(rpc.requests, [
+            ("get_block", [10]), ("get_block", [11]), ("get_block", [11])])
+
+        # Only settled/canceled betting markets are cached, per object
+        rpc.objects["1.21.1"] = {"id": "1.21.1", "status": "settled"}
+        rpc.objects["1.21.2"] = {"id": "1.21.2", "status": "unresolved"}
+        rpc.requests = []
+        rpc.get_objects(["1.21.1", "1.21.2"])
+        objects = rpc.get_objects(["1.21.2", "1.21.1"])
+        self.assertEqual(objects[1]["status"], "settled")
+        self.assertEqual(rpc.requests, [
+            ("get_objects", [["1.21.1", "1.21.2"]]),
+            ("get_objects", [["1.21.2"]])])
+
+    def test_cache_policies(self):
+        cache = ResponseCache(
+            policies={"get_objects_by_block": {"policy": "block"}},
+            max_bytes=100)
+        calls = []
+
+        def fetch(args):
+            calls.append(args)
+            return ["x" * 30]
+
+        cache.call("get_objects_by_block", [1], fetch)
+        cache.call("get_objects_by_block", [1], fetch)
+        self.assertEqual(len(calls), 1)
+        # A new head block invalidates
+        cache.observe("get_dynamic_global_properties", [], {"head_block_number": 5})
+        cache.call("get_objects_by_block", [1], fetch)
+        self.assertEqual(len(calls), 2)
+        # The memory bound evicts the least recently used entries
+        for i in range(2, 6):
+            cache.call("get_objects_by_block", [i], fetch)
+        self.assertLessEqual(cache.stats()["bytes"], 100)
+        self.assertGreater(cache.stats()["evictions"], 0)
+        cache.call("get_objects_by_block", [5], fetch)
+        self.assertEqual(len(calls), 6)
+
+    def test_pool(self):
+        rpc = FakePooledNodeRPC(["ws://a", "ws://b"], pool_size=2)
+        used = set()
+
+        def lookup(id):
+            with rpc.connection() as conn:
+                used.add(conn)
+                time.sleep(0.01)
+                conn.get_objects([id])
+
+        threads = [
+            threading.Thread(target=lookup, args=("1.21.%d" % i,))
+            for i in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(used), 2)
+        self.assertEqual(rpc.get_objects(["1.21.1"]), [{"id": "1.21.1"}])
+        self.assertEqual(rpc.stats()["pool"]["idle"], 2)
+        self.assertEqual(rpc.stats()["calls"]["get_objects"], 9)
+
+    def test_pool_timeout_and_recycling(self):
+        rpc = FakePooledNodeRPC("ws://a", pool_size=1)
+        with rpc.connection():
+            with self.assertRaises(PoolTimeout):
+                rpc.checkout(timeout=0.01)
+        with self.assertRaises(OSError):
+            rpc.disconnect()
+        stats = rpc.stats()["pool"]
+        self.assertEqual(stats["recycled"], 1)
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertEqual(stats["size"], 0)
+        # A new connection replaces the broken one
+        self.assertEqual(rpc.get_object("1.21.1"), {"id": "1.21.1"})
+        self.assertEqual(rpc.stats()["pool"]["size"], 1)
+
+    def test_pool_open_logs_url(self):
+        rpc = FakePooledNodeRPC(["ws://a", "ws://b"], lazy=True)
+        with self.assertLogs("peerplaysapi.pool", level="DEBUG") as logs:
+            conn = rpc.open()
+        self.assertFalse(conn.deferred)
+        self.assertEqual(logs.output, [
+            "DEBUG:peerplaysapi.pool:Opened pooled connection to ws://localhost:8090"])
+
+    def test_lazy_connect(self):
+        params = []
+        rpc = FakeNodeRPC(
+            lazy=True,
+            chain_params=known_chains["PPY"],
+            network_callback=params.append)
+        self.assertEqual(rpc.chain_params["prefix"], "PPY")
+        self.assertEqual(rpc.requests, [])
+
+        rpc.get_objects(["2.1.0"])
+        rpc.verify_thread.join()
+        self.assertEqual(rpc.requests[0], ("connect", "ws://localhost:8090"))
+        self.assertIn(("get_chain_properties", []), rpc.requests)
+        self.assertTrue(rpc.verified)
+        self.assertEqual(params, [])
+
+        # Wrong chain parameters are replaced
+        rpc = FakeNodeRPC(
+            lazy=True,
+            chain_params=dict(known_chains["PPY"], chain_id="00" * 32),
+            network_callback=params.append)
+        rpc.get_objects(["2.1.0"])
+        rpc.verify_thread.join()
+        self.assertEqual(rpc.chain_params, known_chains["PPY"])
+        self.assertEqual(params, [known_chains["PPY"]])
+
+    def test_lazy_api_registration(self):
+        rpc = FakeNodeRPC()
+        self.assertEqual(rpc.api_id, {})
+        rpc.requests = []
+        rpc.broadcast_transaction({}, api="network_broadcast")
+        rpc.broadcast_transaction({}, api="network_broadcast")
+        self.assertEqual([x[0] for x in rpc.requests], [
+            "network_broadcast", "broadcast_transaction", "broadcast_transaction"])
+        self.assertEqual(rpc.api_id, {"network_broadcast": 4})
+
+    def test_hedge(self):
+        rpc = SocketNodeRPC(hedge=True, hedge_delay=0.01, rate_limit=True)
+        rpc.delay = 0.2
+        start = time.time()
+        self.assertEqual(rpc.get_objects(["1.21.1"]), [{"id": "1.21.1"}])
+        self.assertLess(time.time() - start, 0.2)
+        counters = rpc.stats()["counters"]
+        self.assertEqual(counters["hedges_total"], {None: 1})
+        self.assertEqual(counters["hedges_won_total"], {None: 1})
+        self.assertEqual(rpc.hedge_rpc.requests[-1], ("get_objects", [["1.21.1"]]))
+        self.assertIs(rpc.hedge_rpc.limiter, rpc.limiter)
+        # Hedges are measured apart from the calls they race, and the
+        # call the hedge won is not measured at all
+        stats = rpc.stats()
+        self.assertNotIn("get_objects", stats["calls"])
+        self.assertEqual(stats["errors"], {})
+        self.assertEqual(stats["hedge"]["calls"]["get_objects"], 1)
+
+        # The connection is kept and the late reply is dropped
+        rpc.delay = 0
+        time.sleep(0.2)
+        self.assertEqual(rpc.get_objects(["1.21.2"]), [{"id": "1.21.2"}])
+        self.assertEqual(rpc.stale, set())
+        self.assertEqual(rpc.stats()["counters"]["hedges_total"], {None: 1})
+        self.assertEqual(
+            [x for x in rpc.requests if x[0] == "connect"],
+            [("connect", "ws://localhost:8090")])
+
+        # Broadcasts are never hedged
+        rpc.broadcast_transaction({}, api="network_broadcast")
+        self.assertEqual(rpc.stats()["counters"]["hedges_total"], {None: 1})
+
+    def test_hedge_slow_method(self):
+        rpc = SocketNodeRPC(hedge=True, hedge_delay=0.01)
+        # The quantile falls into the +Inf bucket
+        for i in range(5):
+            rpc.metrics.observe_call("get_objects", 12)
+        rpc.delay = 0.2
+        self.assertEqual(rpc.get_objects(["1.21.1"]), [{"id": "1.21.1"}])
+        self.assertEqual(rpc.stats()["counters"]["hedges_total"], {None: 1})
+
+    def test_ratelimit_aimd(self):
+        limiter = RateLimiter(rate=10, concurrency=4, cooldown=0)
+        limiter.acquire("ws://a")
+        limiter.release("ws://a", "get_block", 0.1)
+        self.assertAlmostEqual(limiter.stats()["ws://a"]["rate"], 10.1)
+        # Errors reported by the node are no congestion signal ...
+        limiter.release("ws://a", "get_block", 0.1, UnhandledRPCError("unknown block"))
+        self.assertAlmostEqual(limiter.stats()["ws://a"]["rate"], 10.1)
+        # ... unless the node throttles us
+        limiter.release("ws://a", "get_block", 0.1, UnhandledRPCError("Too many requests"))
+        self.assertAlmostEqual(limiter.stats()["ws://a"]["rate"], 5.05)
+        limiter.release("ws://a", error=OSError())
+        self.assertAlmostEqual(limiter.stats()["ws://a"]["rate"], 2.525)
+        # Slow replies hold the limits
+        limiter.release("ws://a", "get_block", 1.0)
+        self.assertAlmostEqual(limiter.stats()["ws://a"]["rate"], 2.525)
+        self.assertEqual(limiter.stats()["ws://a"]["decreases"], 2)
+
+    def test_ratelimit_baseline_decays(self):
+        limiter = RateLimiter(rate=10, baseline_decay=0.1)
+        # One unusually fast reply ...
+        limiter.release("ws://a", "get_block", 0.001)
+        limiter.release("ws://a", "get_block", 0.1)
+        increases = limiter.stats()["ws://a"]["increases"]
+        self.assertEqual(increases, 1)
+        # ... holds the limits only until the baseline has caught up
+        for i in range(20):
+            limiter.release("ws://a", "get_block", 0.1)
+        self.assertGreater(limiter.stats()["ws://a"]["increases"], 10)
+        self.assertEqual(limiter.stats()["ws://a"]["decreases"], 0)
+
+    def test_throttle_error(self):
+        self.assertIsNone(throttle_error('{"id":1,"jsonrpc":"2.0","result":"Too many"}'))
+        self.assertIsNone(throttle_error(
+            '{"id":1,"jsonrpc":"2.0","error":{"message":"unknown block"}}'))
+        error = throttle_error(
+            b'{"id":1,"jsonrpc":"2.0","error":{"message":"Too many requests"}}')
+        self.assertIn("Too many", str(error))
+
+    def test_ratelimit_waits(self):
+        limiter = RateLimiter(rate=20, concurrency=1)
+        start = time.time()
+        for i in range(4):
+            limiter.acquire("ws://a", wait=False)
+            limiter.release("ws://a")
+        self.assertLess(time.time() - start, 0.1)
+        for i in range(4):
+            limiter.acquire("ws://b")
+            limiter.release("ws://b")
+        self.assertGreaterEqual(time.time() - start, 0.14)
+
+        # Only one request in flight
+        limiter = RateLimiter(rate=100, concurrency=1)
+        limiter.acquire("ws://a")
+        acquired = threading.Event()
+
+        def acquire():
+            limiter.acquire("ws://a")
+            acquired.set()
+        threading.Thread(target=acquire).start()
+        self.assertFalse(acquired.wait(0.05))
+        limiter.release("ws://a")
+        self.assertTrue(acquired.wait(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
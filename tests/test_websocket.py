@@ -0,0 +1,370 @@
+import json
+import time
+import asyncio
+import threading
+import unittest
+from peerplaysapi.websocket import PeerPlaysWebsocket, SubscriptionMatcher
+from peerplaysapi.dispatch import Dispatcher
+from peerplaysapi.metrics import byte_size
+from peerplaysapi.nodepool import NodePool
+from peerplaysapi.exceptions import (
+    RPCError,
+    ConnectionClosed,
+    NoMethodWithName
+)
+
+try:
+    # Requires the optional websockets package
+    from peerplaysapi.asyncnode import AsyncPeerPlaysNodeRPC
+except ImportError:
+    AsyncPeerPlaysNodeRPC = None
+
+
+class FakeSocket(object):
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(json.loads(data.decode("utf8")))
+
+    def close(self):
+        self.closed = True
+
+
+class Testcases(unittest.TestCase):
+
+    def setUp(self):
+        self.ws = PeerPlaysWebsocket("ws://localhost:8090")
+        self.ws.url = "ws://localhost:8090"
+        self.ws.ws = FakeSocket()
+
+    def reply(self, **kwargs):
+        self.ws.on_message(self.ws.ws, json.dumps(kwargs))
+
+    def test_pipelined_requests(self):
+        f1 = self.ws.get_objects(["1.2.0"])
+        f2 = self.ws.get_objects(["1.2.1"])
+        ids = [x["id"] for x in self.ws.ws.sent]
+        self.assertEqual(len(set(ids)), 2)
+        self.assertFalse(f1.done() or f2.done())
+
+        # Replies may arrive out of order
+        self.reply(id=ids[1], result=["second"])
+        self.reply(id=ids[0], result=["first"])
+        self.assertEqual(f1.result(timeout=1), ["first"])
+        self.assertEqual(f2.result(timeout=1), ["second"])
+        self.assertEqual(self.ws.stats()["calls"], {"get_objects": 2})
+
+    def test_bytes_received(self):
+        f = self.ws.get_objects(["1.2.0"])
+        reply = json.dumps(
+            {"id": self.ws.ws.sent[0]["id"], "result": ["\u20ac"]}, ensure_ascii=False)
+        self.ws.on_message(self.ws.ws, reply)
+        self.assertEqual(f.result(timeout=1), ["\u20ac"])
+        self.assertEqual(
+            self.ws.stats()["bytes_received"]["ws://localhost:8090"],
+            len(reply) + 2)
+        self.assertEqual(byte_size("abc"), 3)
+        self.assertEqual(byte_size(b"abc"), 3)
+
+    def test_error_reply(self):
+        f = self.ws.get_objects(["1.2.0"])
+        self.reply(
+            id=self.ws.ws.sent[0]["id"],
+            error={"message": "assert failed"})
+        with self.assertRaises(RPCError):
+            f.result(timeout=1)
+
+    def test_close_cancels_requests(self):
+        f = self.ws.get_objects(["1.2.0"])
+        self.ws.on_close(self.ws.ws)
+        with self.assertRaises(ConnectionClosed):
+            f.result(timeout=1)
+
+    def test_dispatch_workers(self):
+        ws = PeerPlaysWebsocket(
+            "ws://localhost:8090",
+            objects=["1.21.x"],
+            dispatch_workers=2)
+        received = []
+        done = threading.Event()
+
+        def on_object(notice):
+            received.append(notice["n"])
+            if len(received) == 50:
+                done.set()
+        ws.on_object += on_object
+        for n in range(50):
+            ws.process_notice({"id": "1.21.1", "n": n})
+        self.assertTrue(done.wait(5))
+        self.assertEqual(received, list(range(50)))
+        ws.dispatcher.stop()
+        self.assertEqual(ws.dispatcher.stats()["dispatched"], 50)
+
+    def test_coalesce_per_block(self):
+        ws = PeerPlaysWebsocket(
+            "ws://localhost:8090",
+            objects=["1.21.x"],
+            coalesce_window="block")
+        received = []
+        ws.on_object += received.append
+        self.ws = ws
+        for n in range(3):
+            self.reply(method="notice", params=[1, [
+                {"id": "1.21.1", "n": n},
+                {"id": "1.21.2", "n": n}]])
+        self.assertEqual(received, [])
+        self.reply(method="notice", params=[2, ["0062f19d"]])
+        self.assertEqual(received, [
+            {"id": "1.21.1", "n": 2},
+            {"id": "1.21.2", "n": 2}])
+        self.assertEqual(ws.coalescer.stats()["superseded"], 4)
+
+    def test_close_before_connecting(self):
+        # Closed before the connection is opened
+        self.ws.close()
+        self.ws.ws = FakeSocket()
+        self.ws.on_open(self.ws.ws)
+        self.assertTrue(self.ws.ws.closed)
+        self.assertEqual(self.ws.ws.sent, [])
+
+        # Closed before run_forever is entered
+        ws = PeerPlaysWebsocket("ws://localhost:8090")
+        ws.close()
+        thread = threading.Thread(target=ws.run_forever)
+        thread.start()
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+        self.assertIsNone(ws.ws)
+
+    def test_close_stops_threads(self):
+        ws = PeerPlaysWebsocket(
+            "ws://localhost:8090",
+            objects=["1.21.x"],
+            dispatch_workers=2,
+            coalesce_window=0.01)
+        received = []
+        ws.on_object += received.append
+        ws.process_notice({"id": "1.21.1", "n": 1})
+        ws.close()
+        for thread in ws.dispatcher.threads + [ws.coalescer.thread]:
+            thread.join(1)
+            self.assertFalse(thread.is_alive())
+        # Pending notices are delivered before the threads end
+        self.assertEqual(received, [{"id": "1.21.1", "n": 1}])
+
+    def test_subscription_matcher(self):
+        matcher = SubscriptionMatcher(["1.21.5", "1.22.x"])
+        self.assertIn("1.21.5", matcher)
+        self.assertIn("1.22.123", matcher)
+        self.assertNotIn("1.21.6", matcher)
+        self.assertNotIn("1.2.22", matcher)
+        matcher.remove(["1.22.x"])
+        self.assertNotIn("1.22.123", matcher)
+        self.assertEqual(list(matcher), ["1.21.5"])
+        with self.assertRaises(ValueError):
+            matcher.add(["1.21"])
+
+    def test_runtime_subscriptions(self):
+        received = []
+        self.ws.on_object += received.append
+        self.ws.process_notice({"id": "1.21.1"})
+        self.ws.subscribe_objects(["1.21.1"])
+        self.ws.process_notice({"id": "1.21.1"})
+        self.ws.unsubscribe_objects(["1.21.1"])
+        self.ws.process_notice({"id": "1.21.1"})
+        self.assertEqual(received, [{"id": "1.21.1"}])
+
+    def test_backfill_missed_blocks(self):
+        def block_id(num):
+            return "%08x" % num + "ab" * 16
+
+        def block_notice(num):
+            self.reply(method="notice", params=[2, [block_id(num)]])
+
+        received = []
+        self.ws.on_block += received.append
+        block_notice(10)
+        block_notice(14)
+        # live notices are held back while backfilling
+        block_notice(15)
+        for _ in range(100):
+            if len(self.ws.ws.sent) == 3:
+                break
+            time.sleep(0.01)
+        thread = self.ws.backfill_thread
+        for request in self.ws.ws.sent:
+            num = request["params"][2][0]
+            self.reply(id=request["id"], result={"previous": block_id(num - 1)})
+        thread.join(5)
+        self.assertEqual(
+            [int(x[:8], 16) for x in received],
+            [10, 11, 12, 13, 14, 15])
+
+    def test_keepalive(self):
+        self.ws.keep_alive = 0.01
+        self.ws.ping_timeout = 0.05
+        self.ws.on_open(self.ws.ws)
+        keepalive = self.ws.keepalive
+        # Reconnecting does not start another keepalive thread
+        self.ws.on_close(self.ws.ws)
+        self.ws.on_open(self.ws.ws)
+        self.assertIs(self.ws.keepalive, keepalive)
+
+        # Pings are never answered, so the connection is closed
+        for _ in range(100):
+            if getattr(self.ws.ws, "closed", False):
+                break
+            time.sleep(0.01)
+        self.assertTrue(self.ws.ws.closed)
+        self.assertGreater(self.ws.ping_timeouts, 0)
+
+        self.ws.close()
+        keepalive.join(1)
+        self.assertFalse(keepalive.is_alive())
+
+    def test_keepalive_lagging(self):
+        self.ws.urls = NodePool(["ws://localhost:8090", "ws://other:8090"])
+        self.ws.keep_alive = 0.01
+        self.ws.on_open(self.ws.ws)
+        # The node answers pings with a head block of the past
+        answered = set()
+        for _ in range(100):
+            if getattr(self.ws.ws, "closed", False):
+                break
+            for request in list(self.ws.ws.sent):
+                if request["params"][1:] == ["get_objects", [["2.1.0"]]] and (
+                        request["id"] not in answered):
+                    answered.add(request["id"])
+                    self.reply(id=request["id"], result=[{
+                        "head_block_number": 100, "time": "2019-01-01T00:00:00"}])
+            time.sleep(0.01)
+        self.ws.close()
+        self.assertTrue(self.ws.ws.closed)
+        self.assertFalse(self.ws.urls.healthy("ws://localhost:8090"))
+        self.assertEqual(self.ws.urls.best(), "ws://other:8090")
+
+
+class DispatcherTestcases(unittest.TestCase):
+
+    def stalled(self, policy):
+        dispatcher = Dispatcher(workers=1, maxsize=2, policy=policy)
+        release = threading.Event()
+        received = []
+        dispatcher.submit("block", lambda x: release.wait(5), None)
+        while dispatcher.depth():
+            pass
+        return dispatcher, release, received
+
+    def test_drop_oldest(self):
+        dispatcher, release, received = self.stalled("drop_oldest")
+        for n in range(4):
+            dispatcher.submit("1.21.1", received.append, n, coalesce=True)
+        self.assertEqual(dispatcher.stats()["dropped"], 2)
+        release.set()
+        dispatcher.stop()
+        self.assertEqual(received, [2, 3])
+
+    def test_coalesce(self):
+        dispatcher, release, received = self.stalled("coalesce")
+        dispatcher.submit("1.21.1", received.append, 0, coalesce=True)
+        dispatcher.submit("1.21.2", received.append, 1, coalesce=True)
+        dispatcher.submit("1.21.1", received.append, 2, coalesce=True)
+        stats = dispatcher.stats()
+        self.assertEqual(stats["coalesced"], 1)
+        self.assertEqual(stats["depth"], 2)
+        release.set()
+        dispatcher.stop()
+        self.assertEqual(received, [2, 1])
+
+
+class AsyncFakeSocket(FakeSocket):
+
+    async def send(self, data):
+        self.sent.append(json.loads(data))
+
+
+class DroppingSocket(AsyncFakeSocket):
+    """ Answers every call, but drops the connection on API registration
+    """
+    def __init__(self, rpc):
+        super(DroppingSocket, self).__init__()
+        self.rpc = rpc
+
+    async def send(self, data):
+        payload = json.loads(data)
+        if payload["params"][1] == "database":
+            self.rpc.ws = None
+            raise ConnectionClosed()
+        asyncio.get_event_loop().call_soon(
+            self.rpc.process_message,
+            json.dumps({"id": payload["id"], "result": True}))
+
+
+@unittest.skipUnless(AsyncPeerPlaysNodeRPC, "websockets is not installed")
+class AsyncTestcases(unittest.TestCase):
+
+    def setUp(self):
+        self.rpc = AsyncPeerPlaysNodeRPC("ws://localhost:8090")
+        self.rpc.ws = AsyncFakeSocket()
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def reply(self, **kwargs):
+        self.rpc.process_message(json.dumps(kwargs))
+
+    def test_concurrent_calls(self):
+        async def run():
+            t1 = asyncio.ensure_future(self.rpc.get_objects(["1.2.0"]))
+            t2 = asyncio.ensure_future(self.rpc.foobar())
+            await asyncio.sleep(0)
+            ids = [x["id"] for x in self.rpc.ws.sent]
+            self.reply(id=ids[1], error={"message": "no method with name 'foobar'"})
+            self.reply(id=ids[0], result=["first"])
+            self.assertEqual(await t1, ["first"])
+            with self.assertRaises(NoMethodWithName):
+                await t2
+        self.loop.run_until_complete(run())
+
+    def test_notice_stream(self):
+        async def run():
+            stream = self.rpc.notices("on_block")
+            t = asyncio.ensure_future(stream.__anext__())
+            await asyncio.sleep(0)
+            sent = self.rpc.ws.sent[0]
+            self.assertEqual(sent["params"][1], "set_block_applied_callback")
+            self.reply(id=sent["id"], result=None)
+            self.rpc.process_message(json.dumps({
+                "method": "notice",
+                "params": [self.rpc.__events__.index("on_block"), ["00abcd"]]
+            }))
+            self.assertEqual(await t, "00abcd")
+            stream.close()
+            with self.assertRaises(StopAsyncIteration):
+                await stream.__anext__()
+        self.loop.run_until_complete(run())
+
+    def test_connection_lost_during_handshake(self):
+        async def wsconnect():
+            self.rpc.ws = DroppingSocket(self.rpc)
+
+        async def run():
+            self.rpc.ws = None
+            self.rpc.wsconnect = wsconnect
+            with self.assertRaises(ConnectionClosed):
+                await asyncio.wait_for(self.rpc.connect(), 2)
+        self.loop.run_until_complete(run())
+
+    def test_subscribe_requires_args(self):
+        async def run():
+            with self.assertRaises(ValueError):
+                await self.rpc.subscribe(self.rpc.notices("on_account"))
+            self.assertEqual(self.rpc.ws.sent, [])
+        self.loop.run_until_complete(run())
+
+
+if __name__ == '__main__':
+    unittest.main()